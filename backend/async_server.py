@@ -0,0 +1,346 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs
+
+from respuestas import negociar, acepta_gzip, nuevo_compresor_gzip, JsonArrayStream, evento_sse, last_event_id
+from respuestas import SSE_HEARTBEAT, SSE_WRITE_TIMEOUT, HEARTBEAT_SSE
+from metricas import REGISTRO, CONTENT_TYPE, JSON_DURACION, observar_request
+
+# Configuración
+EXECUTOR_WORKERS = 16       # Hilos para llamadas bloqueantes (SQLite); acotado a propósito
+IDLE_TIMEOUT = 30.0         # Segundos esperando el siguiente request en una conexión keep-alive
+READ_TIMEOUT = 10.0         # Segundos para recibir headers y cuerpo una vez llegada la línea de request
+MAX_BODY = 1024 * 1024      # 1 MB máximo por cuerpo JSON
+MAX_HEADERS = 100           # Headers por request; más que esto se responde 431
+SSE_MAX_PENDIENTES = 100    # Eventos en espera por cliente SSE; luego se descartan los más viejos
+SSE_MAX = 500               # Streams SSE simultáneos; luego 503 + Retry-After
+RETRY_AFTER = 1             # Segundos sugeridos al cliente en las respuestas 503
+
+CORS_HEADERS = [
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type'),
+]
+
+
+class _RequestInvalido(Exception):
+    """Request que no se puede atender: se responde con 'status' y se cierra la conexión."""
+
+    def __init__(self, status: int, mensaje: str):
+        super().__init__(mensaje)
+        self.status = status
+        self.mensaje = mensaje
+
+
+class _ColaAsyncio:
+    """
+    Adaptador entre el broker (que reparte desde su propio hilo con put())
+    y una asyncio.Queue del event loop. Cada cliente SSE inactivo cuesta solo
+    esta cola y una corrutina suspendida, no un hilo. Acotada: si el cliente no
+    da abasto se descarta el evento más viejo (misma política que ColaSuscriptor).
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_pendientes: int = SSE_MAX_PENDIENTES):
+        self._loop = loop
+        self._q = asyncio.Queue(maxsize=max_pendientes)
+        self.descartados = 0
+
+    def put(self, msg) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._agregar, msg)
+        except RuntimeError:
+            pass  # El loop ya se cerró
+
+    def _agregar(self, msg) -> None:
+        if self._q.full():
+            self._q.get_nowait()
+            self.descartados += 1
+        self._q.put_nowait(msg)
+
+    async def get(self):
+        return await self._q.get()
+
+
+class AsyncHospitalServer:
+    """
+    Servidor HTTP/SSE basado en asyncio (solo stdlib).
+    Sirve las mismas rutas que HospitalHTTPHandler: el frontend, /api/notificaciones
+    y todo lo demás delegado a 'procesar_api', que corre en un executor acotado.
+    """
+
+    def __init__(self, procesar_api, frontend, broker, json_default=None,
+                 max_workers: int = EXECUTOR_WORKERS, ruta_metricas=None, max_sse: int = SSE_MAX):
+        self.procesar_api = procesar_api
+        self.max_sse = max_sse
+        self._sse_activos = 0  # Solo lo toca el event loop: sin lock
+        # (metodo, path) -> plantilla para la etiqueta 'route' de las métricas (None = desconocida)
+        self.ruta_metricas = ruta_metricas or (lambda metodo, path: None)
+        self.frontend = frontend
+        self.broker = broker
+        self.json_default = json_default
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="api")
+
+    # --- Escritura de respuestas ---
+    def _escribir(self, writer, status: int, headers, cuerpo: bytes = b'', keep_alive: bool = False) -> int:
+        lineas = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+        for clave, valor in headers:
+            lineas.append(f"{clave}: {valor}")
+        if status != 304:
+            lineas.append(f"Content-Length: {len(cuerpo)}")
+        lineas.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        writer.write(("\r\n".join(lineas) + "\r\n\r\n").encode('latin-1') + cuerpo)
+        return status
+
+    def _escribir_negociado(self, writer, request, status: int, headers, cuerpo: bytes,
+                            keep_alive: bool, etag=None, cuerpo_gzip=None) -> int:
+        """Igual que _escribir, pero con ETag / If-None-Match y gzip (ver respuestas.py). Devuelve el status final."""
+        metodo, req_headers = request[0], request[3]
+        status, extra, cuerpo = negociar(
+            metodo, status, cuerpo,
+            req_headers.get('if-none-match'), req_headers.get('accept-encoding'),
+            etag, cuerpo_gzip
+        )
+        return self._escribir(writer, status, headers + extra, cuerpo, keep_alive)
+
+    def _escribir_json(self, writer, request, status: int, data, keep_alive: bool) -> int:
+        # Las respuestas cacheadas ya llegan serializadas
+        if isinstance(data, bytes):
+            cuerpo = data
+        else:
+            inicio = time.perf_counter()
+            cuerpo = json.dumps(data, default=self.json_default).encode('utf-8')
+            JSON_DURACION.observar(time.perf_counter() - inicio)
+        headers = [('Content-type', 'application/json')] + CORS_HEADERS
+        return self._escribir_negociado(writer, request, status, headers, cuerpo, keep_alive)
+
+    async def _escribir_stream(self, writer, request, status: int, stream, keep_alive: bool) -> bool:
+        """
+        Escribe un JsonArrayStream por bloques; el cursor de SQLite se consume en
+        el executor. Devuelve False si la conexión debe cerrarse al terminar.
+        """
+        loop = asyncio.get_running_loop()
+        bloques = iter(stream)
+        try:
+            primero = await loop.run_in_executor(self._executor, next, bloques)
+        except Exception as e:
+            await loop.run_in_executor(self._executor, bloques.close)
+            self._escribir_json(writer, request, 500, {"error": str(e)}, keep_alive)
+            return keep_alive
+
+        version, req_headers = request[2], request[3]
+        chunked = version == 'HTTP/1.1'
+        gz = acepta_gzip(req_headers.get('accept-encoding'))
+        headers = [('Content-type', 'application/json')] + CORS_HEADERS + [('Vary', 'Accept-Encoding')]
+        if gz:
+            headers.append(('Content-Encoding', 'gzip'))
+        headers.append(('Transfer-Encoding', 'chunked') if chunked else ('Connection', 'close'))
+        if chunked and keep_alive:
+            headers.append(('Connection', 'keep-alive'))
+        writer.write((f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                      + "".join(f"{k}: {v}\r\n" for k, v in headers) + "\r\n").encode('latin-1'))
+
+        compresor = nuevo_compresor_gzip() if gz else None
+
+        def enviar(datos: bytes):
+            if datos:
+                writer.write(b'%x\r\n' % len(datos) + datos + b'\r\n' if chunked else datos)
+
+        try:
+            bloque = primero
+            while bloque is not None:
+                enviar(compresor.compress(bloque) if compresor else bloque)
+                await writer.drain()
+                bloque = await loop.run_in_executor(self._executor, next, bloques, None)
+            if compresor:
+                enviar(compresor.flush())
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+        finally:
+            await loop.run_in_executor(self._executor, bloques.close)
+        return chunked and keep_alive
+
+    # --- Lectura del request ---
+    async def _leer_request(self, reader):
+        """
+        (metodo, target, version, headers, cuerpo), o None si el cliente cerró.
+        Lanza _RequestInvalido con el status a responder (400, 408, 413, 414, 431).
+        La línea de request puede tardar IDLE_TIMEOUT (keep-alive ocioso); headers y
+        cuerpo, juntos, READ_TIMEOUT: un cliente que manda de a un byte o anuncia un
+        cuerpo que nunca envía (slowloris) no retiene la conexión ni sus buffers.
+        """
+        try:
+            linea = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+        except ValueError:
+            raise _RequestInvalido(414, "Linea de request demasiado larga")
+        if not linea:
+            return None
+        partes = linea.decode('latin-1').rstrip('\r\n').split(' ')
+        if len(partes) != 3 or not partes[2].startswith('HTTP/'):
+            raise _RequestInvalido(400, "Request mal formado")
+        metodo, target, version = partes
+        try:
+            headers, cuerpo = await asyncio.wait_for(self._leer_headers_y_cuerpo(reader), READ_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise _RequestInvalido(408, "Tiempo agotado recibiendo el request")
+        return metodo, target, version, headers, cuerpo
+
+    async def _leer_headers_y_cuerpo(self, reader):
+        headers = {}
+        for _ in range(MAX_HEADERS + 1):
+            try:
+                linea = await reader.readline()
+            except ValueError:
+                raise _RequestInvalido(431, "Header demasiado largo")
+            if linea in (b'\r\n', b'\n', b''):
+                break
+            clave, separador, valor = linea.decode('latin-1').partition(':')
+            if not separador or not clave.strip():
+                raise _RequestInvalido(400, "Header mal formado")
+            headers[clave.strip().lower()] = valor.strip()
+        else:
+            raise _RequestInvalido(431, "Demasiados headers")
+        try:
+            largo = int(headers.get('content-length') or 0)
+        except ValueError:
+            largo = -1
+        if largo < 0:
+            raise _RequestInvalido(400, "Content-Length invalido")
+        if largo > MAX_BODY:
+            raise _RequestInvalido(413, "Cuerpo demasiado grande")
+        cuerpo = await reader.readexactly(largo) if largo else b''
+        return headers, cuerpo
+
+    # --- Conexión ---
+    async def _atender(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request = await self._leer_request(reader)
+                except _RequestInvalido as e:
+                    # No sabemos dónde empieza el próximo request: responder y cerrar
+                    cuerpo = json.dumps({"error": e.mensaje}).encode('utf-8')
+                    self._escribir(writer, e.status, [('Content-type', 'application/json')] + CORS_HEADERS, cuerpo)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                metodo, target, version, headers, cuerpo = request
+                inicio = time.perf_counter()
+                conexion = headers.get('connection', '').lower()
+                keep_alive = conexion == 'keep-alive' if version == 'HTTP/1.0' else conexion != 'close'
+
+                path, _, query = target.partition('?')
+                path = path.rstrip('/')
+
+                if metodo == 'OPTIONS':
+                    status = self._escribir(writer, 200, CORS_HEADERS, keep_alive=keep_alive)
+
+                elif metodo == 'GET' and path in ('', '/index.html'):
+                    try:
+                        contenido, contenido_gzip, etag = self.frontend.obtener()
+                        status = self._escribir_negociado(writer, request, 200, [('Content-type', 'text/html')],
+                                                          contenido, keep_alive, etag, contenido_gzip)
+                    except FileNotFoundError:
+                        status = self._escribir_json(writer, request, 404, {"error": "Error: No se encuentra frontend/index.html"}, keep_alive)
+
+                elif metodo == 'GET' and path == '/api/metrics':
+                    status = self._escribir_negociado(writer, request, 200, [('Content-type', CONTENT_TYPE)],
+                                                      REGISTRO.exportar(), keep_alive)
+
+                elif metodo == 'GET' and path == '/api/notificaciones':
+                    query_params = parse_qs(query)
+                    medico_id = query_params.get('medico_id', [None])[0]
+                    if not medico_id:
+                        status = self._escribir_json(writer, request, 400, {"error": "Falta medico_id"}, keep_alive)
+                    elif not medico_id.isdigit():
+                        status = self._escribir_json(writer, request, 400, {"error": "medico_id invalido"}, keep_alive)
+                    elif self._sse_activos >= self.max_sse:
+                        # Cupo de streams: cada uno retiene una cola y buffers aunque no ocupe hilos
+                        cuerpo = json.dumps({"error": "Demasiadas conexiones de notificaciones, "
+                                                      "reintente en unos segundos"}).encode('utf-8')
+                        status = self._escribir(writer, 503, [('Content-type', 'application/json'),
+                                                              ('Retry-After', str(RETRY_AFTER))] + CORS_HEADERS,
+                                                cuerpo, keep_alive)
+                    else:
+                        # El stream ocupa la conexión hasta que el cliente se va
+                        desde_id = last_event_id(headers.get('last-event-id'), query_params)
+                        self._sse_activos += 1
+                        try:
+                            await self._stream_sse(reader, writer, int(medico_id), desde_id)
+                        finally:
+                            self._sse_activos -= 1
+                        break
+
+                else:
+                    status, data = await loop.run_in_executor(
+                        self._executor, self.procesar_api, metodo, path, query, cuerpo)
+                    if isinstance(data, JsonArrayStream):
+                        keep_alive = await self._escribir_stream(writer, request, status, data, keep_alive)
+                    else:
+                        status = self._escribir_json(writer, request, status, data, keep_alive)
+
+                await writer.drain()
+                observar_request(metodo, self.ruta_metricas(metodo, path), status, time.perf_counter() - inicio)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _stream_sse(self, reader, writer, medico_id: int, desde_id=None):
+        headers = [
+            ('Content-Type', 'text/event-stream'),
+            ('Cache-Control', 'no-cache'),
+            ('Connection', 'keep-alive'),
+            ('Access-Control-Allow-Origin', '*'),
+        ]
+        writer.write(("HTTP/1.1 200 OK\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers) + "\r\n").encode('latin-1'))
+        await writer.drain()
+
+        cola = _ColaAsyncio(asyncio.get_running_loop())
+        self.broker.suscribir(medico_id, cola, desde_id)
+        # Un cliente SSE no envía nada más: si read() retorna, cerró la conexión
+        desconexion = asyncio.ensure_future(reader.read())
+        siguiente = None
+        try:
+            while True:
+                siguiente = siguiente or asyncio.ensure_future(cola.get())
+                hecho, _ = await asyncio.wait({siguiente, desconexion}, timeout=SSE_HEARTBEAT,
+                                              return_when=asyncio.FIRST_COMPLETED)
+                if desconexion in hecho:
+                    break
+                if siguiente in hecho:
+                    writer.write(evento_sse(siguiente.result()))
+                    siguiente = None
+                else:
+                    writer.write(HEARTBEAT_SSE)
+                # Cliente que no lee: el buffer del transporte no baja y vence el timeout
+                await asyncio.wait_for(writer.drain(), SSE_WRITE_TIMEOUT)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            if siguiente:
+                siguiente.cancel()
+            desconexion.cancel()
+            self.broker.desuscribir(medico_id, cola)
+
+    async def serve(self, port: int):
+        server = await asyncio.start_server(self._atender, host="", port=port, backlog=1024)
+        print(f"🚀 Servidor Real-Time (asyncio) corriendo en: http://localhost:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def run_async_server(port, procesar_api, frontend, broker, json_default=None, al_cerrar=None, ruta_metricas=None,
+                     max_sse: int = SSE_MAX):
+    servidor = AsyncHospitalServer(procesar_api, frontend, broker, json_default, ruta_metricas=ruta_metricas,
+                                   max_sse=max_sse)
+    try:
+        asyncio.run(servidor.serve(port))
+    except KeyboardInterrupt:
+        (al_cerrar or broker.cerrar)()
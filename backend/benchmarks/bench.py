@@ -0,0 +1,325 @@
+"""
+Benchmark de la API (latencia p50/p99 y req/s) contra el servidor real por loopback.
+
+Uso (desde backend/):
+    python -m benchmarks.bench                          # corrida rápida
+    python -m benchmarks.bench --guardar v1             # guarda benchmarks/baselines/v1.json
+    python -m benchmarks.bench --comparar v1            # compara contra esa línea base
+
+La base se siembra en un archivo temporal (nunca en hospital.db, salvo --db).
+RabbitMQ se reemplaza por InMemoryMessageBroker: se mide HTTP + SQLite.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+ESPECIALIDADES = ["Cardiología", "Pediatría", "Traumatología", "Dermatología", "Clínica", "Neurología"]
+INICIO_AGENDA = date(2030, 1, 7)  # Lunes; fechas futuras fijas para que las corridas sean comparables
+
+
+# --- Datos ---
+def sembrar(medicos: int, dias: int, turnos: int, semilla: int = 42) -> dict:
+    """Inserta médicos, agenda (8:00-16:00, cada 30 min, lunes a viernes) y turnos."""
+    from data.database import DatabaseConfig
+    DatabaseConfig.initialize_db()
+    rnd = random.Random(semilla)
+    with DatabaseConfig.connection() as conn:
+        conn.executemany(
+            "INSERT INTO medicos (nombre, apellido, especialidad) VALUES (?, ?, ?)",
+            [(f"Medico{i}", f"Bench{i}", ESPECIALIDADES[i % len(ESPECIALIDADES)]) for i in range(medicos)])
+        ids = [r[0] for r in conn.execute("SELECT id FROM medicos ORDER BY id")]
+        fechas = []
+        for d in range(dias):
+            dia = INICIO_AGENDA + timedelta(days=d)
+            if dia.weekday() < 5:
+                base = datetime.combine(dia, datetime.min.time()).replace(hour=8)
+                fechas.extend(base + timedelta(minutes=30 * k) for k in range(16))
+        conn.executemany(
+            "INSERT INTO disponibilidad (medico_id, fecha_hora, estado) VALUES (?, ?, 'DISPONIBLE')",
+            ((m, f.isoformat()) for m in ids for f in fechas))
+
+        # Turnos: slots al azar, un paciente distinto por turno (sin choques)
+        elegidos = rnd.sample(range(len(ids) * len(fechas)), min(turnos, len(ids) * len(fechas)))
+        filas = [(ids[i // len(fechas)], f"Paciente{n}", "Seed", fechas[i % len(fechas)].isoformat())
+                 for n, i in enumerate(elegidos)]
+        conn.executemany(
+            "INSERT INTO turnos (medico_id, paciente_nombre, paciente_apellido, fecha_hora, estado) "
+            "VALUES (?, ?, ?, ?, 'CONFIRMADO')", filas)
+        conn.executemany(
+            "UPDATE disponibilidad SET estado = 'RESERVADO' WHERE medico_id = ? AND fecha_hora = ?",
+            ((m, f) for m, _, _, f in filas))
+        conn.commit()
+    return {"medico_ids": ids, "fechas": fechas, "reservados": {(m, f) for m, _, _, f in filas}}
+
+
+def iniciar_servidor(modo: str) -> int:
+    """Importa main (ya con la base sembrada) y levanta el servidor en un puerto libre."""
+    import main
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        puerto = s.getsockname()[1]
+    if modo == 'asyncio':
+        import asyncio
+        from async_server import AsyncHospitalServer
+        servidor = AsyncHospitalServer(main.procesar_api, main.frontend, main.broker, main.json_serial)
+        threading.Thread(target=lambda: asyncio.run(servidor.serve(puerto)), daemon=True).start()
+    else:
+        main.HospitalHTTPHandler.log_message = lambda *args: None  # Sin log por request
+        httpd = main.PoolHTTPServer(("127.0.0.1", puerto), main.HospitalHTTPHandler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    for _ in range(50):
+        try:
+            socket.create_connection(("127.0.0.1", puerto), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return puerto
+
+
+# --- Medición ---
+def percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p * (len(ordenados) - 1))))]
+
+
+def resumen(latencias, duracion: float, errores: int, estados: dict) -> dict:
+    return {
+        "peticiones": len(latencias),
+        "req_s": round(len(latencias) / duracion, 1) if duracion else 0.0,
+        "p50_ms": round(percentil(latencias, 0.50) * 1000, 3),
+        "p99_ms": round(percentil(latencias, 0.99) * 1000, 3),
+        "errores": errores,
+        "status": {str(k): v for k, v in sorted(estados.items())},
+    }
+
+
+def correr(puerto: int, peticiones, concurrencia: int) -> dict:
+    """
+    Ejecuta la lista de (metodo, path, cuerpo) repartida entre 'concurrencia' hilos.
+    Cada hilo reutiliza su conexión cuando el servidor lo permite.
+    """
+    latencias, estados, errores = [], {}, [0]
+    lock = threading.Lock()
+    local = threading.local()
+
+    def una(peticion):
+        metodo, path, cuerpo = peticion
+        conn = getattr(local, 'conn', None) or http.client.HTTPConnection("127.0.0.1", puerto, timeout=30)
+        local.conn = conn
+        inicio = time.perf_counter()
+        try:
+            conn.request(metodo, path, body=cuerpo, headers={"Content-Type": "application/json"})
+            respuesta = conn.getresponse()
+            respuesta.read()
+            status = respuesta.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            local.conn = None
+            with lock:
+                errores[0] += 1
+            return
+        fin = time.perf_counter()
+        with lock:
+            latencias.append(fin - inicio)
+            estados[status] = estados.get(status, 0) + 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        list(pool.map(una, peticiones))
+    return resumen(latencias, time.perf_counter() - inicio, errores[0], estados)
+
+
+def escenario_sse(puerto: int, medico_id: int, fechas, clientes: int, eventos: int) -> dict:
+    """
+    'clientes' conexiones SSE al mismo médico; se agendan 'eventos' turnos y se mide
+    cuánto tarda cada notificación en llegar a cada cliente (incluye el relay del outbox).
+    """
+    enviados = {}
+    recibidos = []
+    lock = threading.Lock()
+    listos = threading.Barrier(clientes + 1)
+
+    def cliente():
+        sock = socket.create_connection(("127.0.0.1", puerto))
+        sock.sendall(f"GET /api/notificaciones?medico_id={medico_id} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+        sock.settimeout(10)
+        archivo = sock.makefile('rb')
+        while archivo.readline() not in (b'\r\n', b''):
+            pass  # Headers
+        listos.wait()
+        vistos = 0
+        try:
+            while vistos < eventos:
+                linea = archivo.readline()
+                if not linea:
+                    break
+                if linea.startswith(b'data: '):
+                    llegada = time.perf_counter()
+                    fecha = json.loads(linea[6:])['fecha']
+                    with lock:
+                        recibidos.append(llegada - enviados.get(fecha, llegada))
+                    vistos += 1
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+    hilos = [threading.Thread(target=cliente, daemon=True) for _ in range(clientes)]
+    for h in hilos:
+        h.start()
+    listos.wait()
+    time.sleep(0.2)  # Que las suscripciones queden registradas del lado del servidor
+
+    inicio = time.perf_counter()
+    for n, fecha in enumerate(fechas[:eventos]):
+        conn = http.client.HTTPConnection("127.0.0.1", puerto, timeout=30)
+        enviados[fecha.isoformat()] = time.perf_counter()
+        conn.request("POST", "/api/turnos", body=json.dumps({
+            "medico_id": medico_id, "fecha_hora": fecha.isoformat(),
+            "paciente_nombre": f"SSE{n}", "paciente_apellido": "Bench"}))
+        conn.getresponse().read()
+        conn.close()
+    for h in hilos:
+        h.join(15)
+    duracion = time.perf_counter() - inicio
+    resultado = resumen(recibidos, duracion, clientes * eventos - len(recibidos), {})
+    resultado.pop("status")
+    resultado["clientes"] = clientes
+    resultado["entregas_s"] = resultado.pop("req_s")
+    return resultado
+
+
+def ejecutar(args) -> dict:
+    datos = sembrar(args.medicos, args.dias, args.turnos)
+    puerto = iniciar_servidor(args.modo)
+    rnd = random.Random(7)
+    medicos, fechas, reservados = datos["medico_ids"], datos["fechas"], datos["reservados"]
+    n = args.peticiones
+    resultados = {}
+
+    print(f"⏱️  [BENCH] {len(medicos)} médicos, {len(medicos) * len(fechas)} horarios, "
+          f"{len(reservados)} turnos; servidor {args.modo} en :{puerto}")
+
+    resultados["GET /api/disponibilidad"] = correr(puerto, [
+        ("GET", f"/api/disponibilidad?medico_id={rnd.choice(medicos)}", None) for _ in range(n)], args.concurrencia)
+
+    resultados["GET /api/disponibilidad (filtrada)"] = correr(puerto, [
+        ("GET", f"/api/disponibilidad?medico_id={rnd.choice(medicos)}&estado=DISPONIBLE"
+                f"&desde={rnd.choice(fechas).isoformat()}&limit=50", None) for _ in range(n)], args.concurrencia)
+
+    # Reservas sobre horarios libres (uno distinto por petición; algún 409 por carrera es esperable)
+    medico_sse = medicos[-1]
+    libres = [(m, f.isoformat()) for m in medicos if m != medico_sse for f in fechas
+              if (m, f.isoformat()) not in reservados]
+    reservas = rnd.sample(libres, min(n, len(libres)))
+    resultados["POST /api/turnos"] = correr(puerto, [
+        ("POST", "/api/turnos", json.dumps({"medico_id": m, "fecha_hora": f,
+                                            "paciente_nombre": f"Bench{i}", "paciente_apellido": "Post"}))
+        for i, (m, f) in enumerate(reservas)], args.concurrencia)
+
+    from data.database import DatabaseConfig
+    with DatabaseConfig.connection() as conn:
+        creados = [r[0] for r in conn.execute(
+            "SELECT id FROM turnos WHERE paciente_apellido = 'Post' AND estado != 'ANULADO'")]
+    resultados["DELETE /api/turnos/{id}"] = correr(puerto, [
+        ("DELETE", f"/api/turnos/{turno_id}", None) for turno_id in creados], args.concurrencia)
+
+    libres_sse = [f for f in fechas if (medico_sse, f.isoformat()) not in reservados]
+    resultados["SSE fan-out"] = escenario_sse(puerto, medico_sse, libres_sse, args.sse_clientes, args.sse_eventos)
+    return resultados
+
+
+# --- Líneas base ---
+def metadatos(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "fecha": datetime.now().isoformat(timespec='seconds'),
+        "commit": commit,
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "parametros": {k: v for k, v in vars(args).items() if k not in ('guardar', 'comparar', 'db')},
+    }
+
+
+def imprimir(resultados: dict, base: dict = None, umbral: float = 0.10) -> bool:
+    """Tabla de resultados; con 'base' agrega la variación. Devuelve True si hay regresiones."""
+    regresion = False
+    print(f"\n{'escenario':38} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errores':>8}")
+    for nombre, r in resultados.items():
+        tasa = r.get("req_s", r.get("entregas_s"))
+        print(f"{nombre:38} {tasa:>10} {r['p50_ms']:>10} {r['p99_ms']:>10} {r['errores']:>8}")
+        anterior = (base or {}).get(nombre)
+        if not anterior:
+            continue
+        cambios = []
+        for clave, mayor_es_mejor in (("req_s", True), ("entregas_s", True), ("p50_ms", False), ("p99_ms", False)):
+            if clave not in r or not anterior.get(clave):
+                continue
+            delta = (r[clave] - anterior[clave]) / anterior[clave]
+            peor = delta < -umbral if mayor_es_mejor else delta > umbral
+            regresion |= peor
+            cambios.append(f"{clave} {delta:+.0%}{' ❌' if peor else ''}")
+        print(f"{'':38} {'  '.join(cambios)}")
+    return regresion
+
+
+def main_bench(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de la API del sistema hospitalario")
+    parser.add_argument("--medicos", type=int, default=50)
+    parser.add_argument("--dias", type=int, default=28, help="Días de agenda a sembrar (lunes a viernes)")
+    parser.add_argument("--turnos", type=int, default=5000)
+    parser.add_argument("--peticiones", type=int, default=2000, help="Peticiones por escenario HTTP")
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--sse-clientes", type=int, default=100)
+    parser.add_argument("--sse-eventos", type=int, default=20)
+    parser.add_argument("--modo", choices=("threading", "asyncio"), default="threading")
+    parser.add_argument("--db", help="Archivo SQLite a usar (por defecto uno temporal)")
+    parser.add_argument("--guardar", metavar="NOMBRE", help="Guardar resultados en baselines/NOMBRE.json")
+    parser.add_argument("--comparar", metavar="NOMBRE", help="Comparar contra baselines/NOMBRE.json")
+    parser.add_argument("--umbral", type=float, default=0.10, help="Variación tolerada antes de marcar regresión")
+    args = parser.parse_args(argv)
+
+    # Antes de importar main / data.database: la configuración se lee al importar
+    os.environ['HOSPITAL_BROKER'] = 'memoria'
+    os.environ['HOSPITAL_DB'] = args.db or os.path.join(tempfile.mkdtemp(prefix="bench_"), "hospital.db")
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(BACKEND_DIR)
+
+    resultados = ejecutar(args)
+
+    base = None
+    if args.comparar:
+        with open(os.path.join(BASELINES_DIR, f"{args.comparar}.json"), encoding='utf-8') as f:
+            base = json.load(f)["resultados"]
+    regresion = imprimir(resultados, base, args.umbral)
+
+    if args.guardar:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        destino = os.path.join(BASELINES_DIR, f"{args.guardar}.json")
+        with open(destino, "w", encoding='utf-8') as f:
+            json.dump({"meta": metadatos(args), "resultados": resultados}, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 [BENCH] Línea base guardada en {destino}")
+    return 1 if regresion else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_bench())
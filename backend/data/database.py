@@ -1,62 +1,252 @@
 import sqlite3
 import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from data.migrations import aplicar_migraciones, consultas_con_scan
 
 # --- CORRECCIÓN DE RUTA ---
 # Obtenemos la ruta absoluta del directorio donde está este archivo (backend/data)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-# Unimos esa ruta con el nombre del archivo. 
+# Unimos esa ruta con el nombre del archivo.
 # Resultado: .../tu_proyecto/backend/data/hospital.db
-DB_NAME = os.path.join(BASE_DIR, "hospital.db")
+# (HOSPITAL_DB permite apuntar a otro archivo, p. ej. uno compartido por los workers)
+DB_NAME = os.environ.get('HOSPITAL_DB', os.path.join(BASE_DIR, "hospital.db"))
+# Archivo histórico (turnos y horarios viejos, una tabla por mes). Se adjunta a cada
+# conexión como esquema 'archivo'. Por defecto: junto a DB_NAME, con sufijo '_archivo'.
+ARCHIVE_DB_NAME = os.environ.get('HOSPITAL_ARCHIVE_DB')
 
-class DatabaseConfig:
-    @staticmethod
-    def get_connection():
-        conn = sqlite3.connect(DB_NAME)
+# --- CONFIGURACIÓN DEL POOL ---
+POOL_SIZE = 10                      # Máximo de conexiones abiertas simultáneamente
+POOL_TIMEOUT = 5.0                  # Segundos esperando una conexión libre antes de fallar
+BUSY_TIMEOUT = 5.0                  # Segundos que SQLite espera por el lock de escritura
+MMAP_SIZE = 64 * 1024 * 1024        # 64 MB de lecturas mapeadas en memoria
+
+
+class ConnectionPool:
+    """
+    Pool acotado de conexiones SQLite reutilizables.
+
+    Los requests corren en hilos distintos (pool HTTP, executor asyncio, relay
+    del outbox) y hay más hilos que conexiones que valga la pena abrir, así que
+    mantenemos una pila (LIFO) de conexiones ya configuradas que los hilos
+    toman y devuelven. Las PRAGMAs (WAL, synchronous, mmap) se aplican una sola
+    vez por conexión, igual que el ATTACH del archivo histórico.
+    """
+
+    def __init__(self, db_path: str, max_size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT,
+                 archive_path: Optional[str] = None):
+        self.db_path = db_path
+        self.archive_path = archive_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._stats = {"acquired": 0, "reused": 0, "waits": 0, "timeouts": 0}
+
+    def _create_connection(self) -> sqlite3.Connection:
+        # check_same_thread=False: la conexión pasa de un hilo a otro, pero
+        # el pool garantiza que solo un hilo la usa a la vez.
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        if self.archive_path is not None:
+            conn.execute("ATTACH DATABASE ? AS archivo", (self.archive_path,))
+            conn.execute("PRAGMA archivo.journal_mode=WAL")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        # 1. Reutilizar una conexión ociosa si existe
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._in_use += 1
+                self._stats["acquired"] += 1
+                self._stats["reused"] += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        # 2. Crear una nueva si no alcanzamos el límite
+        with self._lock:
+            puede_crear = self._created < self.max_size
+            if puede_crear:
+                self._created += 1
+        if puede_crear:
+            try:
+                conn = self._create_connection()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            with self._lock:
+                self._in_use += 1
+                self._stats["acquired"] += 1
+            return conn
+
+        # 3. Pool agotado: esperar a que otro hilo devuelva una
+        with self._lock:
+            self._stats["waits"] += 1
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise TimeoutError("No hay conexiones disponibles en el pool de SQLite.")
+        with self._lock:
+            self._in_use += 1
+            self._stats["acquired"] += 1
+            self._stats["reused"] += 1
         return conn
 
+    def release(self, conn: sqlite3.Connection) -> None:
+        # Nunca devolvemos al pool una conexión con una transacción a medias
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put_nowait(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                **self._stats,
+            }
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+class DatabaseConfig:
+    _pool = None
+    _pool_lock = threading.Lock()
+    # Crear el archivo histórico si todavía no existe. Lo activan quienes archivan
+    # (main.py con HOSPITAL_ARCHIVO_INTERVALO > 0, la pasada manual); si no, solo se
+    # adjunta un archivo que ya exista (para seguir leyendo el histórico).
+    crear_archivo = False
+
+    @staticmethod
+    def get_pool() -> ConnectionPool:
+        if DatabaseConfig._pool is None:
+            with DatabaseConfig._pool_lock:
+                if DatabaseConfig._pool is None:
+                    archivo = DatabaseConfig.archive_path()
+                    if not (DatabaseConfig.crear_archivo or os.path.exists(archivo)):
+                        archivo = None
+                    DatabaseConfig._pool = ConnectionPool(DB_NAME, archive_path=archivo)
+        return DatabaseConfig._pool
+
+    @staticmethod
+    def archivo_adjunto() -> bool:
+        """True si las conexiones tienen el esquema 'archivo' (ver crear_archivo)."""
+        return DatabaseConfig.get_pool().archive_path is not None
+
+    @staticmethod
+    def archive_path() -> str:
+        if ARCHIVE_DB_NAME:
+            return ARCHIVE_DB_NAME
+        base, extension = os.path.splitext(DB_NAME)
+        return f"{base}_archivo{extension or '.db'}"
+
+    @staticmethod
+    def connection():
+        """
+        Context manager que presta una conexión del pool:
+            with DatabaseConfig.connection() as conn: ...
+        """
+        return DatabaseConfig.get_pool().connection()
+
+    @staticmethod
+    def pool_metrics() -> dict:
+        return DatabaseConfig.get_pool().metrics()
+
     @staticmethod
     def initialize_db():
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        
-        # 1. Tabla MÉDICOS
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS medicos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT NOT NULL,
-            apellido TEXT NOT NULL,
-            especialidad TEXT NOT NULL
-        );
-        """)
-
-        # 2. Tabla DISPONIBILIDAD
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS disponibilidad (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            medico_id INTEGER NOT NULL,
-            fecha_hora TEXT NOT NULL,
-            estado TEXT NOT NULL,
-            FOREIGN KEY(medico_id) REFERENCES medicos(id)
-        );
-        """)
-        
-        # 3. Tabla TURNOS
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS turnos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            medico_id INTEGER NOT NULL,
-            paciente_nombre TEXT NOT NULL,
-            paciente_apellido TEXT NOT NULL,
-            fecha_hora TEXT NOT NULL,
-            estado TEXT NOT NULL,
-            FOREIGN KEY(medico_id) REFERENCES medicos(id)
-        );
-        """)
-        
-        conn.commit()
-        conn.close()
-        print(f"Base de datos inicializada en: {DB_NAME}")
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+
+            # 1. Tabla MÉDICOS
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS medicos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nombre TEXT NOT NULL,
+                apellido TEXT NOT NULL,
+                especialidad TEXT NOT NULL
+            );
+            """)
+
+            # 2. Tabla DISPONIBILIDAD
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS disponibilidad (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                medico_id INTEGER NOT NULL,
+                fecha_hora TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                FOREIGN KEY(medico_id) REFERENCES medicos(id)
+            );
+            """)
+
+            # 3. Tabla TURNOS
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS turnos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                medico_id INTEGER NOT NULL,
+                paciente_nombre TEXT NOT NULL,
+                paciente_apellido TEXT NOT NULL,
+                fecha_hora TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                FOREIGN KEY(medico_id) REFERENCES medicos(id)
+            );
+            """)
+
+            conn.commit()
+
+            # 4. Índices y cambios de esquema versionados (PRAGMA user_version)
+            version = aplicar_migraciones(conn)
+        archivo = DatabaseConfig.archive_path() if DatabaseConfig.archivo_adjunto() else "sin archivo histórico"
+        print(f"Base de datos inicializada en: {DB_NAME} (esquema v{version}, archivo: {archivo})")
+
+    @staticmethod
+    def verificar_indices() -> dict:
+        """Consultas críticas cuyo plan hace SCAN completo. Vacío = todo indexado."""
+        # Conexión propia sin caché de sentencias: un EXPLAIN cacheado en una conexión
+        # del pool no se vuelve a planificar tras cambios de índices o un ANALYZE
+        conn = sqlite3.connect(DB_NAME, cached_statements=0)
+        try:
+            return consultas_con_scan(conn)
+        finally:
+            conn.close()
 
+# Ejecutar desde backend/:  python -m data.database
 if __name__ == "__main__":
-    DatabaseConfig.initialize_db()
\ No newline at end of file
+    DatabaseConfig.initialize_db()
+    problemas = DatabaseConfig.verificar_indices()
+    for nombre, detalles in problemas.items():
+        print(f"⚠️ [DB] {nombre} sin índice: {detalles}")
+    if not problemas:
+        print("✅ [DB] Todas las consultas críticas usan índices.")
@@ -0,0 +1,174 @@
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+# --- MIGRACIONES VERSIONADAS ---
+# La versión actual del esquema vive en 'PRAGMA user_version' (cabecera del archivo .db).
+# Cada migración se aplica una sola vez, en orden, dentro de su propia transacción.
+# Para agregar una nueva: añadir una tupla al final con el siguiente número.
+MIGRACIONES = [
+    (1, "Índices compuestos para calendario de médicos y búsqueda de pacientes", [
+        "CREATE INDEX IF NOT EXISTS idx_disponibilidad_medico_fecha ON disponibilidad (medico_id, fecha_hora)",
+        "CREATE INDEX IF NOT EXISTS idx_turnos_paciente_fecha ON turnos (paciente_apellido, paciente_nombre, fecha_hora)",
+    ]),
+    (2, "Índices únicos parciales sobre turnos activos (no anulados)", [
+        # REGLA: Un horario de un médico no puede tener más de un cliente
+        """CREATE UNIQUE INDEX IF NOT EXISTS ux_turnos_medico_fecha_activo
+           ON turnos (medico_id, fecha_hora) WHERE estado != 'ANULADO'""",
+        # REGLA: Un cliente no puede tener cita a la misma hora (aunque sea otro médico)
+        """CREATE UNIQUE INDEX IF NOT EXISTS ux_turnos_paciente_fecha_activo
+           ON turnos (paciente_apellido, paciente_nombre, fecha_hora) WHERE estado != 'ANULADO'""",
+    ]),
+    (3, "Horario único por médico en disponibilidad (duplicados detectados por SQLite)", [
+        # Limpieza previa: de cada par repetido se conserva el slot RESERVADO (o el más antiguo)
+        """DELETE FROM disponibilidad WHERE id NOT IN (
+               SELECT id FROM (
+                   SELECT id, ROW_NUMBER() OVER (
+                       PARTITION BY medico_id, fecha_hora
+                       ORDER BY estado = 'RESERVADO' DESC, id
+                   ) AS rn
+                   FROM disponibilidad
+               ) WHERE rn = 1
+           )""",
+        "DROP INDEX IF EXISTS idx_disponibilidad_medico_fecha",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_disponibilidad_medico_fecha ON disponibilidad (medico_id, fecha_hora)",
+    ]),
+    (4, "Outbox de eventos (se escribe en la misma transacción que el turno)", [
+        # disponible_desde: epoch en segundos. Al reclamar un lote se corre hacia
+        # adelante (lease); si el envío no se confirma, la fila vuelve a estar lista sola.
+        """CREATE TABLE IF NOT EXISTS outbox (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               topico TEXT NOT NULL,
+               payload TEXT NOT NULL,
+               creado_en TEXT NOT NULL,
+               intentos INTEGER NOT NULL DEFAULT 0,
+               disponible_desde REAL NOT NULL DEFAULT 0
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_disponible ON outbox (disponible_desde, id)",
+    ]),
+    (5, "Índice de médicos por especialidad (búsqueda de próximos horarios)", [
+        "CREATE INDEX IF NOT EXISTS idx_medicos_especialidad ON medicos (especialidad)",
+    ]),
+    (6, "Índices por fecha para mover filas viejas y cerradas al archivo histórico", [
+        "CREATE INDEX IF NOT EXISTS idx_turnos_fecha ON turnos (fecha_hora)",
+        "CREATE INDEX IF NOT EXISTS idx_disponibilidad_fecha ON disponibilidad (fecha_hora)",
+        # Parcial: solo los turnos cerrados, que se archivan aunque sean futuros
+        """CREATE INDEX IF NOT EXISTS idx_turnos_cerrados
+           ON turnos (fecha_hora) WHERE estado IN ('ANULADO', 'FINALIZADO')""",
+    ]),
+    (7, "Los turnos cerrados futuros ya no se archivan: sin índice parcial de cerrados", [
+        "DROP INDEX IF EXISTS idx_turnos_cerrados",
+    ]),
+]
+
+
+def version_actual(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def aplicar_migraciones(conn: sqlite3.Connection) -> int:
+    """
+    Aplica las migraciones pendientes y devuelve la versión final del esquema.
+    La versión se relee dentro de BEGIN IMMEDIATE para que dos procesos que
+    arrancan a la vez no apliquen la misma migración dos veces.
+    """
+    for numero, descripcion, sentencias in MIGRACIONES:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version_actual(conn) >= numero:
+                conn.rollback()
+                continue
+            for sql in sentencias:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {int(numero)}")
+            conn.commit()
+        except sqlite3.IntegrityError as e:
+            conn.rollback()
+            raise RuntimeError(f"La migración {numero} falló por datos inconsistentes: {e}") from e
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"🛠️ [DB] Migración {numero} aplicada: {descripcion}")
+    return version_actual(conn)
+
+
+# --- VERIFICACIÓN DE PLANES (EXPLAIN QUERY PLAN) ---
+def consultas_criticas() -> Dict[str, Tuple[str, tuple]]:
+    """
+    Las consultas calientes tal como las ejecutan los repositorios (constantes
+    SQL_* y constructores de data/repositories.py), con parámetros de ejemplo.
+    Si alguna deja de usar índice, 'consultas_con_scan' la reporta.
+    """
+    # Import diferido: data.repositories importa data.database, que importa este módulo
+    from data import repositories as repos
+    disponibilidad = repos.SqliteDisponibilidadRepository
+    turnos = repos.SqliteTurnosRepository
+    inicio, fin, cursor = datetime(2000, 1, 1), datetime(2000, 1, 8), datetime(2000, 1, 2)
+    fecha = inicio.isoformat()
+    return {
+        "disponibilidad.find_by_medico": disponibilidad._consulta_por_medico(
+            ["disponibilidad"], 1, None, None, None, None, None),
+        "disponibilidad.find_by_medico (rango + cursor)": disponibilidad._consulta_por_medico(
+            ["disponibilidad"], 1, inicio, fin, "DISPONIBLE", cursor, 50),
+        "disponibilidad.marcar_reservada": (repos.SQL_MARCAR_RESERVADA, (1, fecha)),
+        "disponibilidad.marcar_disponible": (repos.SQL_MARCAR_DISPONIBLE, (1, fecha)),
+        "turnos.reservar (tomar horario)": (repos.SQL_TOMAR_HORARIO, (1, fecha)),
+        "turnos.find_by_paciente": turnos._consulta_por_paciente(
+            ["turnos"], "Ana", "Perez", None, None, None, None, None, None, "*"),
+        "turnos.find_by_paciente (rango + cursor)": turnos._consulta_por_paciente(
+            ["turnos"], "Ana", "Perez", inicio, fin, None, cursor, 10, 50, "*"),
+        "turnos.existe_conflicto_paciente": (repos.SQL_CONFLICTO_PACIENTE, ("Ana", "Perez", fecha)),
+        "turnos.existe_conflicto_medico": (repos.SQL_CONFLICTO_MEDICO, (1, fecha)),
+        "medicos.find_by_especialidad": (repos.SQL_MEDICOS_POR_ESPECIALIDAD, ("Cardiología",)),
+        "archivo.turnos_vencidos": (repos.SQL_FILAS_VENCIDAS.format(tabla="turnos"), (fecha, 1000)),
+        "archivo.disponibilidad_vencida": (repos.SQL_FILAS_VENCIDAS.format(tabla="disponibilidad"), (fecha, 1000)),
+        "outbox.reclamar": (repos.SQL_OUTBOX_RECLAMAR, (0.0, 100)),
+    }
+
+
+def explicar_consultas(conn: sqlite3.Connection) -> Dict[str, List[str]]:
+    """
+    Devuelve, por consulta crítica, las líneas 'detail' de su EXPLAIN QUERY PLAN.
+    Usar una conexión sin caché de sentencias (cached_statements=0): sqlite3
+    reutiliza el EXPLAIN ya preparado aunque después cambien índices o estadísticas.
+    """
+    planes = {}
+    for nombre, (sql, params) in consultas_criticas().items():
+        filas = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        planes[nombre] = [fila[3] for fila in filas]
+    return planes
+
+
+# Tablas con menos filas que esto (según ANALYZE) se recorren completas a propósito
+FILAS_MINIMAS_SCAN = 1000
+
+
+def _filas_analizadas(conn: sqlite3.Connection, tabla: str):
+    """Filas de 'tabla' según sqlite_stat1 (primer número de 'stat'), o None si no hay estadísticas."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        return None
+    fila = conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1", (tabla,)).fetchone()
+    return int(fila[0].split()[0]) if fila else None
+
+
+def consultas_con_scan(conn: sqlite3.Connection) -> Dict[str, List[str]]:
+    """
+    Consultas críticas que recorren una tabla completa ('SCAN ...') o que
+    necesitan ordenar en un B-tree temporal. Un diccionario vacío es lo esperado.
+    Tras el ANALYZE del archivador el planificador elige SCAN en tablas de pocas
+    filas (FILAS_MINIMAS_SCAN) porque es lo más barato: esos casos no se reportan.
+    Sin estadísticas (base nueva) se reporta todo SCAN.
+    """
+    problemas = {}
+    for nombre, detalles in explicar_consultas(conn).items():
+        malos = []
+        for d in detalles:
+            if "TEMP B-TREE" in d:
+                malos.append(d)
+            elif d.startswith("SCAN"):
+                filas = _filas_analizadas(conn, d.split()[1])
+                if filas is None or filas >= FILAS_MINIMAS_SCAN:
+                    malos.append(d)
+        if malos:
+            problemas[nombre] = malos
+    return problemas
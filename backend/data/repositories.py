@@ -1,6 +1,9 @@
 import sqlite3
+import json
+import re
+import time
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 from datetime import datetime
 
 from data.database import DatabaseConfig
@@ -8,7 +11,205 @@ from data.database import DatabaseConfig
 # Estos modelos serán actualizados/creados en el próximo paso (Capa Logic)
 # Usamos 'import' dentro de los métodos o strings para evitar errores circulares por ahora
 # pero idealmente deberían estar arriba.
-from logic.models import Turno, Medico, Disponibilidad
+from logic.models import Turno, Medico, Disponibilidad, ResultadoReserva
+from metricas import instrumentar_repositorio
+
+def _filtros_rango(desde: Optional[datetime], hasta: Optional[datetime], estado: Optional[str]):
+    """Condiciones comunes de rango [desde, hasta) y estado para las consultas de calendario."""
+    condiciones, params = [], []
+    if desde is not None:
+        condiciones.append("fecha_hora >= ?")
+        params.append(desde.isoformat())
+    if hasta is not None:
+        condiciones.append("fecha_hora < ?")
+        params.append(hasta.isoformat())
+    if estado is not None:
+        condiciones.append("estado = ?")
+        params.append(estado)
+    return condiciones, params
+
+
+def _insertar_outbox(cursor: sqlite3.Cursor, evento: Optional[Tuple[str, dict]]) -> None:
+    """Agrega (topico, mensaje) al outbox usando la transacción abierta del cursor."""
+    if evento is None:
+        return
+    _insertar_outbox_lote(cursor, [evento])
+
+
+def _insertar_outbox_lote(cursor: sqlite3.Cursor, eventos: List[Tuple[str, dict]]) -> None:
+    """Varios eventos en un solo executemany (ids consecutivos: el relay los toma juntos)."""
+    creado_en = datetime.now().isoformat()
+    cursor.executemany(
+        "INSERT INTO outbox (topico, payload, creado_en) VALUES (?, ?, ?)",
+        [(topico, json.dumps(mensaje), creado_en) for topico, mensaje in eventos]
+    )
+
+
+# --- LISTADOS EN STREAMING ---
+LOTE_STREAM = 500  # Filas por consulta en los iter_*: una conexión del pool por lote
+
+
+def _iterar_por_lotes(leer_lote: Callable[[Optional[tuple], int], List[tuple]],
+                      limit: Optional[int] = None) -> Iterator[tuple]:
+    """
+    Recorre una consulta paginada por keyset: leer_lote(ultima_fila, tamanio) trae el
+    lote siguiente a 'ultima_fila' (None = el primero) con su propia conexión del pool.
+    Así un cliente lento que consume el stream no retiene una conexión ni un snapshot
+    de lectura (que frenaría los checkpoints del WAL) mientras se le escribe.
+    """
+    ultima, restantes = None, limit
+    while restantes is None or restantes > 0:
+        tamanio = LOTE_STREAM if restantes is None else min(LOTE_STREAM, restantes)
+        filas = leer_lote(ultima, tamanio)
+        yield from filas
+        if len(filas) < tamanio:
+            return
+        ultima = filas[-1]
+        if restantes is not None:
+            restantes -= len(filas)
+
+
+# --- PARTICIONES DEL ARCHIVO HISTÓRICO ---
+# Las filas viejas viven en el esquema adjunto 'archivo' (ver DatabaseConfig.archive_path),
+# una tabla por mes: turnos_2024_03, disponibilidad_2024_03, ...
+_NOMBRE_PARTICION = re.compile(r"\d{4}_\d{2}")
+
+
+def _particiones(conn: sqlite3.Connection, base: str) -> List[str]:
+    """Tablas mensuales del archivo para 'base', ordenadas por mes (ninguna si no hay archivo adjunto)."""
+    if not DatabaseConfig.archivo_adjunto():
+        return []
+    filas = conn.execute(
+        "SELECT name FROM archivo.sqlite_master WHERE type = 'table' AND name GLOB ?",
+        (f"{base}_[0-9][0-9][0-9][0-9]_[0-9][0-9]",)).fetchall()
+    return sorted(f[0] for f in filas)
+
+
+def _particion_de(conn: sqlite3.Connection, base: str, fecha: datetime) -> Optional[str]:
+    """Partición (con esquema) que guarda las filas de 'base' del mes de 'fecha', si existe."""
+    if not DatabaseConfig.archivo_adjunto():
+        return None
+    tabla = f"{base}_{fecha:%Y_%m}"
+    existe = conn.execute("SELECT 1 FROM archivo.sqlite_master WHERE type = 'table' AND name = ?",
+                          (tabla,)).fetchone()
+    return f"archivo.{tabla}" if existe else None
+
+
+def _turnos_archivados(conn: sqlite3.Connection, ids: List[int]) -> List[sqlite3.Row]:
+    """Filas de turnos ya archivados, buscadas por id (clave primaria) de la partición más nueva a la más vieja."""
+    faltan, filas = set(ids), []
+    for tabla in reversed(_particiones(conn, "turnos")):
+        if not faltan:
+            break
+        marcadores = ", ".join("?" * len(faltan))
+        encontradas = conn.execute(f"SELECT * FROM archivo.{tabla} WHERE id IN ({marcadores})",
+                                   list(faltan)).fetchall()
+        faltan.difference_update(r['id'] for r in encontradas)
+        filas.extend(encontradas)
+    return filas
+
+
+def _horarios_archivados(conn: sqlite3.Connection, medico_id: int, fechas: List[datetime]) -> Set[str]:
+    """
+    Fechas (ISO) de 'fechas' que el médico ya tiene en el archivo. Los índices únicos
+    de (medico_id, fecha_hora) solo cubren la tabla caliente: sin esto, un horario
+    archivado podría volver a cargarse (y reservarse) por segunda vez.
+    """
+    particiones = set(_particiones(conn, "disponibilidad"))
+    por_tabla: Dict[str, List[str]] = {}
+    for fecha in fechas:
+        tabla = f"disponibilidad_{fecha:%Y_%m}"
+        if tabla in particiones:
+            por_tabla.setdefault(tabla, []).append(fecha.isoformat())
+    archivadas = set()
+    for tabla, isos in por_tabla.items():
+        for inicio in range(0, len(isos), 500):
+            tramo = isos[inicio:inicio + 500]
+            filas = conn.execute(
+                f"SELECT fecha_hora FROM archivo.{tabla} WHERE medico_id = ? AND fecha_hora IN ({', '.join('?' * len(tramo))})",
+                (medico_id, *tramo))
+            archivadas.update(f[0] for f in filas)
+    return archivadas
+
+
+def _anular_fila(cursor: sqlite3.Cursor, turno: Turno) -> bool:
+    """
+    Turno ANULADO + slot DISPONIBLE dentro de la transacción abierta. Si el turno
+    ya se archivó, se anula en su partición del mes. False si ya estaba anulado.
+    """
+    fecha_str = turno.fecha_hora.isoformat()
+    cursor.execute("UPDATE turnos SET estado = 'ANULADO' WHERE id = ? AND estado != 'ANULADO'", (turno.id,))
+    if cursor.rowcount:
+        cursor.execute(SQL_MARCAR_DISPONIBLE, (turno.medico_id, fecha_str))
+        return True
+    tabla = _particion_de(cursor.connection, "turnos", turno.fecha_hora)
+    if tabla is None:
+        return False
+    cursor.execute(f"UPDATE {tabla} SET estado = 'ANULADO' WHERE id = ? AND estado != 'ANULADO'", (turno.id,))
+    if not cursor.rowcount:
+        return False
+    horarios = _particion_de(cursor.connection, "disponibilidad", turno.fecha_hora)
+    if horarios:
+        cursor.execute(f"UPDATE {horarios} SET estado = 'DISPONIBLE' WHERE medico_id = ? AND fecha_hora = ?",
+                       (turno.medico_id, fecha_str))
+    return True
+
+
+def _tablas_consulta(conn: sqlite3.Connection, base: str, historico: bool,
+                     desde: Optional[datetime], hasta: Optional[datetime]) -> List[str]:
+    """
+    Tablas que debe leer una consulta: solo la caliente, salvo que se pida el
+    histórico. En ese caso se suman las particiones de los meses que tocan [desde, hasta].
+    """
+    if not historico:
+        return [base]
+    primera = f"{base}_{desde:%Y_%m}" if desde is not None else None
+    ultima = f"{base}_{hasta:%Y_%m}" if hasta is not None else None
+    return [base] + [f"archivo.{t}" for t in _particiones(conn, base)
+                     if (primera is None or t >= primera) and (ultima is None or t <= ultima)]
+
+
+def _union_particiones(tablas: List[str], columnas: str, condiciones: str, params: list,
+                       orden: str, limit: Optional[int]):
+    """El mismo SELECT sobre cada tabla (cada rama usa su propio índice), unido y ordenado una vez."""
+    if len(tablas) == 1:
+        sql = f"SELECT {columnas} FROM {tablas[0]} WHERE {condiciones} ORDER BY {orden}"
+        params = list(params)
+    else:
+        ramas = " UNION ALL ".join(f"SELECT {columnas} FROM {t} WHERE {condiciones}" for t in tablas)
+        sql = f"SELECT * FROM ({ramas}) ORDER BY {orden}"
+        params = list(params) * len(tablas)
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, tuple(params)
+
+
+# --- CONSULTAS CALIENTES ---
+# Texto SQL de las consultas críticas, compartido con data/migrations.consultas_criticas()
+# para que la verificación de planes (EXPLAIN QUERY PLAN) mire exactamente lo que se ejecuta.
+SQL_MEDICOS_POR_ESPECIALIDAD = "SELECT * FROM medicos WHERE especialidad = ?"
+SQL_MARCAR_RESERVADA = "UPDATE disponibilidad SET estado = 'RESERVADO' WHERE medico_id = ? AND fecha_hora = ?"
+SQL_MARCAR_DISPONIBLE = "UPDATE disponibilidad SET estado = 'DISPONIBLE' WHERE medico_id = ? AND fecha_hora = ?"
+SQL_CONFLICTO_PACIENTE = """
+    SELECT count(*) FROM turnos
+    WHERE paciente_nombre = ? AND paciente_apellido = ?
+    AND fecha_hora = ? AND estado != 'ANULADO'
+"""
+SQL_CONFLICTO_MEDICO = """
+    SELECT count(*) FROM turnos
+    WHERE medico_id = ? AND fecha_hora = ? AND estado != 'ANULADO'
+"""
+# Toma el slot solo si sigue DISPONIBLE (rowcount 0 = ya reservado o inexistente)
+SQL_TOMAR_HORARIO = """
+    UPDATE disponibilidad SET estado = 'RESERVADO'
+    WHERE medico_id = ? AND fecha_hora = ? AND estado = 'DISPONIBLE'
+"""
+SQL_OUTBOX_RECLAMAR = ("SELECT id, topico, payload, intentos FROM outbox WHERE disponible_desde <= ? "
+                       "ORDER BY disponible_desde, id LIMIT ?")
+# {tabla}: 'turnos' o 'disponibilidad'
+SQL_FILAS_VENCIDAS = "SELECT id, substr(fecha_hora, 1, 7) FROM {tabla} WHERE fecha_hora < ? LIMIT ?"
+
 
 # --- REPOSITORIO DE MÉDICOS ---
 class IMedicoRepository(ABC):
@@ -18,91 +219,214 @@ class IMedicoRepository(ABC):
     def find_all(self) -> List[Medico]: pass
     @abstractmethod
     def find_by_id(self, id: int) -> Optional[Medico]: pass
+    @abstractmethod
+    def find_by_especialidad(self, especialidad: str) -> List[Medico]: pass
 
+@instrumentar_repositorio("medicos")
 class SqliteMedicoRepository(IMedicoRepository):
     def save(self, medico: Medico) -> Medico:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        if medico.id is None:
-            sql = "INSERT INTO medicos (nombre, apellido, especialidad) VALUES (?, ?, ?)"
-            cursor.execute(sql, (medico.nombre, medico.apellido, medico.especialidad))
-            medico.id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            if medico.id is None:
+                sql = "INSERT INTO medicos (nombre, apellido, especialidad) VALUES (?, ?, ?)"
+                cursor.execute(sql, (medico.nombre, medico.apellido, medico.especialidad))
+                medico.id = cursor.lastrowid
+            conn.commit()
         return medico
 
     def find_all(self) -> List[Medico]:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM medicos")
-        rows = cursor.fetchall()
-        conn.close()
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM medicos")
+            rows = cursor.fetchall()
         # Mapeo simple
         return [Medico(id=r['id'], nombre=r['nombre'], apellido=r['apellido'], especialidad=r['especialidad']) for r in rows]
 
     def find_by_id(self, id: int) -> Optional[Medico]:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM medicos WHERE id = ?", (id,))
-        row = cursor.fetchone()
-        conn.close()
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM medicos WHERE id = ?", (id,))
+            row = cursor.fetchone()
         if row:
             return Medico(id=row['id'], nombre=row['nombre'], apellido=row['apellido'], especialidad=row['especialidad'])
         return None
 
+    def find_by_especialidad(self, especialidad: str) -> List[Medico]:
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(SQL_MEDICOS_POR_ESPECIALIDAD, (especialidad,))
+            rows = cursor.fetchall()
+        return [Medico(id=r['id'], nombre=r['nombre'], apellido=r['apellido'], especialidad=r['especialidad']) for r in rows]
+
 
 # --- REPOSITORIO DE DISPONIBILIDAD ---
 class IDisponibilidadRepository(ABC):
     @abstractmethod
     def save(self, disponibilidad: Disponibilidad) -> Disponibilidad: pass
     @abstractmethod
-    def find_by_medico(self, medico_id: int) -> List[Disponibilidad]: pass
+    def save_many(self, medico_id: int, fechas: List[datetime]) -> int: pass
+    # historico=True suma las particiones mensuales del archivo (por defecto, solo la tabla caliente)
+    @abstractmethod
+    def find_by_medico(self, medico_id: int,
+                       desde: Optional[datetime] = None, hasta: Optional[datetime] = None,
+                       estado: Optional[str] = None,
+                       after_fecha_hora: Optional[datetime] = None,
+                       limit: Optional[int] = None, historico: bool = False) -> List[Disponibilidad]: pass
+    # Igual que find_by_medico pero sin construir objetos: tuplas
+    # (id, medico_id, fecha_hora ISO, estado) leídas directo del cursor
+    @abstractmethod
+    def iter_by_medico(self, medico_id: int,
+                       desde: Optional[datetime] = None, hasta: Optional[datetime] = None,
+                       estado: Optional[str] = None,
+                       after_fecha_hora: Optional[datetime] = None,
+                       limit: Optional[int] = None, historico: bool = False) -> Iterator[tuple]: pass
     @abstractmethod
     def marcar_reservada(self, medico_id: int, fecha: datetime) -> None: pass
     @abstractmethod
     def marcar_disponible(self, medico_id: int, fecha: datetime) -> None: pass
+    # Todas las filas (medico_id, fecha_hora, estado): carga del índice en memoria
+    @abstractmethod
+    def iter_todos(self) -> Iterator[tuple]: pass
+    # Primeros 'limit' horarios libres desde 'desde' entre varios médicos, por fecha
+    @abstractmethod
+    def find_libres_por_medicos(self, medico_ids: List[int], desde: datetime, limit: int) -> List[Disponibilidad]: pass
 
+@instrumentar_repositorio("disponibilidad")
 class SqliteDisponibilidadRepository(IDisponibilidadRepository):
     def save(self, disp: Disponibilidad) -> Disponibilidad:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        fecha_str = disp.fecha_hora.isoformat()
-        
-        sql = "INSERT INTO disponibilidad (medico_id, fecha_hora, estado) VALUES (?, ?, ?)"
-        cursor.execute(sql, (disp.medico_id, fecha_str, disp.estado))
-        disp.id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        """
+        Si el médico ya tiene ese horario (índice único, o en el archivo histórico)
+        no inserta y disp.id queda en None.
+        """
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            fecha_str = disp.fecha_hora.isoformat()
+            # BEGIN IMMEDIATE: el archivador no puede mover el horario entre la verificación y el INSERT
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                if not _horarios_archivados(conn, disp.medico_id, [disp.fecha_hora]):
+                    sql = "INSERT OR IGNORE INTO disponibilidad (medico_id, fecha_hora, estado) VALUES (?, ?, ?)"
+                    cursor.execute(sql, (disp.medico_id, fecha_str, disp.estado))
+                    if cursor.rowcount:
+                        disp.id = cursor.lastrowid
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
         return disp
 
-    def find_by_medico(self, medico_id: int) -> List[Disponibilidad]:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        # Traemos solo las disponibles o todas según se necesite. 
-        # El frontend filtrará, pero aquí traemos todo el calendario del médico.
-        sql = "SELECT * FROM disponibilidad WHERE medico_id = ? ORDER BY fecha_hora ASC"
-        cursor.execute(sql, (medico_id,))
-        rows = cursor.fetchall()
-        conn.close()
+    def save_many(self, medico_id: int, fechas: List[datetime]) -> int:
+        """
+        Inserta todos los horarios DISPONIBLE en una sola transacción (executemany).
+        Los ya existentes (en la tabla caliente o en el archivo) se ignoran; devuelve cuántos se crearon.
+        """
+        with DatabaseConfig.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                archivadas = _horarios_archivados(conn, medico_id, fechas)
+                antes = conn.total_changes
+                conn.executemany(
+                    "INSERT OR IGNORE INTO disponibilidad (medico_id, fecha_hora, estado) VALUES (?, ?, 'DISPONIBLE')",
+                    ((medico_id, iso) for iso in (f.isoformat() for f in fechas) if iso not in archivadas)
+                )
+                creados = conn.total_changes - antes
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return creados
+
+    @staticmethod
+    def _consulta_por_medico(tablas, medico_id, desde, hasta, estado, after_fecha_hora, limit, after_id=None):
+        # Filtros y paginación por cursor (keyset) resueltos en SQL sobre el índice
+        # (medico_id, fecha_hora). fecha_hora es única por médico en cada tabla; 'after_id'
+        # desempata entre la tabla caliente y el archivo cuando se recorre el histórico.
+        condiciones, params = _filtros_rango(desde, hasta, estado)
+        if after_fecha_hora is not None:
+            if after_id is not None:
+                # El rango sobre fecha_hora sigue usando el índice; el OR solo filtra los empates
+                condiciones.append("fecha_hora >= ? AND (fecha_hora > ? OR id > ?)")
+                params.extend([after_fecha_hora.isoformat(), after_fecha_hora.isoformat(), after_id])
+            else:
+                condiciones.append("fecha_hora > ?")
+                params.append(after_fecha_hora.isoformat())
+        where = "medico_id = ?" + "".join(f" AND {c}" for c in condiciones)
+        return _union_particiones(tablas, "id, medico_id, fecha_hora, estado", where,
+                                  [medico_id, *params], "fecha_hora ASC, id ASC", limit)
+
+    def find_by_medico(self, medico_id: int,
+                       desde: Optional[datetime] = None, hasta: Optional[datetime] = None,
+                       estado: Optional[str] = None,
+                       after_fecha_hora: Optional[datetime] = None,
+                       limit: Optional[int] = None, historico: bool = False) -> List[Disponibilidad]:
+        with DatabaseConfig.connection() as conn:
+            tablas = _tablas_consulta(conn, "disponibilidad", historico, desde, hasta)
+            sql, params = self._consulta_por_medico(tablas, medico_id, desde, hasta, estado, after_fecha_hora, limit)
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
         return [Disponibilidad(id=r['id'], medico_id=r['medico_id'], fecha_hora=datetime.fromisoformat(r['fecha_hora']), estado=r['estado']) for r in rows]
 
+    def iter_by_medico(self, medico_id: int,
+                       desde: Optional[datetime] = None, hasta: Optional[datetime] = None,
+                       estado: Optional[str] = None,
+                       after_fecha_hora: Optional[datetime] = None,
+                       limit: Optional[int] = None, historico: bool = False) -> Iterator[tuple]:
+        def leer_lote(ultima: Optional[tuple], tamanio: int) -> List[tuple]:
+            # Después del primer lote el cursor es (fecha_hora, id) de la última fila enviada
+            despues, despues_id = ((datetime.fromisoformat(ultima[2]), ultima[0]) if ultima
+                                   else (after_fecha_hora, None))
+            with DatabaseConfig.connection() as conn:
+                tablas = _tablas_consulta(conn, "disponibilidad", historico, desde, hasta)
+                sql, params = self._consulta_por_medico(tablas, medico_id, desde, hasta, estado,
+                                                        despues, tamanio, despues_id)
+                cursor = conn.execute(sql, params)
+                cursor.row_factory = None  # Tuplas planas, sin sqlite3.Row
+                return cursor.fetchall()
+        yield from _iterar_por_lotes(leer_lote, limit)
+
     def marcar_reservada(self, medico_id: int, fecha: datetime) -> None:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        fecha_str = fecha.isoformat()
-        sql = "UPDATE disponibilidad SET estado = 'RESERVADO' WHERE medico_id = ? AND fecha_hora = ?"
-        cursor.execute(sql, (medico_id, fecha_str))
-        conn.commit()
-        conn.close()
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            fecha_str = fecha.isoformat()
+            cursor.execute(SQL_MARCAR_RESERVADA, (medico_id, fecha_str))
+            conn.commit()
 
     def marcar_disponible(self, medico_id: int, fecha: datetime) -> None:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        fecha_str = fecha.isoformat()
-        sql = "UPDATE disponibilidad SET estado = 'DISPONIBLE' WHERE medico_id = ? AND fecha_hora = ?"
-        cursor.execute(sql, (medico_id, fecha_str))
-        conn.commit()
-        conn.close()
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            fecha_str = fecha.isoformat()
+            cursor.execute(SQL_MARCAR_DISPONIBLE, (medico_id, fecha_str))
+            conn.commit()
+
+    def iter_todos(self) -> Iterator[tuple]:
+        # Recorre el índice único (medico_id, fecha_hora): las filas salen ya ordenadas
+        def leer_lote(ultima: Optional[tuple], tamanio: int) -> List[tuple]:
+            with DatabaseConfig.connection() as conn:
+                if ultima is None:
+                    cursor = conn.execute("SELECT medico_id, fecha_hora, estado FROM disponibilidad "
+                                          "ORDER BY medico_id, fecha_hora LIMIT ?", (tamanio,))
+                else:
+                    cursor = conn.execute("SELECT medico_id, fecha_hora, estado FROM disponibilidad "
+                                          "WHERE (medico_id, fecha_hora) > (?, ?) "
+                                          "ORDER BY medico_id, fecha_hora LIMIT ?", (ultima[0], ultima[1], tamanio))
+                cursor.row_factory = None
+                return cursor.fetchall()
+        yield from _iterar_por_lotes(leer_lote)
+
+    def find_libres_por_medicos(self, medico_ids: List[int], desde: datetime, limit: int) -> List[Disponibilidad]:
+        # Un rango del índice (medico_id, fecha_hora) por médico; SQLite ordena solo los candidatos
+        marcadores = ", ".join("?" * len(medico_ids))
+        sql = f"""
+            SELECT id, medico_id, fecha_hora, estado FROM disponibilidad
+            WHERE medico_id IN ({marcadores}) AND fecha_hora >= ? AND estado = 'DISPONIBLE'
+            ORDER BY fecha_hora, medico_id LIMIT ?
+        """
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, (*medico_ids, desde.isoformat(), limit))
+            rows = cursor.fetchall()
+        return [Disponibilidad(id=r['id'], medico_id=r['medico_id'], fecha_hora=datetime.fromisoformat(r['fecha_hora']), estado=r['estado']) for r in rows]
 
 
 # --- REPOSITORIO DE TURNOS (Actualizado) ---
@@ -112,9 +436,26 @@ class ITurnosRepository(ABC):
     @abstractmethod
     def find_by_id(self, id: int) -> Optional[Turno]: pass
     @abstractmethod
-    def find_by_paciente(self, nombre: str, apellido: str) -> List[Turno]: pass
+    def find_by_ids(self, ids: List[int]) -> Dict[int, Turno]: pass
+    # historico=True incluye los turnos archivados (ver IArchivoRepository)
+    @abstractmethod
+    def find_by_paciente(self, nombre: str, apellido: str,
+                         desde: Optional[datetime] = None, hasta: Optional[datetime] = None,
+                         estado: Optional[str] = None,
+                         after_fecha_hora: Optional[datetime] = None, after_id: Optional[int] = None,
+                         limit: Optional[int] = None, historico: bool = False) -> List[Turno]: pass
+    # Igual que find_by_paciente pero con tuplas (id, medico_id, fecha_hora ISO, estado)
+    @abstractmethod
+    def iter_by_paciente(self, nombre: str, apellido: str,
+                         desde: Optional[datetime] = None, hasta: Optional[datetime] = None,
+                         estado: Optional[str] = None,
+                         after_fecha_hora: Optional[datetime] = None, after_id: Optional[int] = None,
+                         limit: Optional[int] = None, historico: bool = False) -> Iterator[tuple]: pass
     @abstractmethod
     def delete_by_id(self, id: int) -> None: pass
+    # Turnos no anulados como (paciente_nombre, paciente_apellido, fecha_hora)
+    @abstractmethod
+    def iter_activos(self) -> Iterator[tuple]: pass
     
     # Nuevas validaciones
     @abstractmethod
@@ -122,40 +463,56 @@ class ITurnosRepository(ABC):
     @abstractmethod
     def existe_conflicto_medico(self, medico_id: int, fecha: datetime) -> bool: pass
 
+    # Reserva atómica: inserta el turno, toma el slot y (opcional) escribe el
+    # evento (topico, mensaje) en el outbox, todo en una sola transacción
+    @abstractmethod
+    def reservar(self, turno: Turno, evento: Optional[Tuple[str, dict]] = None) -> ResultadoReserva: pass
+    # Anulación atómica: turno ANULADO + slot DISPONIBLE + outbox. False si ya estaba anulado.
+    @abstractmethod
+    def anular(self, turno: Turno, evento: Optional[Tuple[str, dict]] = None) -> bool: pass
+    # Versiones por lote: una sola transacción, un resultado por ítem (los rechazados
+    # no afectan a los demás) y los eventos de los ítems aplicados en el outbox
+    @abstractmethod
+    def reservar_lote(self, turnos: List[Turno], eventos: List[Tuple[str, dict]]) -> List[ResultadoReserva]: pass
+    @abstractmethod
+    def anular_lote(self, turnos: List[Turno], eventos: List[Tuple[str, dict]]) -> List[bool]: pass
+
+@instrumentar_repositorio("turnos")
 class SqliteTurnosRepository(ITurnosRepository):
     def save(self, turno: Turno) -> Turno:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        fecha_str = turno.fecha_hora.isoformat()
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            fecha_str = turno.fecha_hora.isoformat()
         
-        # Mapeo seguro del Enum a string
-        estado_str = turno.estado.value if hasattr(turno.estado, 'value') else turno.estado
+            # Mapeo seguro del Enum a string
+            estado_str = turno.estado.value if hasattr(turno.estado, 'value') else turno.estado
+
+            if turno.id is None:
+                sql = """
+                    INSERT INTO turnos (medico_id, paciente_nombre, paciente_apellido, fecha_hora, estado)
+                    VALUES (?, ?, ?, ?, ?)
+                """
+                cursor.execute(sql, (turno.medico_id, turno.paciente_nombre, turno.paciente_apellido, fecha_str, estado_str))
+                turno.id = cursor.lastrowid
+            else:
+                sql = """
+                    UPDATE turnos 
+                    SET medico_id=?, paciente_nombre=?, paciente_apellido=?, fecha_hora=?, estado=?
+                    WHERE id=?
+                """
+                cursor.execute(sql, (turno.medico_id, turno.paciente_nombre, turno.paciente_apellido, fecha_str, estado_str, turno.id))
 
-        if turno.id is None:
-            sql = """
-                INSERT INTO turnos (medico_id, paciente_nombre, paciente_apellido, fecha_hora, estado)
-                VALUES (?, ?, ?, ?, ?)
-            """
-            cursor.execute(sql, (turno.medico_id, turno.paciente_nombre, turno.paciente_apellido, fecha_str, estado_str))
-            turno.id = cursor.lastrowid
-        else:
-            sql = """
-                UPDATE turnos 
-                SET medico_id=?, paciente_nombre=?, paciente_apellido=?, fecha_hora=?, estado=?
-                WHERE id=?
-            """
-            cursor.execute(sql, (turno.medico_id, turno.paciente_nombre, turno.paciente_apellido, fecha_str, estado_str, turno.id))
-
-        conn.commit()
-        conn.close()
+            conn.commit()
         return turno
 
     def find_by_id(self, id: int) -> Optional[Turno]:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM turnos WHERE id = ?", (id,))
-        row = cursor.fetchone()
-        conn.close()
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM turnos WHERE id = ?", (id,))
+            row = cursor.fetchone()
+            if row is None:
+                # Turno viejo: ya no está en la tabla caliente sino en el archivo
+                row = next(iter(_turnos_archivados(conn, [id])), None)
         if row:
             from logic.models import EstadoTurno # Import diferido
             return Turno(
@@ -168,13 +525,41 @@ class SqliteTurnosRepository(ITurnosRepository):
             )
         return None
 
-    def find_by_paciente(self, nombre: str, apellido: str) -> List[Turno]:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        sql = "SELECT * FROM turnos WHERE paciente_nombre = ? AND paciente_apellido = ? ORDER BY fecha_hora DESC"
-        cursor.execute(sql, (nombre, apellido))
-        rows = cursor.fetchall()
-        conn.close()
+    def find_by_ids(self, ids: List[int]) -> Dict[int, Turno]:
+        from logic.models import EstadoTurno
+        if not ids:
+            return {}
+        marcadores = ", ".join("?" * len(ids))
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT * FROM turnos WHERE id IN ({marcadores})", ids)
+            rows = cursor.fetchall()
+            if len(rows) < len(set(ids)):
+                encontrados = {r['id'] for r in rows}
+                rows += _turnos_archivados(conn, [i for i in set(ids) if i not in encontrados])
+        return {
+            r['id']: Turno(
+                id=r['id'],
+                medico_id=r['medico_id'],
+                paciente_nombre=r['paciente_nombre'],
+                paciente_apellido=r['paciente_apellido'],
+                fecha_hora=datetime.fromisoformat(r['fecha_hora']),
+                estado=EstadoTurno(r['estado'])
+            ) for r in rows
+        }
+
+    def find_by_paciente(self, nombre: str, apellido: str,
+                         desde: Optional[datetime] = None, hasta: Optional[datetime] = None,
+                         estado: Optional[str] = None,
+                         after_fecha_hora: Optional[datetime] = None, after_id: Optional[int] = None,
+                         limit: Optional[int] = None, historico: bool = False) -> List[Turno]:
+        with DatabaseConfig.connection() as conn:
+            tablas = _tablas_consulta(conn, "turnos", historico, desde, hasta)
+            sql, params = self._consulta_por_paciente(tablas, nombre, apellido, desde, hasta, estado,
+                                                      after_fecha_hora, after_id, limit, "*")
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
         from logic.models import EstadoTurno
         return [
             Turno(
@@ -187,39 +572,365 @@ class SqliteTurnosRepository(ITurnosRepository):
             ) for r in rows
         ]
 
+    def iter_by_paciente(self, nombre: str, apellido: str,
+                         desde: Optional[datetime] = None, hasta: Optional[datetime] = None,
+                         estado: Optional[str] = None,
+                         after_fecha_hora: Optional[datetime] = None, after_id: Optional[int] = None,
+                         limit: Optional[int] = None, historico: bool = False) -> Iterator[tuple]:
+        def leer_lote(ultima: Optional[tuple], tamanio: int) -> List[tuple]:
+            despues, despues_id = ((datetime.fromisoformat(ultima[2]), ultima[0]) if ultima
+                                   else (after_fecha_hora, after_id))
+            with DatabaseConfig.connection() as conn:
+                tablas = _tablas_consulta(conn, "turnos", historico, desde, hasta)
+                sql, params = self._consulta_por_paciente(tablas, nombre, apellido, desde, hasta, estado,
+                                                          despues, despues_id, tamanio,
+                                                          "id, medico_id, fecha_hora, estado")
+                cursor = conn.execute(sql, params)
+                cursor.row_factory = None
+                return cursor.fetchall()
+        yield from _iterar_por_lotes(leer_lote, limit)
+
+    @staticmethod
+    def _consulta_por_paciente(tablas, nombre, apellido, desde, hasta, estado,
+                               after_fecha_hora, after_id, limit, columnas):
+        # Orden descendente (más recientes primero). Un paciente puede tener turnos
+        # ANULADOS repetidos a la misma hora, por eso el cursor admite 'after_id' como desempate.
+        condiciones, params = _filtros_rango(desde, hasta, estado)
+        if after_fecha_hora is not None:
+            if after_id is not None:
+                # El rango sobre fecha_hora sigue usando el índice; el OR solo filtra los empates
+                condiciones.append("fecha_hora <= ? AND (fecha_hora < ? OR id < ?)")
+                params.extend([after_fecha_hora.isoformat(), after_fecha_hora.isoformat(), after_id])
+            else:
+                condiciones.append("fecha_hora < ?")
+                params.append(after_fecha_hora.isoformat())
+        where = "paciente_nombre = ? AND paciente_apellido = ?" + "".join(f" AND {c}" for c in condiciones)
+        return _union_particiones(tablas, columnas, where, [nombre, apellido, *params],
+                                  "fecha_hora DESC, id DESC", limit)
+
     def delete_by_id(self, id: int) -> None:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM turnos WHERE id = ?", (id,))
-        conn.commit()
-        conn.close()
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM turnos WHERE id = ?", (id,))
+            conn.commit()
+
+    def iter_activos(self) -> Iterator[tuple]:
+        def leer_lote(ultima: Optional[tuple], tamanio: int) -> List[tuple]:
+            with DatabaseConfig.connection() as conn:
+                cursor = conn.execute(
+                    "SELECT id, paciente_nombre, paciente_apellido, fecha_hora FROM turnos "
+                    "WHERE estado != 'ANULADO' AND id > ? ORDER BY id LIMIT ?", (ultima[0] if ultima else 0, tamanio))
+                cursor.row_factory = None
+                return cursor.fetchall()
+        for fila in _iterar_por_lotes(leer_lote):
+            yield fila[1:]
 
     # REGLA: Un cliente no puede tener cita a la misma hora (aunque sea otro médico)
     def existe_conflicto_paciente(self, nombre: str, apellido: str, fecha: datetime) -> bool:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        fecha_str = fecha.isoformat()
-        # Buscamos turnos activos (no anulados)
-        sql = """
-            SELECT count(*) FROM turnos 
-            WHERE paciente_nombre = ? AND paciente_apellido = ? 
-            AND fecha_hora = ? AND estado != 'ANULADO'
-        """
-        cursor.execute(sql, (nombre, apellido, fecha_str))
-        count = cursor.fetchone()[0]
-        conn.close()
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            fecha_str = fecha.isoformat()
+            # Buscamos turnos activos (no anulados)
+            cursor.execute(SQL_CONFLICTO_PACIENTE, (nombre, apellido, fecha_str))
+            count = cursor.fetchone()[0]
         return count > 0
 
     # REGLA: Un horario de un médico no puede tener más de un cliente
     def existe_conflicto_medico(self, medico_id: int, fecha: datetime) -> bool:
-        conn = DatabaseConfig.get_connection()
-        cursor = conn.cursor()
-        fecha_str = fecha.isoformat()
-        sql = """
-            SELECT count(*) FROM turnos 
-            WHERE medico_id = ? AND fecha_hora = ? AND estado != 'ANULADO'
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            fecha_str = fecha.isoformat()
+            cursor.execute(SQL_CONFLICTO_MEDICO, (medico_id, fecha_str))
+            count = cursor.fetchone()[0]
+        return count > 0
+
+    def reservar(self, turno: Turno, evento: Optional[Tuple[str, dict]] = None) -> ResultadoReserva:
+        """
+        Inserta el turno y marca el slot como RESERVADO dentro de un único
+        BEGIN IMMEDIATE. Los conflictos se detectan por los índices únicos
+        parciales (INSERT) y por el conteo de filas del UPDATE condicional,
+        así dos requests concurrentes nunca reservan el mismo horario.
+        El evento se guarda en el outbox en esa misma transacción.
+        """
+        fecha_str = turno.fecha_hora.isoformat()
+        estado_str = turno.estado.value if hasattr(turno.estado, 'value') else turno.estado
+
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # 1. Insertar el turno (REGLA paciente / REGLA médico vía índices únicos)
+                try:
+                    cursor.execute("""
+                        INSERT INTO turnos (medico_id, paciente_nombre, paciente_apellido, fecha_hora, estado)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, (turno.medico_id, turno.paciente_nombre, turno.paciente_apellido, fecha_str, estado_str))
+                except sqlite3.IntegrityError as e:
+                    conn.rollback()
+                    if 'paciente' in str(e):
+                        return ResultadoReserva.PACIENTE_OCUPADO
+                    return ResultadoReserva.HORARIO_NO_DISPONIBLE
+                turno_id = cursor.lastrowid
+
+                # 2. Tomar el slot solo si sigue DISPONIBLE
+                cursor.execute(SQL_TOMAR_HORARIO, (turno.medico_id, fecha_str))
+                if cursor.rowcount == 0:
+                    cursor.execute(
+                        "SELECT 1 FROM disponibilidad WHERE medico_id = ? AND fecha_hora = ?",
+                        (turno.medico_id, fecha_str))
+                    existe = cursor.fetchone() is not None
+                    conn.rollback()
+                    if existe:
+                        return ResultadoReserva.HORARIO_NO_DISPONIBLE
+                    return ResultadoReserva.HORARIO_INEXISTENTE
+
+                # 3. Evento para el relay (at-least-once hacia RabbitMQ)
+                _insertar_outbox(cursor, evento)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        turno.id = turno_id
+        return ResultadoReserva.CONFIRMADA
+
+    def anular(self, turno: Turno, evento: Optional[Tuple[str, dict]] = None) -> bool:
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # Condicional: si otro request ya lo anuló no hacemos nada (ni evento)
+                if not _anular_fila(cursor, turno):
+                    conn.rollback()
+                    return False
+                _insertar_outbox(cursor, evento)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return True
+
+    def reservar_lote(self, turnos: List[Turno], eventos: List[Tuple[str, dict]]) -> List[ResultadoReserva]:
+        """
+        Mismas reglas que reservar() para cada turno, pero todo dentro de un único
+        BEGIN IMMEDIATE: un lock de escritura y un commit para todo el lote.
+        Cada ítem corre en un SAVEPOINT; si choca (con la base o con otro ítem del
+        mismo lote) se deshace solo ese ítem. Los eventos de los confirmados se
+        escriben juntos en el outbox antes del commit.
+        """
+        resultados = []
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for turno in turnos:
+                    fecha_str = turno.fecha_hora.isoformat()
+                    estado_str = turno.estado.value if hasattr(turno.estado, 'value') else turno.estado
+                    cursor.execute("SAVEPOINT item")
+                    try:
+                        cursor.execute("""
+                            INSERT INTO turnos (medico_id, paciente_nombre, paciente_apellido, fecha_hora, estado)
+                            VALUES (?, ?, ?, ?, ?)
+                        """, (turno.medico_id, turno.paciente_nombre, turno.paciente_apellido, fecha_str, estado_str))
+                    except sqlite3.IntegrityError as e:
+                        cursor.execute("ROLLBACK TO item")
+                        cursor.execute("RELEASE item")
+                        resultados.append(ResultadoReserva.PACIENTE_OCUPADO if 'paciente' in str(e)
+                                          else ResultadoReserva.HORARIO_NO_DISPONIBLE)
+                        continue
+                    turno_id = cursor.lastrowid
+                    cursor.execute(SQL_TOMAR_HORARIO, (turno.medico_id, fecha_str))
+                    if cursor.rowcount == 0:
+                        cursor.execute("ROLLBACK TO item")
+                        cursor.execute("RELEASE item")
+                        cursor.execute(
+                            "SELECT 1 FROM disponibilidad WHERE medico_id = ? AND fecha_hora = ?",
+                            (turno.medico_id, fecha_str))
+                        resultados.append(ResultadoReserva.HORARIO_NO_DISPONIBLE if cursor.fetchone()
+                                          else ResultadoReserva.HORARIO_INEXISTENTE)
+                        continue
+                    cursor.execute("RELEASE item")
+                    turno.id = turno_id
+                    resultados.append(ResultadoReserva.CONFIRMADA)
+
+                _insertar_outbox_lote(cursor, [evento for evento, resultado in zip(eventos, resultados)
+                                               if resultado == ResultadoReserva.CONFIRMADA])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                for turno in turnos:
+                    turno.id = None
+                raise
+        return resultados
+
+    def anular_lote(self, turnos: List[Turno], eventos: List[Tuple[str, dict]]) -> List[bool]:
+        """Anula cada turno como anular(), en una sola transacción. False = ya estaba anulado."""
+        anulados = []
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for turno in turnos:
+                    anulados.append(_anular_fila(cursor, turno))
+                _insertar_outbox_lote(cursor, [evento for evento, ok in zip(eventos, anulados) if ok])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return anulados
+
+
+# --- OUTBOX DE EVENTOS ---
+class IOutboxRepository(ABC):
+    @abstractmethod
+    def reclamar(self, limite: int, lease: float) -> List[Tuple[int, str, dict]]: pass
+    @abstractmethod
+    def confirmar(self, ids: List[int]) -> None: pass
+    @abstractmethod
+    def pendientes(self) -> int: pass
+
+@instrumentar_repositorio("outbox")
+class SqliteOutboxRepository(IOutboxRepository):
+    MAX_LEASE = 300.0  # Segundos; techo del backoff entre reintentos
+
+    def reclamar(self, limite: int, lease: float) -> List[Tuple[int, str, dict]]:
+        """
+        Toma hasta 'limite' eventos listos y los aparta (lease) para que ningún otro
+        relay (u otro proceso) los envíe mientras tanto. Si no se confirman, vuelven
+        a estar disponibles con backoff exponencial según 'intentos'.
         """
-        cursor.execute(sql, (medico_id, fecha_str))
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count > 0
\ No newline at end of file
+        ahora = time.time()
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute(SQL_OUTBOX_RECLAMAR, (ahora, limite))
+                rows = cursor.fetchall()
+                cursor.executemany(
+                    "UPDATE outbox SET intentos = intentos + 1, disponible_desde = ? WHERE id = ?",
+                    [(ahora + min(lease * (2 ** r['intentos']), self.MAX_LEASE), r['id']) for r in rows])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return [(r['id'], r['topico'], json.loads(r['payload'])) for r in rows]
+
+    def confirmar(self, ids: List[int]) -> None:
+        if not ids:
+            return
+        with DatabaseConfig.connection() as conn:
+            conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+            conn.commit()
+
+    def pendientes(self) -> int:
+        with DatabaseConfig.connection() as conn:
+            return conn.execute("SELECT count(*) FROM outbox").fetchone()[0]
+
+
+# --- ARCHIVO HISTÓRICO ---
+class IArchivoRepository(ABC):
+    # Mueve al archivo hasta 'limite' filas de cada tabla: horarios y turnos anteriores
+    # a 'corte', cualquiera sea su estado. Devuelve cuántas movió.
+    @abstractmethod
+    def archivar(self, corte: datetime, limite: int) -> Dict[str, int]: pass
+    # ANALYZE y, si las páginas libres superan 'vacuum_ratio' del archivo, VACUUM
+    @abstractmethod
+    def mantenimiento(self, vacuum_ratio: float) -> Dict[str, int]: pass
+    # Filas en las tablas calientes y particiones mensuales existentes
+    @abstractmethod
+    def tamanios(self) -> Dict[str, int]: pass
+
+@instrumentar_repositorio("archivo")
+class SqliteArchivoRepository(IArchivoRepository):
+    """
+    Tablas calientes (turnos, disponibilidad) con solo la agenda vigente y una
+    partición por mes en el esquema adjunto 'archivo' con todo lo anterior.
+    Copiar y borrar ocurren en la misma transacción. Con WAL, SQLite no garantiza
+    atomicidad entre archivos adjuntos ante un corte de luz, por eso la copia es
+    INSERT OR IGNORE por id: repetir un lote a medias no duplica nada.
+    """
+
+    COLUMNAS = {
+        "turnos": "id, medico_id, paciente_nombre, paciente_apellido, fecha_hora, estado",
+        "disponibilidad": "id, medico_id, fecha_hora, estado",
+    }
+    ESQUEMAS = {
+        "turnos": (
+            """CREATE TABLE IF NOT EXISTS archivo.{tabla} (
+                   id INTEGER PRIMARY KEY,
+                   medico_id INTEGER NOT NULL,
+                   paciente_nombre TEXT NOT NULL,
+                   paciente_apellido TEXT NOT NULL,
+                   fecha_hora TEXT NOT NULL,
+                   estado TEXT NOT NULL
+               )""",
+            "CREATE INDEX IF NOT EXISTS archivo.idx_{tabla}_paciente ON {tabla} (paciente_apellido, paciente_nombre, fecha_hora)",
+        ),
+        "disponibilidad": (
+            """CREATE TABLE IF NOT EXISTS archivo.{tabla} (
+                   id INTEGER PRIMARY KEY,
+                   medico_id INTEGER NOT NULL,
+                   fecha_hora TEXT NOT NULL,
+                   estado TEXT NOT NULL
+               )""",
+            "CREATE INDEX IF NOT EXISTS archivo.idx_{tabla}_medico ON {tabla} (medico_id, fecha_hora)",
+        ),
+    }
+    ANALYSIS_LIMIT = 1000  # Filas muestreadas por índice en ANALYZE (acota su costo)
+
+    def archivar(self, corte: datetime, limite: int) -> Dict[str, int]:
+        corte_str = corte.isoformat()
+        with DatabaseConfig.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                turnos = self._mover(cursor, "turnos", corte_str, limite)
+                horarios = self._mover(cursor, "disponibilidad", corte_str, limite)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return {"turnos": turnos, "disponibilidad": horarios}
+
+    def _mover(self, cursor: sqlite3.Cursor, base: str, corte: str, limite: int) -> int:
+        """Copia a su partición mensual y borra de la tabla caliente hasta 'limite' filas anteriores a 'corte'."""
+        cursor.execute(SQL_FILAS_VENCIDAS.format(tabla=base), (corte, limite))
+        por_mes: Dict[str, List[tuple]] = {}
+        for fila_id, mes in cursor.fetchall():
+            por_mes.setdefault(mes.replace('-', '_'), []).append((fila_id,))
+        columnas = self.COLUMNAS[base]
+        for mes, ids in por_mes.items():
+            if not _NOMBRE_PARTICION.fullmatch(mes):
+                raise ValueError(f"fecha_hora inválida en {base}: {mes}")
+            tabla = f"{base}_{mes}"
+            for ddl in self.ESQUEMAS[base]:
+                cursor.execute(ddl.format(tabla=tabla))
+            cursor.executemany(
+                f"INSERT OR IGNORE INTO archivo.{tabla} ({columnas}) SELECT {columnas} FROM {base} WHERE id = ?", ids)
+            cursor.executemany(f"DELETE FROM {base} WHERE id = ?", ids)
+        return sum(len(ids) for ids in por_mes.values())
+
+    def mantenimiento(self, vacuum_ratio: float) -> Dict[str, int]:
+        vacuums = 0
+        with DatabaseConfig.connection() as conn:
+            conn.execute(f"PRAGMA analysis_limit = {int(self.ANALYSIS_LIMIT)}")
+            conn.execute("ANALYZE main")
+            conn.execute("PRAGMA archivo.optimize")
+            conn.commit()
+            for esquema in ("main", "archivo"):
+                paginas = conn.execute(f"PRAGMA {esquema}.page_count").fetchone()[0]
+                libres = conn.execute(f"PRAGMA {esquema}.freelist_count").fetchone()[0]
+                if paginas and libres / paginas > vacuum_ratio:
+                    # Bloquea a los escritores mientras dura: por eso solo con muchas páginas libres
+                    conn.execute(f"VACUUM {esquema}")
+                    conn.execute(f"PRAGMA {esquema}.wal_checkpoint(TRUNCATE)")
+                    vacuums += 1
+        return {"vacuums": vacuums}
+
+    def tamanios(self) -> Dict[str, int]:
+        with DatabaseConfig.connection() as conn:
+            return {
+                "turnos_calientes": conn.execute("SELECT count(*) FROM turnos").fetchone()[0],
+                "disponibilidad_calientes": conn.execute("SELECT count(*) FROM disponibilidad").fetchone()[0],
+                "particiones": len(_particiones(conn, "turnos")) + len(_particiones(conn, "disponibilidad")),
+            }
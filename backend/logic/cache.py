@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+
+class ResponseCache:
+    """
+    Caché LRU en memoria con TTL para respuestas ya serializadas (bytes JSON).
+
+    Claves usadas por los servicios:
+    - ("medicos",)                     -> listado de médicos
+    - ("disponibilidad", medico_id)    -> calendario de un médico
+    - ("disponibilidad", medico_id, estado, desde, hasta)
+                                       -> vista filtrada del calendario (días completos)
+
+    Los servicios invalidan la clave base en cada escritura; eso invalida también
+    las claves que la extienden (las vistas filtradas del mismo médico).
+
+    Un resultado que se invalidó mientras otro hilo lo leía de SQLite (ya viejo)
+    no se guarda: clear() incrementa una generación global, e invalidate() sube la
+    versión de las claves que se están calculando en ese momento. Esas versiones
+    solo existen mientras dura el cálculo, así que no crecen con cada clave vista.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entradas = OrderedDict()  # clave -> (expira_en, valor)
+        self._generacion = 0            # La incrementa clear()
+        self._en_vuelo: Dict[Hashable, list] = {}  # clave -> [cálculos en curso, versión]
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidaciones": 0, "expulsiones": 0}
+
+    def get_or_compute(self, clave: Hashable, calcular: Callable[[], bytes]) -> bytes:
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] > ahora:
+                self._entradas.move_to_end(clave)
+                self._stats["hits"] += 1
+                return entrada[1]
+            self._stats["misses"] += 1
+            calculo = self._en_vuelo.setdefault(clave, [0, 0])
+            calculo[0] += 1
+            version = (self._generacion, calculo[1])
+
+        # Fuera del lock: la consulta a SQLite no bloquea a otros lectores
+        try:
+            valor = calcular()
+        except BaseException:
+            with self._lock:
+                self._terminar_calculo(clave)
+            raise
+
+        with self._lock:
+            if (self._generacion, self._en_vuelo[clave][1]) == version:
+                self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+                self._entradas.move_to_end(clave)
+                while len(self._entradas) > self.max_entries:
+                    self._entradas.popitem(last=False)
+                    self._stats["expulsiones"] += 1
+            self._terminar_calculo(clave)
+        return valor
+
+    def _terminar_calculo(self, clave: Hashable) -> None:
+        calculo = self._en_vuelo[clave]
+        calculo[0] -= 1
+        if not calculo[0]:
+            del self._en_vuelo[clave]
+
+    def invalidate(self, clave: Hashable) -> None:
+        """Quita 'clave' y, si es una tupla, todas las claves que empiezan con ella."""
+        with self._lock:
+            self._entradas.pop(clave, None)
+            if isinstance(clave, tuple):
+                largo = len(clave)
+                for derivada in [c for c in self._entradas if isinstance(c, tuple) and c[:largo] == clave]:
+                    del self._entradas[derivada]
+                # Los cálculos en curso de la clave o de sus derivadas no se guardarán
+                for en_curso, calculo in self._en_vuelo.items():
+                    if isinstance(en_curso, tuple) and en_curso[:largo] == clave:
+                        calculo[1] += 1
+            elif clave in self._en_vuelo:
+                self._en_vuelo[clave][1] += 1
+            self._stats["invalidaciones"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generacion += 1
+            self._entradas.clear()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            consultas = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entradas": len(self._entradas),
+                "hit_ratio": round(self._stats["hits"] / consultas, 4) if consultas else 0.0,
+            }
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, date, time
+from typing import List
 
 @dataclass
 class CrearMedicoDTO:
@@ -17,4 +18,27 @@ class AgendarTurnoDTO:
     medico_id: int
     paciente_nombre: str
     paciente_apellido: str
-    fecha_hora: datetime
\ No newline at end of file
+    fecha_hora: datetime
+
+@dataclass
+class AgendarTurnosLoteDTO:
+    turnos: List[AgendarTurnoDTO]
+
+@dataclass
+class AnularTurnosLoteDTO:
+    turno_ids: List[int]
+
+@dataclass
+class AgregarDisponibilidadLoteDTO:
+    medico_id: int
+    fechas: List[datetime]
+
+@dataclass
+class GenerarDisponibilidadDTO:
+    medico_id: int
+    desde: date
+    hasta: date
+    dias_semana: List[int]      # 0 = lunes ... 6 = domingo
+    hora_inicio: time
+    hora_fin: time
+    duracion_minutos: int
@@ -0,0 +1,175 @@
+import bisect
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+DISPONIBLE = "DISPONIBLE"
+RESERVADO = "RESERVADO"
+
+
+class IndiceHorarios:
+    """
+    Índice en memoria de la agenda (por proceso), para responder sin ir a SQLite:
+    - ¿existe / está libre este horario del médico?         O(1)
+    - próximos N horarios libres de un médico desde X        O(log n + N)
+    - ¿el paciente ya tiene turno a esa hora?                O(1)
+
+    Estructura por médico: un dict fecha -> estado y una lista ordenada con
+    solo las fechas libres (bisect). Los pacientes ocupados son un set de
+    (apellido, nombre, fecha) con los turnos activos.
+
+    SQLite sigue siendo la autoridad: el índice se carga al arrancar
+    (cargar) y lo mantienen los servicios después de cada escritura confirmada.
+    Para que esas actualizaciones se apliquen en el mismo orden que los commits,
+    quien escribe toma 'escritura' desde antes del commit hasta actualizar el índice
+    (sin él, una reserva y una anulación concurrentes pueden quedar invertidas).
+    """
+
+    def __init__(self):
+        self._estados: Dict[int, Dict[datetime, str]] = {}
+        self._libres: Dict[int, List[datetime]] = {}
+        self._pacientes: Set[Tuple[str, str, datetime]] = set()
+        self._lock = threading.RLock()
+        self.escritura = threading.Lock()  # Commit en SQLite + actualización, sin intercalarse
+
+    # --- Carga inicial ---
+    def cargar(self, horarios: Iterable[tuple], turnos_activos: Iterable[tuple]) -> None:
+        """
+        Reemplaza el contenido con filas de SQLite:
+        horarios = (medico_id, fecha_hora_iso, estado), turnos_activos = (nombre, apellido, fecha_hora_iso).
+        """
+        estados: Dict[int, Dict[datetime, str]] = {}
+        libres: Dict[int, List[datetime]] = {}
+        for medico_id, fecha_iso, estado in horarios:
+            fecha = datetime.fromisoformat(fecha_iso)
+            estados.setdefault(medico_id, {})[fecha] = estado
+            if estado == DISPONIBLE:
+                libres.setdefault(medico_id, []).append(fecha)
+        for fechas in libres.values():
+            fechas.sort()  # Ya vienen ordenadas del índice; sort() es O(n) en ese caso
+        pacientes = {(apellido, nombre, datetime.fromisoformat(fecha_iso))
+                     for nombre, apellido, fecha_iso in turnos_activos}
+        with self._lock:
+            self._estados, self._libres, self._pacientes = estados, libres, pacientes
+
+    # --- Consultas ---
+    def estado(self, medico_id: int, fecha: datetime) -> Optional[str]:
+        """DISPONIBLE, RESERVADO o None si el médico no atiende en ese horario."""
+        with self._lock:
+            return self._estados.get(medico_id, {}).get(fecha)
+
+    def esta_libre(self, medico_id: int, fecha: datetime) -> bool:
+        return self.estado(medico_id, fecha) == DISPONIBLE
+
+    def paciente_ocupado(self, nombre: str, apellido: str, fecha: datetime) -> bool:
+        with self._lock:
+            return (apellido, nombre, fecha) in self._pacientes
+
+    def proximos_libres(self, medico_id: int, desde: datetime, n: int) -> List[datetime]:
+        """Los primeros 'n' horarios libres del médico con fecha >= desde, en orden."""
+        with self._lock:
+            libres = self._libres.get(medico_id, [])
+            inicio = bisect.bisect_left(libres, desde)
+            return libres[inicio:inicio + n]
+
+    def medicos(self) -> List[int]:
+        with self._lock:
+            return list(self._estados)
+
+    def total_horarios(self) -> int:
+        with self._lock:
+            return sum(len(e) for e in self._estados.values())
+
+    # --- Actualizaciones (las llaman los servicios tras confirmar en SQLite) ---
+    def agregar_horarios(self, medico_id: int, fechas: Iterable[datetime]) -> None:
+        """Agrega horarios DISPONIBLE; los que ya existen no se tocan (igual que INSERT OR IGNORE)."""
+        with self._lock:
+            estados = self._estados.setdefault(medico_id, {})
+            libres = self._libres.setdefault(medico_id, [])
+            nuevas = [f for f in fechas if f not in estados]
+            for fecha in nuevas:
+                estados[fecha] = DISPONIBLE
+            if len(nuevas) > 16:
+                libres.extend(nuevas)
+                libres.sort()
+            else:
+                for fecha in nuevas:
+                    bisect.insort(libres, fecha)
+
+    def reservar(self, medico_id: int, fecha: datetime, nombre: str, apellido: str) -> None:
+        with self._lock:
+            self._cambiar_estado(medico_id, fecha, RESERVADO)
+            self._pacientes.add((apellido, nombre, fecha))
+
+    def liberar(self, medico_id: int, fecha: datetime, nombre: str, apellido: str) -> None:
+        with self._lock:
+            # Un horario que no está en el índice (p. ej. ya archivado) no vuelve a aparecer
+            if fecha in self._estados.get(medico_id, {}):
+                self._cambiar_estado(medico_id, fecha, DISPONIBLE)
+            self._pacientes.discard((apellido, nombre, fecha))
+
+    def marcar_ocupado(self, medico_id: int, fecha: datetime) -> None:
+        """SQLite rechazó una reserva que el índice creía posible: corregirlo."""
+        with self._lock:
+            self._cambiar_estado(medico_id, fecha, RESERVADO)
+
+    def quitar_horario(self, medico_id: int, fecha: datetime) -> None:
+        with self._lock:
+            if self._estados.get(medico_id, {}).pop(fecha, None) == DISPONIBLE:
+                self._quitar_libre(medico_id, fecha)
+
+    def descartar_anteriores(self, corte: datetime) -> int:
+        """Quita horarios y turnos de pacientes anteriores a 'corte' (ya pasaron al archivo)."""
+        quitados = 0
+        with self._lock:
+            for medico_id, estados in self._estados.items():
+                viejas = [fecha for fecha in estados if fecha < corte]
+                for fecha in viejas:
+                    del estados[fecha]
+                quitados += len(viejas)
+                libres = self._libres.get(medico_id)
+                if libres:
+                    del libres[:bisect.bisect_left(libres, corte)]
+            self._pacientes = {p for p in self._pacientes if p[2] >= corte}
+        return quitados
+
+    def _cambiar_estado(self, medico_id: int, fecha: datetime, estado: str) -> None:
+        estados = self._estados.setdefault(medico_id, {})
+        anterior = estados.get(fecha)
+        estados[fecha] = estado
+        if anterior == estado:
+            return
+        if estado == DISPONIBLE:
+            bisect.insort(self._libres.setdefault(medico_id, []), fecha)
+        elif anterior == DISPONIBLE:
+            self._quitar_libre(medico_id, fecha)
+
+    def _quitar_libre(self, medico_id: int, fecha: datetime) -> None:
+        libres = self._libres.get(medico_id, [])
+        pos = bisect.bisect_left(libres, fecha)
+        if pos < len(libres) and libres[pos] == fecha:
+            del libres[pos]
+
+    # --- Verificación ---
+    def diferencias(self, horarios: Iterable[tuple], turnos_activos: Iterable[tuple]) -> List[str]:
+        """
+        Compara el índice con filas frescas de SQLite (mismo formato que cargar).
+        Devuelve una descripción por cada diferencia; vacío si están sincronizados.
+        """
+        referencia = IndiceHorarios()
+        referencia.cargar(horarios, turnos_activos)
+        problemas = []
+        with self._lock:
+            for medico_id in set(self._estados) | set(referencia._estados):
+                propios = self._estados.get(medico_id, {})
+                esperados = referencia._estados.get(medico_id, {})
+                for fecha in set(propios) | set(esperados):
+                    if propios.get(fecha) != esperados.get(fecha):
+                        problemas.append(f"medico {medico_id} {fecha.isoformat()}: "
+                                         f"índice={propios.get(fecha)} db={esperados.get(fecha)}")
+                if self._libres.get(medico_id, []) != referencia._libres.get(medico_id, []):
+                    problemas.append(f"medico {medico_id}: lista de libres desordenada o incompleta")
+            for apellido, nombre, fecha in self._pacientes ^ referencia._pacientes:
+                problemas.append(f"paciente {nombre} {apellido} {fecha.isoformat()}: "
+                                 f"{'sobra' if (apellido, nombre, fecha) in self._pacientes else 'falta'} en el índice")
+        return problemas
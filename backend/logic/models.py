@@ -8,7 +8,16 @@ class EstadoTurno(Enum):
     ANULADO = "ANULADO"
     FINALIZADO = "FINALIZADO"
 
+class ResultadoReserva(Enum):
+    CONFIRMADA = "CONFIRMADA"
+    PACIENTE_OCUPADO = "PACIENTE_OCUPADO"           # El paciente ya tiene un turno activo a esa hora
+    HORARIO_INEXISTENTE = "HORARIO_INEXISTENTE"     # El médico no atiende en ese horario
+    HORARIO_NO_DISPONIBLE = "HORARIO_NO_DISPONIBLE" # El slot existe pero ya fue tomado
+
 class Medico:
+    # __slots__: sin __dict__ por instancia, menos memoria en listados grandes
+    __slots__ = ('id', 'nombre', 'apellido', 'especialidad')
+
     def __init__(self, 
                  nombre: str, 
                  apellido: str, 
@@ -28,6 +37,8 @@ class Medico:
         }
 
 class Disponibilidad:
+    __slots__ = ('id', 'medico_id', 'fecha_hora', 'estado')
+
     def __init__(self, 
                  medico_id: int, 
                  fecha_hora: datetime, 
@@ -39,6 +50,8 @@ class Disponibilidad:
         self.estado = estado # 'DISPONIBLE', 'RESERVADO'
 
 class Turno:
+    __slots__ = ('id', 'medico_id', 'paciente_nombre', 'paciente_apellido', 'fecha_hora', 'estado')
+
     def __init__(self, 
                  medico_id: int, 
                  paciente_nombre: str, 
@@ -1,12 +1,17 @@
+import contextlib
+import heapq
+import itertools
 from abc import ABC, abstractmethod
-from typing import List, Optional
-from datetime import datetime
+from typing import Callable, Iterator, List, Optional
+from datetime import datetime, timedelta
 
 # --- CORRECCIÓN DE IMPORTS (Sin prefijo 'backend.') ---
 # Asumimos que ejecutamos main.py desde la carpeta backend/
-from logic.models import Turno, Medico, Disponibilidad, EstadoTurno
-from logic.dtos import AgendarTurnoDTO, CrearMedicoDTO, AgregarDisponibilidadDTO
+from logic.models import Turno, Medico, Disponibilidad, EstadoTurno, ResultadoReserva
+from logic.dtos import AgendarTurnoDTO, AgendarTurnosLoteDTO, AnularTurnosLoteDTO, CrearMedicoDTO, AgregarDisponibilidadDTO, AgregarDisponibilidadLoteDTO, GenerarDisponibilidadDTO
 from data.repositories import ITurnosRepository, IMedicoRepository, IDisponibilidadRepository
+from logic.cache import ResponseCache
+from logic.indice_horarios import IndiceHorarios
 
 # --- Interfaz para Notificaciones (Pub/Sub) ---
 class IEventPublisher(ABC):
@@ -14,11 +19,29 @@ class IEventPublisher(ABC):
     def publicar_evento(self, topico: str, mensaje: dict) -> None:
         pass
 
+    def publicar_confirmado(self, topico: str, mensaje: dict, al_confirmar: Callable[[], None]) -> None:
+        """
+        Publica y llama a 'al_confirmar' cuando el broker aceptó el mensaje.
+        Por defecto se confirma apenas se entrega a publicar_evento.
+        """
+        self.publicar_evento(topico, mensaje)
+        al_confirmar()
+
+def _en_orden(indice: Optional[IndiceHorarios]):
+    """Escritura en SQLite + actualización del índice como un solo paso (ver IndiceHorarios.escritura)."""
+    return indice.escritura if indice else contextlib.nullcontext()
+
+
 # --- SERVICIO DE GESTIÓN MÉDICA ---
 class MedicoService:
-    def __init__(self, medico_repo: IMedicoRepository, disp_repo: IDisponibilidadRepository):
+    MAX_HORARIOS_POR_LOTE = 20000
+
+    def __init__(self, medico_repo: IMedicoRepository, disp_repo: IDisponibilidadRepository,
+                 cache: Optional[ResponseCache] = None, indice: Optional[IndiceHorarios] = None):
         self.medico_repo = medico_repo
         self.disp_repo = disp_repo
+        self.cache = cache
+        self.indice = indice
 
     def registrar_medico(self, dto: CrearMedicoDTO) -> Medico:
         nuevo_medico = Medico(
@@ -26,59 +49,195 @@ class MedicoService:
             apellido=dto.apellido, 
             especialidad=dto.especialidad
         )
-        return self.medico_repo.save(nuevo_medico)
+        guardado = self.medico_repo.save(nuevo_medico)
+        if self.cache:
+            self.cache.invalidate(("medicos",))
+        return guardado
 
     def obtener_todos(self) -> List[Medico]:
         return self.medico_repo.find_all()
 
     def agregar_disponibilidad(self, dto: AgregarDisponibilidadDTO) -> Disponibilidad:
-        # Validar duplicados
-        horarios = self.disp_repo.find_by_medico(dto.medico_id)
-        for h in horarios:
-            if h.fecha_hora == dto.fecha_hora:
-                raise ValueError("El médico ya tiene este horario configurado.")
+        # Duplicado evidente: se resuelve en memoria sin escribir en SQLite
+        if self.indice and self.indice.estado(dto.medico_id, dto.fecha_hora) is not None:
+            raise ValueError("El médico ya tiene este horario configurado.")
 
         nueva_disp = Disponibilidad(
             medico_id=dto.medico_id,
             fecha_hora=dto.fecha_hora,
             estado="DISPONIBLE"
         )
-        return self.disp_repo.save(nueva_disp)
+        with _en_orden(self.indice):
+            guardada = self.disp_repo.save(nueva_disp)
+            if self.indice and guardada.id is not None:
+                self.indice.agregar_horarios(dto.medico_id, [dto.fecha_hora])
+
+        # Validar duplicados (lo detecta el índice único de SQLite)
+        if guardada.id is None:
+            raise ValueError("El médico ya tiene este horario configurado.")
+
+        if self.cache:
+            self.cache.invalidate(("disponibilidad", dto.medico_id))
+        return guardada
+
+    def agregar_disponibilidad_lote(self, dto: AgregarDisponibilidadLoteDTO) -> dict:
+        """Carga una lista explícita de horarios. Los repetidos se cuentan, no fallan."""
+        fechas = sorted(set(dto.fechas))
+        if not fechas:
+            raise ValueError("No se indicaron horarios.")
+        if len(fechas) > self.MAX_HORARIOS_POR_LOTE:
+            raise ValueError(f"Máximo {self.MAX_HORARIOS_POR_LOTE} horarios por solicitud.")
+
+        with _en_orden(self.indice):
+            creados = self.disp_repo.save_many(dto.medico_id, fechas)
+            if self.indice and creados:
+                self.indice.agregar_horarios(dto.medico_id, fechas)
+        if self.cache and creados:
+            self.cache.invalidate(("disponibilidad", dto.medico_id))
+        return {"creados": creados, "duplicados": len(dto.fechas) - creados}
 
-    def obtener_disponibilidad(self, medico_id: int) -> List[Disponibilidad]:
-        return self.disp_repo.find_by_medico(medico_id)
+    def generar_disponibilidad(self, dto: GenerarDisponibilidadDTO) -> dict:
+        """
+        Genera horarios recurrentes: para cada día entre 'desde' y 'hasta' cuyo
+        día de semana esté en 'dias_semana', un slot cada 'duracion_minutos'
+        desde 'hora_inicio' hasta 'hora_fin' (el último debe terminar antes del fin).
+        """
+        if dto.hasta < dto.desde:
+            raise ValueError("'hasta' debe ser posterior a 'desde'.")
+        if dto.hora_fin <= dto.hora_inicio:
+            raise ValueError("'hora_fin' debe ser posterior a 'hora_inicio'.")
+        if dto.duracion_minutos <= 0:
+            raise ValueError("'duracion_minutos' debe ser mayor a cero.")
+        if any(d not in range(7) for d in dto.dias_semana):
+            raise ValueError("'dias_semana' usa 0 (lunes) a 6 (domingo).")
+
+        duracion = timedelta(minutes=dto.duracion_minutos)
+        dias = set(dto.dias_semana)
+        fechas = []
+        dia = dto.desde
+        while dia <= dto.hasta:
+            if dia.weekday() in dias:
+                inicio = datetime.combine(dia, dto.hora_inicio)
+                fin = datetime.combine(dia, dto.hora_fin)
+                while inicio + duracion <= fin:
+                    fechas.append(inicio)
+                    inicio += duracion
+                    if len(fechas) > self.MAX_HORARIOS_POR_LOTE:
+                        raise ValueError(f"Máximo {self.MAX_HORARIOS_POR_LOTE} horarios por solicitud.")
+            dia += timedelta(days=1)
+
+        return self.agregar_disponibilidad_lote(AgregarDisponibilidadLoteDTO(dto.medico_id, fechas))
+
+    def obtener_disponibilidad(self, medico_id: int,
+                               desde: Optional[datetime] = None, hasta: Optional[datetime] = None,
+                               estado: Optional[str] = None,
+                               after_fecha_hora: Optional[datetime] = None,
+                               limit: Optional[int] = None, historico: bool = False) -> List[Disponibilidad]:
+        return self.disp_repo.find_by_medico(medico_id, desde, hasta, estado, after_fecha_hora, limit, historico)
+
+    def iterar_disponibilidad(self, medico_id: int, **filtros) -> Iterator[tuple]:
+        """Filas (id, medico_id, fecha_hora, estado) para serializar en streaming."""
+        return self.disp_repo.iter_by_medico(medico_id, **filtros)
+
+    def proximos_horarios_libres(self, medico_id: int, desde: datetime, n: int) -> List[datetime]:
+        """Los primeros 'n' horarios libres desde 'desde' (índice en memoria si está disponible)."""
+        if self.indice:
+            return self.indice.proximos_libres(medico_id, desde, n)
+        return [d.fecha_hora for d in self.disp_repo.find_by_medico(medico_id, desde=desde, estado="DISPONIBLE", limit=n)]
+
+    def proximos_libres_por_especialidad(self, especialidad: str, desde: datetime, k: int) -> List[dict]:
+        """
+        Los 'k' horarios libres más cercanos (fecha >= desde) entre todos los médicos
+        de la especialidad. Con índice: merge de las listas ordenadas de cada médico
+        (cada una recortada a k). Sin índice: una sola consulta a SQLite.
+        """
+        medicos = {m.id: m for m in self.medico_repo.find_by_especialidad(especialidad)}
+        if not medicos:
+            return []
+        if self.indice:
+            por_medico = ([(fecha, medico_id) for fecha in self.indice.proximos_libres(medico_id, desde, k)]
+                          for medico_id in medicos)
+            candidatos = list(itertools.islice(heapq.merge(*por_medico), k))
+        else:
+            candidatos = [(d.fecha_hora, d.medico_id)
+                          for d in self.disp_repo.find_libres_por_medicos(list(medicos), desde, k)]
+        return [{
+            "medico_id": medico_id,
+            "medico": f"{medicos[medico_id].nombre} {medicos[medico_id].apellido}",
+            "especialidad": especialidad,
+            "fecha_hora": fecha,
+        } for fecha, medico_id in candidatos]
 
 
 # --- SERVICIO DE AGENDAMIENTO (Turnos) ---
+TOPICO_NOTIFICACIONES = "notificaciones.medicos"
+
 class AgendamientoService:
+    # Los eventos de turnos no se publican desde aquí: se escriben en el outbox
+    # junto con el cambio y los envía el OutboxRelay (services/outbox.py).
+    # 'event_publisher' queda para eventos que no dependen de una transacción.
+    MAX_TURNOS_POR_LOTE = 500
     def __init__(self, 
                  turno_repo: ITurnosRepository,
                  disp_repo: IDisponibilidadRepository,
-                 event_publisher: IEventPublisher):
+                 event_publisher: IEventPublisher,
+                 cache: Optional[ResponseCache] = None,
+                 indice: Optional[IndiceHorarios] = None):
         self.turno_repo = turno_repo
         self.disp_repo = disp_repo
         self.event_publisher = event_publisher
+        self.cache = cache
+        self.indice = indice
 
-    def agendar_turno(self, dto: AgendarTurnoDTO) -> Turno:
-        # 1. Validar REGLA: Cliente no puede tener cita a la misma hora
-        if self.turno_repo.existe_conflicto_paciente(dto.paciente_nombre, dto.paciente_apellido, dto.fecha_hora):
-            raise ValueError(f"El paciente {dto.paciente_nombre} {dto.paciente_apellido} ya tiene un turno a las {dto.fecha_hora}.")
-
-        # 2. Validar REGLA: El horario del médico debe estar DISPONIBLE
-        horarios = self.disp_repo.find_by_medico(dto.medico_id)
-        slot_encontrado = None
-        for h in horarios:
-            if h.fecha_hora == dto.fecha_hora:
-                slot_encontrado = h
-                break
-        
-        if not slot_encontrado:
-             raise ValueError("El médico no atiende en ese horario.")
-        
-        if slot_encontrado.estado != "DISPONIBLE":
-            raise ValueError("El horario seleccionado ya no está disponible.")
+    def _prever_reserva(self, dto: AgendarTurnoDTO) -> ResultadoReserva:
+        """Resultado esperado según el índice en memoria (SQLite tiene la última palabra)."""
+        if self.indice.paciente_ocupado(dto.paciente_nombre, dto.paciente_apellido, dto.fecha_hora):
+            return ResultadoReserva.PACIENTE_OCUPADO
+        estado = self.indice.estado(dto.medico_id, dto.fecha_hora)
+        if estado is None:
+            return ResultadoReserva.HORARIO_INEXISTENTE
+        if estado != "DISPONIBLE":
+            return ResultadoReserva.HORARIO_NO_DISPONIBLE
+        return ResultadoReserva.CONFIRMADA
+
+    def _sincronizar_indice(self, dto: AgendarTurnoDTO, resultado: ResultadoReserva) -> None:
+        if resultado == ResultadoReserva.CONFIRMADA:
+            self.indice.reservar(dto.medico_id, dto.fecha_hora, dto.paciente_nombre, dto.paciente_apellido)
+        elif resultado == ResultadoReserva.HORARIO_NO_DISPONIBLE:
+            self.indice.marcar_ocupado(dto.medico_id, dto.fecha_hora)
+        elif resultado == ResultadoReserva.HORARIO_INEXISTENTE:
+            self.indice.quitar_horario(dto.medico_id, dto.fecha_hora)
 
-        # 3. Crear el Turno
+    @staticmethod
+    def _evento_agendado(dto: AgendarTurnoDTO) -> tuple:
+        return TOPICO_NOTIFICACIONES, {
+            "tipo": "TURNO_AGENDADO",
+            "medico_id": dto.medico_id,
+            "paciente": f"{dto.paciente_nombre} {dto.paciente_apellido}",
+            "fecha": dto.fecha_hora.isoformat(),
+            "mensaje": "Nueva cita agendada"
+        }
+
+    @staticmethod
+    def _evento_cancelado(turno: Turno) -> tuple:
+        return TOPICO_NOTIFICACIONES, {
+            "tipo": "TURNO_CANCELADO",
+            "medico_id": turno.medico_id,
+            "paciente": f"{turno.paciente_nombre} {turno.paciente_apellido}",
+            "fecha": turno.fecha_hora.isoformat(),
+            "mensaje": "Cita cancelada por el paciente"
+        }
+
+    @staticmethod
+    def _motivo_rechazo(dto: AgendarTurnoDTO, resultado: ResultadoReserva) -> str:
+        if resultado == ResultadoReserva.PACIENTE_OCUPADO:
+            return f"El paciente {dto.paciente_nombre} {dto.paciente_apellido} ya tiene un turno a las {dto.fecha_hora}."
+        if resultado == ResultadoReserva.HORARIO_INEXISTENTE:
+            return "El médico no atiende en ese horario."
+        return "El horario seleccionado ya no está disponible."
+
+    def agendar_turno(self, dto: AgendarTurnoDTO) -> Turno:
+        # 1. Crear el Turno
         nuevo_turno = Turno(
             medico_id=dto.medico_id,
             paciente_nombre=dto.paciente_nombre,
@@ -86,22 +245,75 @@ class AgendamientoService:
             fecha_hora=dto.fecha_hora,
             estado=EstadoTurno.CONFIRMADO
         )
-        
-        # 4. Guardar
-        turno_guardado = self.turno_repo.save(nuevo_turno)
-        self.disp_repo.marcar_reservada(dto.medico_id, dto.fecha_hora)
 
-        # 5. Notificar
-        evento = {
-            "tipo": "TURNO_AGENDADO",
-            "medico_id": dto.medico_id,
-            "paciente": f"{dto.paciente_nombre} {dto.paciente_apellido}",
-            "fecha": dto.fecha_hora.isoformat(),
-            "mensaje": "Nueva cita agendada"
-        }
-        self.event_publisher.publicar_evento("notificaciones.medicos", evento)
+        # 2. Reservar de forma atómica (valida REGLAS de paciente y de horario);
+        # el evento de notificación viaja en la misma transacción que el turno.
+        # Con índice, los rechazos evidentes no llegan a tomar el lock de escritura.
+        resultado = self._prever_reserva(dto) if self.indice else ResultadoReserva.CONFIRMADA
+        if resultado == ResultadoReserva.CONFIRMADA:
+            with _en_orden(self.indice):
+                resultado = self.turno_repo.reservar(nuevo_turno, self._evento_agendado(dto))
+                if self.indice:
+                    self._sincronizar_indice(dto, resultado)
+
+        if resultado != ResultadoReserva.CONFIRMADA:
+            raise ValueError(self._motivo_rechazo(dto, resultado))
+
+        if self.cache:
+            self.cache.invalidate(("disponibilidad", dto.medico_id))
+
+        return nuevo_turno
 
-        return turno_guardado
+    def agendar_turnos_lote(self, dto: AgendarTurnosLoteDTO) -> dict:
+        """
+        Reserva varios turnos (centrales de turnos, derivaciones) en una sola
+        transacción. Cada ítem se valida con las mismas reglas que agendar_turno,
+        también contra los demás ítems del lote, y los rechazados no impiden los otros.
+        Devuelve un resultado por ítem, en el orden recibido.
+        """
+        if not dto.turnos:
+            raise ValueError("No se indicaron turnos.")
+        if len(dto.turnos) > self.MAX_TURNOS_POR_LOTE:
+            raise ValueError(f"Máximo {self.MAX_TURNOS_POR_LOTE} turnos por solicitud.")
+
+        resultados: List[Optional[ResultadoReserva]] = [None] * len(dto.turnos)
+        pendientes = []  # (posición, dto, turno) que van a SQLite
+        for i, item in enumerate(dto.turnos):
+            if self.indice:
+                resultados[i] = self._prever_reserva(item)
+                if resultados[i] != ResultadoReserva.CONFIRMADA:
+                    continue
+            pendientes.append((i, item, Turno(
+                medico_id=item.medico_id,
+                paciente_nombre=item.paciente_nombre,
+                paciente_apellido=item.paciente_apellido,
+                fecha_hora=item.fecha_hora,
+                estado=EstadoTurno.CONFIRMADO
+            )))
+
+        if pendientes:
+            with _en_orden(self.indice):
+                confirmados = self.turno_repo.reservar_lote(
+                    [turno for _, _, turno in pendientes],
+                    [self._evento_agendado(item) for _, item, _ in pendientes])
+                for (i, item, _), resultado in zip(pendientes, confirmados):
+                    resultados[i] = resultado
+                    if self.indice:
+                        self._sincronizar_indice(item, resultado)
+
+        if self.cache:
+            for medico_id in {t.medico_id for _, _, t in pendientes if t.id is not None}:
+                self.cache.invalidate(("disponibilidad", medico_id))
+
+        turnos_por_posicion = {i: turno for i, _, turno in pendientes}
+        items = []
+        for i, (item, resultado) in enumerate(zip(dto.turnos, resultados)):
+            if resultado == ResultadoReserva.CONFIRMADA:
+                items.append({"indice": i, "resultado": resultado.value, "id": turnos_por_posicion[i].id})
+            else:
+                items.append({"indice": i, "resultado": resultado.value, "error": self._motivo_rechazo(item, resultado)})
+        confirmados = sum(1 for r in resultados if r == ResultadoReserva.CONFIRMADA)
+        return {"confirmados": confirmados, "rechazados": len(items) - confirmados, "resultados": items}
 
     def anular_turno(self, turno_id: int) -> None:
         turno = self.turno_repo.find_by_id(turno_id)
@@ -111,18 +323,62 @@ class AgendamientoService:
         if turno.estado == EstadoTurno.ANULADO:
             return 
 
+        # Turno ANULADO + slot liberado + evento en el outbox, todo o nada.
+        # Si otro request lo anuló primero, no se emite un segundo evento.
+        with _en_orden(self.indice):
+            if not self.turno_repo.anular(turno, self._evento_cancelado(turno)):
+                return
+            if self.indice:
+                self.indice.liberar(turno.medico_id, turno.fecha_hora, turno.paciente_nombre, turno.paciente_apellido)
         turno.estado = EstadoTurno.ANULADO
-        self.turno_repo.save(turno)
-        self.disp_repo.marcar_disponible(turno.medico_id, turno.fecha_hora)
+        if self.cache:
+            self.cache.invalidate(("disponibilidad", turno.medico_id))
 
-        evento = {
-            "tipo": "TURNO_CANCELADO",
-            "medico_id": turno.medico_id,
-            "paciente": f"{turno.paciente_nombre} {turno.paciente_apellido}",
-            "fecha": turno.fecha_hora.isoformat(),
-            "mensaje": "Cita cancelada por el paciente"
-        }
-        self.event_publisher.publicar_evento("notificaciones.medicos", evento)
+    def anular_turnos_lote(self, dto: AnularTurnosLoteDTO) -> dict:
+        """
+        Anula varios turnos en una sola transacción. Resultado por ítem:
+        ANULADO, YA_ANULADO (incluye ids repetidos en el lote) o NO_ENCONTRADO.
+        """
+        if not dto.turno_ids:
+            raise ValueError("No se indicaron turnos.")
+        if len(dto.turno_ids) > self.MAX_TURNOS_POR_LOTE:
+            raise ValueError(f"Máximo {self.MAX_TURNOS_POR_LOTE} turnos por solicitud.")
+
+        existentes = self.turno_repo.find_by_ids(list(set(dto.turno_ids)))
+        ya_anulados = {i for i, t in existentes.items() if t.estado == EstadoTurno.ANULADO}
+        # Un ítem por posición (los repetidos también): la base decide cuál anula primero
+        activos = [existentes[i] for i in dto.turno_ids if i in existentes and i not in ya_anulados]
+
+        items = []
+        with _en_orden(self.indice):
+            anulados = iter(self.turno_repo.anular_lote(activos, [self._evento_cancelado(t) for t in activos])
+                            if activos else ())
+            for turno_id in dto.turno_ids:
+                turno = existentes.get(turno_id)
+                if turno is None:
+                    items.append({"id": turno_id, "resultado": "NO_ENCONTRADO"})
+                elif turno_id in ya_anulados or not next(anulados):
+                    items.append({"id": turno_id, "resultado": "YA_ANULADO"})
+                else:
+                    turno.estado = EstadoTurno.ANULADO
+                    if self.indice:
+                        self.indice.liberar(turno.medico_id, turno.fecha_hora, turno.paciente_nombre, turno.paciente_apellido)
+                    items.append({"id": turno_id, "resultado": "ANULADO"})
+
+        if self.cache:
+            for medico_id in {t.medico_id for t in activos}:
+                self.cache.invalidate(("disponibilidad", medico_id))
+        anulados_total = sum(1 for item in items if item["resultado"] == "ANULADO")
+        return {"anulados": anulados_total, "rechazados": len(items) - anulados_total, "resultados": items}
+
+    def listar_por_paciente(self, nombre: str, apellido: str,
+                            desde: Optional[datetime] = None, hasta: Optional[datetime] = None,
+                            estado: Optional[str] = None,
+                            after_fecha_hora: Optional[datetime] = None, after_id: Optional[int] = None,
+                            limit: Optional[int] = None, historico: bool = False) -> List[Turno]:
+        return self.turno_repo.find_by_paciente(nombre, apellido, desde, hasta, estado,
+                                                after_fecha_hora, after_id, limit, historico)
 
-    def listar_por_paciente(self, nombre: str, apellido: str) -> List[Turno]:
-        return self.turno_repo.find_by_paciente(nombre, apellido)
\ No newline at end of file
+    def iterar_por_paciente(self, nombre: str, apellido: str, **filtros) -> Iterator[tuple]:
+        """Filas (id, medico_id, fecha_hora, estado) para serializar en streaming."""
+        return self.turno_repo.iter_by_paciente(nombre, apellido, **filtros)
\ No newline at end of file
@@ -1,243 +1,872 @@
 import http.server
+import itertools
 import socketserver
 import json
-import re
+import queue
+import selectors
+import signal
+import socket
+import threading
 import os
+import sys
 import time
-from urllib.parse import urlparse, parse_qs
-from datetime import datetime, date
+from typing import Optional
+from urllib.parse import parse_qs
+from datetime import datetime, date, time as dtime
 
 # --- IMPORTS DE CAPAS ---
 from data.database import DatabaseConfig
-from data.repositories import SqliteMedicoRepository, SqliteTurnosRepository, SqliteDisponibilidadRepository
+from data.repositories import SqliteMedicoRepository, SqliteTurnosRepository, SqliteDisponibilidadRepository, SqliteOutboxRepository, SqliteArchivoRepository
 from logic.services import MedicoService, AgendamientoService
-from logic.dtos import CrearMedicoDTO, AgregarDisponibilidadDTO, AgendarTurnoDTO
+from logic.cache import ResponseCache
+from logic.indice_horarios import IndiceHorarios
+from logic.dtos import CrearMedicoDTO, AgregarDisponibilidadDTO, AgendarTurnoDTO, AgendarTurnosLoteDTO, AnularTurnosLoteDTO, AgregarDisponibilidadLoteDTO, GenerarDisponibilidadDTO
 from logic.models import EstadoTurno
-from services.messaging import RabbitMQMessageBroker
+from services.memoria import InMemoryMessageBroker
+from services.outbox import OutboxRelay
+from services.archivador import Archivador
+from respuestas import RecursoEstatico, negociar, acepta_gzip, comprimir_stream, enmarcar_chunked, JsonArrayStream, evento_sse, last_event_id
+from respuestas import SSE_HEARTBEAT, SSE_WRITE_TIMEOUT, HEARTBEAT_SSE
+import metricas
+from metricas import REGISTRO, JSON_DURACION, API_DURACION, observar_request
+from router import Router, Campo, Objeto, ErrorHttp
 
 # Configuración
-PORT = 8000
+PORT = int(os.environ.get('HOSPITAL_PORT', '8000'))
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FRONTEND_PATH = os.path.join(BASE_DIR, '..', 'frontend', 'index.html')
+# Modo de servidor: 'threading' (por defecto) o 'asyncio' (ver async_server.py)
+SERVER_MODE = os.environ.get('HOSPITAL_SERVER_MODE', 'threading')
+# Broker de eventos: 'rabbitmq' (por defecto) o 'memoria' (un solo proceso, sin RabbitMQ)
+BROKER = os.environ.get('HOSPITAL_BROKER', 'rabbitmq')
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL = float(os.environ.get('HOSPITAL_CACHE_TTL', '30'))  # Segundos
+# Índice de agenda en memoria. Con varios procesos (prefork.py) cada uno tendría
+# su propia copia sin enterarse de las escrituras de los demás, así que se apaga.
+USAR_INDICE_MEMORIA = os.environ.get('HOSPITAL_INDICE_MEMORIA', '1') == '1'
+HTTP_WORKERS = int(os.environ.get('HOSPITAL_HTTP_WORKERS', '32'))  # Hilos que atienden conexiones HTTP
+IDLE_TIMEOUT = float(os.environ.get('HOSPITAL_IDLE_TIMEOUT', '5'))  # Segundos de una conexión keep-alive sin requests
+READ_TIMEOUT = 5.0  # Segundos para terminar de recibir un request ya empezado (ocupa un hilo mientras tanto)
+MAX_BODY = 1024 * 1024  # 1 MB máximo por cuerpo JSON (el mismo tope que el servidor asyncio)
+HTTP_QUEUE_SIZE = int(os.environ.get('HOSPITAL_HTTP_QUEUE', '256'))  # Requests listos para leer esperando un hilo libre
+HTTP_QUEUE_TIMEOUT = 2.0  # Segundos en cola tras los cuales un request se rechaza en vez de atenderse
+HTTP_MAX_CONEXIONES = int(os.environ.get('HOSPITAL_HTTP_MAX_CONEXIONES', '4096'))  # Conexiones keep-alive inactivas
+SSE_MAX = int(os.environ.get('HOSPITAL_SSE_MAX', '500'))  # Streams SSE simultáneos (hilos aparte del pool)
+RETRY_AFTER = 1  # Segundos sugeridos al cliente en las respuestas 503
+LISTEN_BACKLOG = 1024  # Conexiones en espera de accept() antes de que el kernel empiece a descartar SYN
+# Archivo histórico: días de agenda pasada que quedan en las tablas calientes y
+# cada cuánto se mueve lo anterior a las particiones mensuales (0 = no archivar)
+ARCHIVO_DIAS = int(os.environ.get('HOSPITAL_ARCHIVO_DIAS', '30'))
+ARCHIVO_INTERVALO = float(os.environ.get('HOSPITAL_ARCHIVO_INTERVALO', '3600'))  # Segundos
+MAX_PAGE_SIZE = 1000  # Tope para el parámetro 'limit' de los listados
+# Columnas (en orden) de las filas de disponibilidad y turnos en los listados JSON
+COLUMNAS_LISTADO = ("id", "medico_id", "fecha_hora", "estado")
 
 # ==========================================
 # 1. INICIALIZACIÓN
 # ==========================================
 print("--- ⚙️ Iniciando Sistema Hospitalario (Real-Time) ---")
 
+# Sin archivador no se crea hospital_archivo.db (si ya existe, se sigue leyendo)
+DatabaseConfig.crear_archivo = ARCHIVO_INTERVALO > 0
 DatabaseConfig.initialize_db()
 
 medico_repo = SqliteMedicoRepository()
 disp_repo = SqliteDisponibilidadRepository()
 turno_repo = SqliteTurnosRepository()
-broker = RabbitMQMessageBroker()
+if BROKER == 'memoria':
+    broker = InMemoryMessageBroker()
+else:
+    # pika solo hace falta en este modo
+    from services.messaging import RabbitMQMessageBroker
+    broker = RabbitMQMessageBroker()
+print(f"📡 Broker de eventos: {type(broker).__name__}")
+# Caché de lecturas (/api/medicos y /api/disponibilidad), invalidada por los servicios
+response_cache = ResponseCache(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
 
-medico_service = MedicoService(medico_repo, disp_repo)
-agendamiento_service = AgendamientoService(turno_repo, disp_repo, broker)
+# Agenda en memoria (horarios libres y turnos por paciente), cargada desde SQLite
+indice_horarios = None
+if USAR_INDICE_MEMORIA:
+    indice_horarios = IndiceHorarios()
+    indice_horarios.cargar(disp_repo.iter_todos(), turno_repo.iter_activos())
+    print(f"🗂️ [INDICE] {indice_horarios.total_horarios()} horarios cargados en memoria")
+
+medico_service = MedicoService(medico_repo, disp_repo, response_cache, indice_horarios)
+agendamiento_service = AgendamientoService(turno_repo, disp_repo, broker, response_cache, indice_horarios)
+# Los eventos de turnos se guardan en el outbox (misma transacción) y este hilo los publica
+outbox_relay = OutboxRelay(SqliteOutboxRepository(), broker)
+outbox_relay.iniciar()
+
+
+def al_archivar(corte: datetime) -> None:
+    # Lo archivado ya no está en las tablas calientes: tampoco en las copias en memoria
+    if indice_horarios:
+        indice_horarios.descartar_anteriores(corte)
+    response_cache.clear()
+
+
+# Mueve turnos y horarios viejos a las particiones mensuales del archivo (+ ANALYZE / VACUUM)
+archivador = None
+if ARCHIVO_INTERVALO > 0:
+    # Con prefork.py todos los workers comparten el lock: solo uno archiva
+    archivador = Archivador(SqliteArchivoRepository(), ARCHIVO_DIAS, ARCHIVO_INTERVALO, al_archivar=al_archivar,
+                            lock_path=DatabaseConfig.archive_path() + ".lock")
+    archivador.iniciar()
+
+
+# Lo que cada componente ya cuenta, expuesto en /api/metrics
+metricas.registrar_componente("hospital_db_pool", "Pool SQLite", DatabaseConfig.pool_metrics,
+                              contadores=("acquired", "reused", "waits", "timeouts", "created"),
+                              gauges=("in_use", "idle", "max_size"))
+metricas.registrar_componente("hospital_cache", "Caché de respuestas", response_cache.metrics,
+                              contadores=("hits", "misses", "invalidaciones", "expulsiones"),
+                              gauges=("entradas",))
+metricas.registrar_componente("hospital_outbox", "Relay del outbox", outbox_relay.metrics,
+                              contadores=("reclamados", "confirmados", "errores", "omitidos_en_vuelo"),
+                              gauges=("por_borrar", "en_vuelo"))
+metricas.registrar_componente("hospital_broker", "Broker de eventos", broker.metrics,
+                              contadores=("encolados", "publicados", "errores", "descartados", "reconexiones", "rechazados",
+                                          "sse_descartados"),
+                              gauges=("suscriptores", "medicos_suscritos", "pendientes"))
+if archivador:
+    metricas.registrar_componente("hospital_archivo", "Archivador", archivador.metrics,
+                                  contadores=("ejecuciones", "turnos_archivados", "disponibilidad_archivados",
+                                              "vacuums", "errores"),
+                                  gauges=("lider", "turnos_calientes", "disponibilidad_calientes", "particiones",
+                                          "duracion_segundos"))
+
+
+def apagar_servicios():
+    if archivador:
+        archivador.detener()
+    outbox_relay.detener()   # No reclamar más eventos
+    broker.cerrar()          # Vaciar lo encolado (dispara las confirmaciones)
+    outbox_relay.cerrar()    # Borrar del outbox lo que se confirmó en el vaciado
 
 print("--- ✅ Dependencias cargadas ---")
 
 # ==========================================
-# 2. CONTROLADOR HTTP
+# 2. RUTAS DE LA API (independientes del servidor)
+# ==========================================
+def json_serial(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, EstadoTurno):
+        return obj.value
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+
+def serializar_json(data) -> bytes:
+    inicio = time.perf_counter()
+    cuerpo = json.dumps(data, default=json_serial).encode('utf-8')
+    JSON_DURACION.observar(time.perf_counter() - inicio)
+    return cuerpo
+
+
+# Filtros opcionales de listados: desde / hasta (ISO, rango [desde, hasta)),
+# estado, paginación por cursor after_fecha_hora / limit e historico=1 para
+# incluir lo ya archivado (por defecto solo se lee la agenda vigente)
+FILTROS_LISTADO = (
+    Campo('desde', datetime), Campo('hasta', datetime),
+    Campo('after_fecha_hora', datetime), Campo('limit', int, minimo=1, maximo=MAX_PAGE_SIZE),
+    Campo('historico', bool),
+)
+
+router = Router()
+
+
+def medir_handler(solicitud, siguiente):
+    # Tiempo de la lógica de cada ruta (sin la escritura de la respuesta), etiquetado por plantilla
+    inicio = time.perf_counter()
+    resultado = siguiente(solicitud)
+    API_DURACION.observar(time.perf_counter() - inicio, solicitud.metodo, solicitud.ruta.plantilla)
+    return resultado
+
+
+router.usar(medir_handler)
+
+
+# --- GET ---
+# Listar Médicos
+@router.ruta('GET', '/api/medicos')
+def listar_medicos(s):
+    return 200, response_cache.get_or_compute(
+        ("medicos",),
+        lambda: serializar_json([m.to_dict() for m in medico_service.obtener_todos()]))
+
+
+# Consultar Disponibilidad
+@router.ruta('GET', '/api/disponibilidad', query=(
+        Campo('medico_id', int, requerido=True),
+        Campo('estado', opciones=('DISPONIBLE', 'RESERVADO')), *FILTROS_LISTADO))
+def consultar_disponibilidad(s):
+    filtros = dict(s.query)
+    medico_id = filtros.pop('medico_id')
+    if not filtros:
+        clave = ("disponibilidad", medico_id)
+    elif set(filtros) <= {'estado', 'desde', 'hasta'} and all(
+            filtros.get(campo) is None or filtros[campo].time() == dtime.min for campo in ('desde', 'hasta')):
+        # Vista por días completos (la del paciente: libres de hoy a una semana): cacheable,
+        # la invalida la misma escritura que invalida el calendario del médico
+        clave = ("disponibilidad", medico_id, filtros.get('estado'), filtros.get('desde'), filtros.get('hasta'))
+    else:
+        # Rangos a la hora, cursores o histórico: directo a SQL, por lotes
+        return 200, JsonArrayStream(
+            medico_service.iterar_disponibilidad(medico_id, **filtros), COLUMNAS_LISTADO)
+    return 200, response_cache.get_or_compute(
+        clave,
+        lambda: serializar_json([{
+            "id": h.id, "medico_id": h.medico_id,
+            "fecha_hora": h.fecha_hora, "estado": h.estado
+        } for h in medico_service.obtener_disponibilidad(medico_id, **filtros)]))
+
+
+# Próximos horarios libres de una especialidad (todos sus médicos en una sola consulta)
+@router.ruta('GET', '/api/disponibilidad/proximos', query=(
+        Campo('especialidad', requerido=True), Campo('desde', datetime),
+        Campo('limit', int, defecto=10, minimo=1, maximo=MAX_PAGE_SIZE)))
+def proximos_por_especialidad(s):
+    desde = s.query.get('desde') or datetime.now().replace(microsecond=0)
+    return 200, medico_service.proximos_libres_por_especialidad(s.query['especialidad'], desde, s.query['limit'])
+
+
+# Buscar Turnos
+@router.ruta('GET', '/api/turnos', query=(
+        Campo('nombre', requerido=True), Campo('apellido', requerido=True),
+        Campo('estado', opciones=[e.value for e in EstadoTurno]), Campo('after_id', int), *FILTROS_LISTADO))
+def buscar_turnos(s):
+    filtros = dict(s.query)
+    nombre, apellido = filtros.pop('nombre'), filtros.pop('apellido')
+    return 200, JsonArrayStream(
+        agendamiento_service.iterar_por_paciente(nombre, apellido, **filtros), COLUMNAS_LISTADO)
+
+
+# --- POST ---
+@router.ruta('POST', '/api/medicos', cuerpo=(
+        Campo('nombre', requerido=True), Campo('apellido', requerido=True), Campo('especialidad', requerido=True)))
+def registrar_medico(s):
+    nuevo = medico_service.registrar_medico(CrearMedicoDTO(**s.cuerpo))
+    return 201, nuevo.to_dict()
+
+
+@router.ruta('POST', '/api/disponibilidad', cuerpo=(
+        Campo('medico_id', int, requerido=True), Campo('fecha_hora', datetime, requerido=True)))
+def agregar_disponibilidad(s):
+    nuevo = medico_service.agregar_disponibilidad(AgregarDisponibilidadDTO(**s.cuerpo))
+    return 201, {"mensaje": "Disponibilidad creada", "id": nuevo.id}
+
+
+# Carga masiva: lista explícita ("fechas") o agenda recurrente
+CAMPOS_AGENDA_RECURRENTE = ('desde', 'hasta', 'dias_semana', 'hora_inicio', 'hora_fin', 'duracion_minutos')
+
+
+@router.ruta('POST', '/api/disponibilidad/lote', cuerpo=(
+        Campo('medico_id', int, requerido=True), Campo('fechas', [datetime]),
+        Campo('desde', date), Campo('hasta', date), Campo('dias_semana', [int]),
+        Campo('hora_inicio', dtime), Campo('hora_fin', dtime), Campo('duracion_minutos', int)))
+def agregar_disponibilidad_lote(s):
+    datos = s.cuerpo
+    if 'fechas' in datos:
+        resultado = medico_service.agregar_disponibilidad_lote(
+            AgregarDisponibilidadLoteDTO(datos['medico_id'], datos['fechas']))
+    else:
+        for campo in CAMPOS_AGENDA_RECURRENTE:
+            if campo not in datos:
+                raise ErrorHttp(400, f"Falta parametro {campo} (o 'fechas')")
+        resultado = medico_service.generar_disponibilidad(GenerarDisponibilidadDTO(**datos))
+    return 201, {"mensaje": "Disponibilidad creada", **resultado}
+
+
+CAMPOS_TURNO = (
+    Campo('medico_id', int, requerido=True), Campo('paciente_nombre', requerido=True),
+    Campo('paciente_apellido', requerido=True), Campo('fecha_hora', datetime, requerido=True),
+)
+
+
+# Conflictos de negocio (horario ocupado, turno duplicado) -> 409
+@router.ruta('POST', '/api/turnos', status_valor=409, cuerpo=CAMPOS_TURNO)
+def agendar_turno(s):
+    turno = agendamiento_service.agendar_turno(AgendarTurnoDTO(**s.cuerpo))
+    return 201, {"mensaje": "Turno confirmado", "id": turno.id}
+
+
+# Lotes (centrales de turnos, derivaciones): una transacción, resultado por ítem.
+# Los conflictos van en cada ítem; la respuesta es 200 aunque alguno se rechace.
+@router.ruta('POST', '/api/turnos/lote', cuerpo=(Campo('turnos', [Objeto(*CAMPOS_TURNO)], requerido=True),))
+def agendar_turnos_lote(s):
+    dto = AgendarTurnosLoteDTO([AgendarTurnoDTO(**item) for item in s.cuerpo['turnos']])
+    return 200, agendamiento_service.agendar_turnos_lote(dto)
+
+
+@router.ruta('POST', '/api/turnos/anular', cuerpo=(Campo('turno_ids', [int], requerido=True),))
+def anular_turnos_lote(s):
+    return 200, agendamiento_service.anular_turnos_lote(AnularTurnosLoteDTO(s.cuerpo['turno_ids']))
+
+
+# --- DELETE ---
+@router.ruta('DELETE', '/api/turnos/{turno_id:int}', status_valor=404)
+def anular_turno(s):
+    agendamiento_service.anular_turno(s.params['turno_id'])
+    return 200, {"mensaje": "Turno anulado"}
+
+
+def procesar_api(metodo: str, path: str, query: str = '', cuerpo: bytes = b''):
+    """
+    Ejecuta una ruta JSON y devuelve (status, data).
+    'data' puede venir ya serializado (bytes) cuando sale de la caché, o ser
+    un JsonArrayStream que el servidor escribe por bloques a medida que lee
+    lotes de SQLite (sin retener una conexión del pool entre lote y lote).
+    La usan tanto HospitalHTTPHandler como el servidor asyncio, así ambos
+    mantienen exactamente los mismos contratos. 'query' es el query string
+    sin parsear: solo lo parsean las rutas que declaran parámetros.
+    """
+    return router.despachar(metodo, path, query, cuerpo)
+
+
+# Rutas que los servidores atienden antes del router (etiqueta 'route' en /api/metrics)
+RUTAS_FIJAS = {
+    ('GET', ''): '/', ('GET', '/'): '/', ('GET', '/index.html'): '/',
+    ('GET', '/api/metrics'): '/api/metrics',
+    ('GET', '/api/notificaciones'): '/api/notificaciones',
+}
+
+
+def ruta_metricas(metodo: str, path: str) -> Optional[str]:
+    """
+    Plantilla con la que se etiqueta un request en las métricas, o None si no
+    coincidió con ninguna ruta. Los preflight OPTIONS (se responden para
+    cualquier URL) van todos a '*'.
+    """
+    if metodo == 'OPTIONS':
+        return '*'
+    path = path.partition('?')[0].rstrip('/')
+    return RUTAS_FIJAS.get((metodo, path)) or router.plantilla(metodo, path)
+
+
+# El frontend se sirve desde memoria (ya comprimido); se relee solo si cambia en disco
+frontend = RecursoEstatico(FRONTEND_PATH)
+
+JSON_HEADERS = [
+    ('Content-type', 'application/json'),
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type'),
+]
+
+
+# ==========================================
+# 3. CONTROLADOR HTTP
 # ==========================================
 class HospitalHTTPHandler(http.server.BaseHTTPRequestHandler):
-    
-    def _send_response(self, data, status=200):
+    # Conexiones persistentes: el frontend carga médicos, disponibilidad y turnos por el mismo socket.
+    # Toda respuesta lleva Content-Length o va chunked; las que no pueden (SSE) cierran la conexión.
+    # Entre requests la conexión no ocupa un hilo: espera en el selector de PoolHTTPServer.
+    protocol_version = 'HTTP/1.1'
+    timeout = READ_TIMEOUT
+    # Headers y cuerpo salen en dos write(): con Nagle + ACK retardado, en una
+    # conexión persistente cada respuesta esperaría ~40 ms
+    disable_nagle_algorithm = True
+    stream_pendiente = None  # SSE: lo continúa un hilo propio (ver PoolHTTPServer)
+
+    def handle_one_request(self):
+        # Latencia por ruta para /api/metrics (las conexiones SSE no cuentan: duran lo que el cliente quiera)
+        self._status = None
+        inicio = time.perf_counter()
+        super().handle_one_request()
+        path = getattr(self, 'path', None)
+        if self._status is not None and self.command and not path.startswith('/api/notificaciones'):
+            observar_request(self.command, ruta_metricas(self.command, path), self._status,
+                             time.perf_counter() - inicio)
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def _send_body(self, cuerpo, headers, status=200, etag=None, cuerpo_gzip=None):
+        """Envía un cuerpo aplicando ETag / If-None-Match y gzip según el request."""
+        status, extra, cuerpo = negociar(
+            self.command, status, cuerpo,
+            self.headers.get('If-None-Match'), self.headers.get('Accept-Encoding'),
+            etag, cuerpo_gzip
+        )
         self.send_response(status)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        for clave, valor in headers + extra:
+            self.send_header(clave, valor)
+        if status != 304:
+            self.send_header('Content-Length', str(len(cuerpo)))
         self.end_headers()
-        
-        def json_serial(obj):
-            if isinstance(obj, (datetime, date)):
-                return obj.isoformat()
-            if isinstance(obj, EstadoTurno):
-                return obj.value
-            raise TypeError(f"Type {type(obj)} not serializable")
+        if cuerpo:
+            self.wfile.write(cuerpo)
+
+    def _send_response(self, data, status=200):
+        cuerpo = data if isinstance(data, bytes) else serializar_json(data)
+        self._send_body(cuerpo, JSON_HEADERS, status)
 
-        self.wfile.write(json.dumps(data, default=json_serial).encode('utf-8'))
+    def _send_error(self, message, status=400, headers=()):
+        try:
+            self._send_body(json.dumps({"error": message}).encode('utf-8'), JSON_HEADERS + list(headers), status)
+        except OSError:
+            self.close_connection = True
+
+    def _send_stream(self, stream, headers, status=200):
+        """
+        Escribe un JsonArrayStream por bloques: chunked en HTTP/1.1, o hasta
+        cerrar la conexión en HTTP/1.0. Comprime al vuelo si el cliente acepta gzip.
+        """
+        bloques = iter(stream)
+        try:
+            # El primer bloque ejecuta la consulta: si falla aún podemos responder 500
+            primero = next(bloques)
+        except Exception as e:
+            bloques.close()
+            self._send_error(str(e), 500)
+            return
 
-    def _send_error(self, message, status=400):
+        salida = itertools.chain([primero], bloques)
+        self.send_response(status)
+        for clave, valor in headers:
+            self.send_header(clave, valor)
+        self.send_header('Vary', 'Accept-Encoding')
+        if acepta_gzip(self.headers.get('Accept-Encoding')):
+            self.send_header('Content-Encoding', 'gzip')
+            salida = comprimir_stream(salida)
+        if self.request_version == 'HTTP/1.1' and self.protocol_version == 'HTTP/1.1':
+            self.send_header('Transfer-Encoding', 'chunked')
+            salida = enmarcar_chunked(salida)
+        else:
+            self.close_connection = True
+        self.end_headers()
         try:
-            self.send_response(status)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": message}).encode('utf-8'))
-        except: pass
+            for bloque in salida:
+                self.wfile.write(bloque)
+        finally:
+            bloques.close()
+
+    def _send_api_result(self, status, data):
+        if isinstance(data, JsonArrayStream):
+            self._send_stream(data, JSON_HEADERS, status)
+        elif status >= 400 and isinstance(data, dict) and "error" in data:
+            self._send_error(data["error"], status)
+        else:
+            self._send_response(data, status)
 
     def _serve_frontend(self):
         try:
-            with open(FRONTEND_PATH, 'rb') as file:
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-                self.wfile.write(file.read())
+            cuerpo, cuerpo_gzip, etag = frontend.obtener()
         except FileNotFoundError:
             self._send_error(f"Error: No se encuentra frontend/index.html", 404)
+            return
+        self._send_body(cuerpo, [('Content-type', 'text/html')], 200, etag, cuerpo_gzip)
 
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
     # --- GET ---
     def do_GET(self):
-        parsed_url = urlparse(self.path)
-        path = parsed_url.path.rstrip('/')
-        query_params = parse_qs(parsed_url.query)
+        path, _, query = self.path.partition('?')
+        path = path.rstrip('/')
 
         if path == '' or path == '/' or path == '/index.html':
             self._serve_frontend()
             return
 
+        if path == '/api/metrics':
+            self._send_body(REGISTRO.exportar(), [('Content-type', metricas.CONTENT_TYPE)])
+            return
+
         # API: NOTIFICACIONES REAL-TIME (SSE)
         if path == '/api/notificaciones':
+            query_params = parse_qs(query)
             medico_id = query_params.get('medico_id', [None])[0]
             if not medico_id:
                 self._send_error("Falta medico_id", 400)
                 return
+            if not medico_id.isdigit():
+                self._send_error("medico_id invalido", 400)
+                return
 
-            # Configuración de Headers para Server-Sent Events
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/event-stream')
-            self.send_header('Cache-Control', 'no-cache')
-            self.send_header('Connection', 'keep-alive')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-
-            # Suscribirse al broker
-            cola_mensajes = broker.suscribir(int(medico_id))
+            # Cupo propio de streams: un pico de clientes SSE no deja sin hilos a la API
+            if not self.server.reservar_sse():
+                self.close_connection = True
+                self._send_error("Demasiadas conexiones de notificaciones, reintente en unos segundos", 503,
+                                 [('Retry-After', str(RETRY_AFTER))])
+                return
 
             try:
-                while True:
-                    # Esperamos mensaje (bloqueante pero eficiente)
-                    mensaje = cola_mensajes.get()
-                    
-                    # Formato SSE: "data: {json}\n\n"
-                    payload = f"data: {json.dumps(mensaje)}\n\n"
-                    self.wfile.write(payload.encode('utf-8'))
-                    self.wfile.flush() # Forzar envío inmediato
-            except (BrokenPipeError, ConnectionResetError):
-                # El cliente cerró el navegador
-                broker.desuscribir(int(medico_id), cola_mensajes)
+                # Configuración de Headers para Server-Sent Events (sin largo: el stream termina al cerrar)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Connection', 'close')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.close_connection = True
+
+                # Suscribirse al broker (con replay de lo perdido si el cliente reconecta)
+                desde_id = last_event_id(self.headers.get('Last-Event-ID'), query_params)
+                cola_mensajes = broker.suscribir(int(medico_id), desde_id=desde_id)
+            except BaseException:
+                self.server.liberar_sse()
+                raise
+            # El stream dura lo que el cliente quiera: no retiene un hilo del pool
+            self.stream_pendiente = lambda: self._stream_sse(int(medico_id), cola_mensajes)
             return
 
-        # Listar Médicos
-        elif path == '/api/medicos':
-            try:
-                medicos = medico_service.obtener_todos()
-                resp = [m.to_dict() for m in medicos]
-                self._send_response(resp)
-            except Exception as e:
-                self._send_error(str(e), 500)
-
-        # Consultar Disponibilidad
-        elif path == '/api/disponibilidad':
-            medico_id = query_params.get('medico_id', [None])[0]
-            if not medico_id:
-                self._send_error("Falta parametro medico_id")
-                return
-            try:
-                slots = medico_service.obtener_disponibilidad(int(medico_id))
-                resp = [{
-                    "id": s.id, "medico_id": s.medico_id, 
-                    "fecha_hora": s.fecha_hora, "estado": s.estado
-                } for s in slots]
-                self._send_response(resp)
-            except Exception as e:
-                self._send_error(str(e), 500)
-
-        # Buscar Turnos
-        elif path == '/api/turnos':
-            nombre = query_params.get('nombre', [None])[0]
-            apellido = query_params.get('apellido', [None])[0]
-            if not nombre or not apellido:
-                self._send_error("Faltan parametros nombre y apellido")
-                return
-            try:
-                turnos = agendamiento_service.listar_por_paciente(nombre, apellido)
-                resp = [{
-                    "id": t.id, "medico_id": t.medico_id,
-                    "fecha_hora": t.fecha_hora, "estado": t.estado
-                } for t in turnos]
-                self._send_response(resp)
-            except Exception as e:
-                self._send_error(str(e), 500)
-        else:
-            self._send_error("Ruta no encontrada", 404)
+        self._send_api_result(*procesar_api('GET', path, query))
+
+    def _stream_sse(self, medico_id: int, cola_mensajes):
+        # Un cliente que no lee no puede retener este hilo indefinidamente
+        self.connection.settimeout(SSE_WRITE_TIMEOUT)
+        try:
+            while True:
+                # Esperamos mensaje; si no llega nada, heartbeat para detectar clientes caídos
+                mensaje = cola_mensajes.get(timeout=SSE_HEARTBEAT)
+
+                # Formato SSE: "id: N\ndata: {json}\n\n"
+                self.wfile.write(evento_sse(mensaje) if mensaje is not None else HEARTBEAT_SSE)
+                self.wfile.flush() # Forzar envío inmediato
+        except OSError:
+            # El cliente cerró el navegador, la conexión quedó medio abierta o no lee (timeout)
+            pass
+        finally:
+            broker.desuscribir(medico_id, cola_mensajes)
+
+    def handle(self):
+        # Un request por turno: si la conexión sigue abierta, el servidor la estaciona
+        # hasta que llegue el próximo (o lo atiende ya, si vino en el mismo paquete)
+        self.close_connection = True
+        self.handle_one_request()
+
+    def finish(self):
+        # El socket sigue en uso (keep-alive o stream SSE): lo cierra el servidor con cerrar()
+        pass
+
+    def cerrar(self):
+        super().finish()
+
+    def hay_datos(self) -> bool:
+        """¿Quedó un request (pipelining) en el buffer de lectura? Sin bloquear."""
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return True  # Que lo atienda un hilo: verá el error y cerrará
+        finally:
+            self.connection.settimeout(self.timeout)
 
     # --- POST ---
     def do_POST(self):
-        path = self.path.rstrip('/')
+        path, _, query = self.path.partition('?')
         try:
             content_length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            content_length = -1
+        # Sin largo válido no sabemos dónde empieza el próximo request; uno enorme no se
+        # lee (ocuparía un hilo del pool y memoria sin límite): en ambos casos se cierra
+        if content_length < 0:
+            self.close_connection = True
+            self._send_error("Content-Length invalido", 400)
+            return
+        if content_length > MAX_BODY:
+            self.close_connection = True
+            self._send_error("Cuerpo demasiado grande", 413)
+            return
+        try:
             post_data = self.rfile.read(content_length)
-            data = json.loads(post_data)
-        except:
+        except OSError:
+            post_data = b''
+        if len(post_data) < content_length:
+            # El cliente cerró o no terminó de enviar dentro de READ_TIMEOUT
+            self.close_connection = True
             self._send_error("JSON invalido", 400)
             return
 
-        if path == '/api/medicos':
-            try:
-                dto = CrearMedicoDTO(data['nombre'], data['apellido'], data['especialidad'])
-                nuevo = medico_service.registrar_medico(dto)
-                self._send_response(nuevo.to_dict(), 201)
-            except Exception as e:
-                self._send_error(str(e), 400)
+        self._send_api_result(*procesar_api('POST', path.rstrip('/'), query, post_data))
+
+    # --- DELETE ---
+    def do_DELETE(self):
+        path, _, query = self.path.partition('?')
+        self._send_api_result(*procesar_api('DELETE', path.rstrip('/'), query))
+
+# --- SERVIDOR CON POOL DE HILOS ---
+def _respuesta_saturado(mensaje: str) -> bytes:
+    cuerpo = json.dumps({"error": mensaje}).encode('utf-8')
+    return (f"HTTP/1.1 503 Service Unavailable\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Access-Control-Allow-Origin: *\r\n"
+            f"Retry-After: {RETRY_AFTER}\r\n"
+            f"Content-Length: {len(cuerpo)}\r\n"
+            f"Connection: close\r\n\r\n").encode('latin-1') + cuerpo
+
+
+class PoolHTTPServer(socketserver.TCPServer):
+    """
+    Servidor con un número fijo de hilos (HTTP_WORKERS) en lugar de un hilo por
+    conexión. Un hilo atiende un request a la vez, no una conexión: entre
+    requests, las conexiones keep-alive (y las recién aceptadas que todavía no
+    mandaron nada) esperan en un selector y pasan a la cola de trabajo recién
+    cuando el socket tiene datos. Una conexión inactiva más de IDLE_TIMEOUT se cierra.
+
+    Control de admisión (503 + Retry-After, sin tocar SQLite):
+    - cola llena (HTTP_QUEUE_SIZE) o más de HTTP_MAX_CONEXIONES inactivas: se
+      rechaza al aceptar o al llegar el request;
+    - request que esperó más de HTTP_QUEUE_TIMEOUT desde que su socket quedó
+      legible (no desde que se abrió la conexión): el cliente probablemente ya
+      se rindió, se descarta en vez de trabajar para nadie. 'workers_ocupados'
+      cuenta solo hilos procesando un request, nunca conexiones inactivas;
+    - más de SSE_MAX streams: cupo propio, los SSE nunca ocupan hilos del pool
+      (tras enviar los headers el handler deja 'stream_pendiente' y el stream
+      sigue en un hilo aparte).
+    """
+    request_queue_size = LISTEN_BACKLOG
+    RESPUESTA_COLA_LLENA = _respuesta_saturado("Servidor saturado, reintente en unos segundos")
+
+    def __init__(self, direccion, handler, workers: int = HTTP_WORKERS,
+                 max_cola: int = HTTP_QUEUE_SIZE, max_sse: int = SSE_MAX,
+                 max_conexiones: int = HTTP_MAX_CONEXIONES):
+        super().__init__(direccion, handler)
+        self.workers = workers
+        self.max_sse = max_sse
+        self.max_conexiones = max_conexiones
+        # Requests listos: (socket, dirección, handler o None, listo_en). Solo encola el hilo
+        # del selector, así que SimpleQueue (en C, más liviana) + chequeo de tamaño alcanza
+        self.max_cola = max_cola
+        self._conexiones = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._ocupados = 0
+        self._sse_activos = 0
+        self._stats = {"atendidas": 0, "rechazos_cola_llena": 0, "rechazos_espera": 0, "rechazos_sse": 0,
+                       "cerradas_inactivas": 0}
+        # Conexiones inactivas. Cada hilo estaciona la suya registrándola él mismo
+        # (bajo _inactivas_lock): epoll/kqueue la ven aunque el selector ya esté
+        # esperando. Con los demás selectores hay que despertarlo (socketpair).
+        self._selector = selectors.DefaultSelector()
+        self._inactivas_lock = threading.Lock()
+        self._estacionadas = {}  # socket -> (dirección, handler o None, estacionada_en), en orden de llegada
+        self._despertar_r, self._despertar_w = socket.socketpair()
+        self._despertar_r.setblocking(False)
+        self._despertar_w.setblocking(False)
+        self._selector.register(self._despertar_r, selectors.EVENT_READ)
+        self._despertar_siempre = type(self._selector).__name__ not in ('EpollSelector', 'KqueueSelector')
+        threading.Thread(target=self._vigilar, name="http-selector", daemon=True).start()
+        for i in range(workers):
+            threading.Thread(target=self._trabajar, name=f"http-{i}", daemon=True).start()
+        metricas.registrar_componente(
+            "hospital_http", "Servidor HTTP", self.metrics,
+            contadores=tuple(self._stats),
+            gauges=("en_cola", "capacidad_cola", "workers", "workers_ocupados", "sse_activos", "sse_max",
+                    "conexiones_inactivas"))
 
-        elif path == '/api/disponibilidad':
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "en_cola": self._conexiones.qsize(),
+                "capacidad_cola": self.max_cola,
+                "workers": self.workers,
+                "workers_ocupados": self._ocupados,
+                "sse_activos": self._sse_activos,
+                "sse_max": self.max_sse,
+                "conexiones_inactivas": len(self._estacionadas),
+            }
+
+    def _contar(self, clave: str) -> None:
+        with self._lock:
+            self._stats[clave] += 1
+
+    def process_request(self, request, client_address):
+        if self._conexiones.qsize() >= self.max_cola or len(self._estacionadas) >= self.max_conexiones:
+            self._contar("rechazos_cola_llena")
+            self._rechazar(request)
+            return
+        self._estacionar(request, client_address, None)
+
+    def _rechazar(self, request) -> None:
+        # Respuesta chica y precalculada; no bloquear el hilo que acepta conexiones
+        try:
+            request.setblocking(False)
+            request.sendall(self.RESPUESTA_COLA_LLENA)
+            # Leer lo que ya mandó el cliente: cerrar con datos sin leer envía RST y pierde el 503
+            request.recv(65536)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    # --- Conexiones inactivas (selector) ---
+    def _estacionar(self, request, client_address, handler) -> None:
+        with self._inactivas_lock:
+            try:
+                self._selector.register(request, selectors.EVENT_READ)
+            except (ValueError, OSError):
+                registrada = False  # El socket ya se cerró
+            else:
+                registrada = True
+                self._estacionadas[request] = (client_address, handler, time.monotonic())
+        if not registrada:
+            self._cerrar(request, handler)
+        elif self._despertar_siempre:
             try:
-                dto = AgregarDisponibilidadDTO(int(data['medico_id']), datetime.fromisoformat(data['fecha_hora']))
-                nuevo = medico_service.agregar_disponibilidad(dto)
-                self._send_response({"mensaje": "Disponibilidad creada", "id": nuevo.id}, 201)
-            except Exception as e:
-                self._send_error(str(e), 400)
+                self._despertar_w.send(b'\0')
+            except BlockingIOError:
+                pass  # Ya hay un aviso pendiente
+
+    def _vigilar(self) -> None:
+        while True:
+            with self._inactivas_lock:
+                mas_vieja = next(iter(self._estacionadas.values()), None)
+            espera = 1.0
+            if mas_vieja is not None:
+                espera = min(espera, max(0.0, mas_vieja[2] + IDLE_TIMEOUT - time.monotonic()))
+            for clave, _ in self._selector.select(espera):
+                if clave.fileobj is self._despertar_r:
+                    try:
+                        while self._despertar_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                request = clave.fileobj
+                with self._inactivas_lock:
+                    self._selector.unregister(request)
+                    client_address, handler, _ = self._estacionadas.pop(request)
+                self._despachar(request, client_address, handler)
+            self._cerrar_inactivas()
+
+    def _cerrar_inactivas(self) -> None:
+        limite = time.monotonic() - IDLE_TIMEOUT
+        vencidas = []
+        with self._inactivas_lock:
+            while self._estacionadas:
+                request, (_, handler, estacionada_en) = next(iter(self._estacionadas.items()))
+                if estacionada_en > limite:
+                    break
+                del self._estacionadas[request]
+                self._selector.unregister(request)
+                vencidas.append((request, handler))
+        for request, handler in vencidas:
+            self._contar("cerradas_inactivas")
+            self._cerrar(request, handler)
 
-        elif path == '/api/turnos':
+    def _despachar(self, request, client_address, handler) -> None:
+        """El socket tiene datos: a la cola de trabajo (la espera se mide desde ahora)."""
+        if self._conexiones.qsize() >= self.max_cola:
+            self._contar("rechazos_cola_llena")
+            if handler is not None:
+                handler.cerrar()
+            self._rechazar(request)
+            return
+        self._conexiones.put((request, client_address, handler, time.monotonic()))
+
+    def _cerrar(self, request, handler) -> None:
+        if handler is not None:
             try:
-                dto = AgendarTurnoDTO(
-                    int(data['medico_id']), data['paciente_nombre'], 
-                    data['paciente_apellido'], datetime.fromisoformat(data['fecha_hora'])
-                )
-                turno = agendamiento_service.agendar_turno(dto)
-                self._send_response({"mensaje": "Turno confirmado", "id": turno.id}, 201)
-            except ValueError as ve:
-                self._send_error(str(ve), 409) 
-            except Exception as e:
-                print(f"ERROR: {e}")
-                self._send_error(str(e), 500)
-        else:
-            self._send_error("Ruta no encontrada", 404)
+                handler.cerrar()
+            except OSError:
+                pass
+        self.shutdown_request(request)
 
-    # --- DELETE ---
-    def do_DELETE(self):
-        path = self.path.rstrip('/')
-        match = re.search(r'/api/turnos/(\d+)', path)
-        if match:
+    # --- Hilos del pool ---
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def _trabajar(self):
+        while True:
+            request, client_address, handler, listo_en = self._conexiones.get()
+            if time.monotonic() - listo_en > HTTP_QUEUE_TIMEOUT:
+                self._contar("rechazos_espera")
+                if handler is not None:
+                    handler.cerrar()
+                self._rechazar(request)
+                continue
+            with self._lock:
+                self._ocupados += 1
+                self._stats["atendidas"] += 1
             try:
-                agendamiento_service.anular_turno(int(match.group(1)))
-                self._send_response({"mensaje": "Turno anulado"})
-            except Exception as e:
-                self._send_error(str(e), 500)
-        else:
-            self._send_error("Ruta no encontrada", 404)
+                if handler is None:
+                    handler = self.finish_request(request, client_address)
+                else:
+                    handler.handle()
+                # Requests que llegaron juntos (pipelining) no despiertan al selector: atenderlos ya
+                while not handler.close_connection and handler.stream_pendiente is None and handler.hay_datos():
+                    handler.handle()
+            except Exception:
+                self.handle_error(request, client_address)
+                self._cerrar(request, handler)
+                continue
+            finally:
+                with self._lock:
+                    self._ocupados -= 1
+            if handler.stream_pendiente is not None:
+                threading.Thread(target=self._continuar_stream, args=(handler, request), daemon=True).start()
+            elif handler.close_connection:
+                self._cerrar(request, handler)
+            else:
+                self._estacionar(request, client_address, handler)
 
-# --- SERVIDOR MULTIHILO (ThreadingTCPServer) ---
-# Necesario para que SSE no bloquee el servidor
-class ThreadingHTTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    daemon_threads = True
+    def reservar_sse(self) -> bool:
+        """Ocupa un lugar de stream SSE; False si ya hay SSE_MAX abiertos."""
+        with self._lock:
+            if self._sse_activos >= self.max_sse:
+                self._stats["rechazos_sse"] += 1
+                return False
+            self._sse_activos += 1
+            return True
 
-if __name__ == "__main__":
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    # Usamos ThreadingHTTPServer en lugar de TCPServer simple
-    with ThreadingHTTPServer(("", PORT), HospitalHTTPHandler) as httpd:
+    def liberar_sse(self) -> None:
+        with self._lock:
+            self._sse_activos -= 1
+
+    def _continuar_stream(self, handler, request):
+        try:
+            handler.stream_pendiente()
+        finally:
+            self.liberar_sse()
+            handler.stream_pendiente = None
+            self._cerrar(request, handler)
+
+# Modo worker (lo lanza prefork.py): varios procesos escuchan en el mismo PORT
+# y el kernel reparte las conexiones entre ellos
+class ReusePortHTTPServer(PoolHTTPServer):
+    allow_reuse_address = True
+    allow_reuse_port = True
+
+def run_threading_server():
+    with PoolHTTPServer(("", PORT), HospitalHTTPHandler) as httpd:
         print(f"🚀 Servidor Real-Time corriendo en: http://localhost:{PORT}")
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
-            httpd.server_close()
\ No newline at end of file
+            httpd.server_close()
+            apagar_servicios()
+
+def run_worker_server():
+    """
+    Worker de prefork.py. SIGTERM = apagado ordenado: deja de aceptar conexiones
+    (otro worker con SO_REUSEPORT las toma), vacía el outbox/broker y termina.
+    """
+    with ReusePortHTTPServer(("", PORT), HospitalHTTPHandler) as httpd:
+        def al_terminar(signum, frame):
+            # shutdown() espera a serve_forever: llamarlo desde otro hilo
+            threading.Thread(target=httpd.shutdown, daemon=True).start()
+        signal.signal(signal.SIGTERM, al_terminar)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C lo maneja el supervisor
+        print(f"🚀 Worker {os.getpid()} escuchando en: http://localhost:{PORT}")
+        httpd.serve_forever()
+    apagar_servicios()
+    print(f"🏁 Worker {os.getpid()} finalizado.")
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    modo = sys.argv[1] if len(sys.argv) > 1 else SERVER_MODE
+    if modo == 'asyncio':
+        from async_server import run_async_server
+        run_async_server(PORT, procesar_api, frontend, broker, json_serial, apagar_servicios, ruta_metricas, SSE_MAX)
+    elif modo == 'worker':
+        run_worker_server()
+    else:
+        run_threading_server()
@@ -0,0 +1,186 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from typing import Optional
+
+# Límites (segundos) de los buckets de latencia: de 0.5 ms a 5 s
+BUCKETS_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+RUTA_DESCONOCIDA = "desconocida"  # Etiqueta 'route' de todo request que no coincidió con ninguna ruta
+METODOS_CONOCIDOS = frozenset(("GET", "POST", "DELETE", "OPTIONS", "HEAD"))
+METODO_OTRO = "otro"  # Etiqueta 'method' de cualquier verbo fuera de METODOS_CONOCIDOS
+
+
+def _etiquetas(nombres, valores, extra: str = '') -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histograma:
+    """
+    Histograma con etiquetas, formato Prometheus. observar() cuesta un bisect
+    y un lock corto: se puede dejar encendido en producción.
+    Las etiquetas deben tener cardinalidad acotada (rutas, no paths con ids).
+    """
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        self._series = {}  # valores de etiquetas -> [conteos por bucket (+Inf al final), suma]
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, *etiquetas) -> None:
+        pos = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][pos] += 1
+            serie[1] += valor
+
+    def exportar(self):
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} histogram"
+        with self._lock:
+            series = [(k, list(conteos), suma) for k, (conteos, suma) in self._series.items()]
+        for valores, conteos, suma in sorted(series):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + ('+Inf',), conteos):
+                acumulado += conteo
+                le = 'le="%s"' % limite
+                yield f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {acumulado}"
+            yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {suma}"
+            yield f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {acumulado}"
+
+
+class Recolector:
+    """
+    Métricas que se leen recién al exportar (contadores y gauges que otros
+    componentes ya llevan, p. ej. pool_metrics() o broker.metrics()).
+    'leer' devuelve un número o un dict {valores de etiquetas (tupla): número}.
+    """
+
+    def __init__(self, nombre: str, ayuda: str, tipo: str, leer, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.tipo = tipo  # 'counter' o 'gauge'
+        self.leer = leer
+        self.etiquetas = tuple(etiquetas)
+
+    def exportar(self):
+        try:
+            valores = self.leer()
+        except Exception as e:
+            yield f"# {self.nombre}: error al leer ({_escapar(e)})"
+            return
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} {self.tipo}"
+        if not isinstance(valores, dict):
+            valores = {(): valores}
+        for clave, valor in sorted(valores.items()):
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {valor}"
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, metrica):
+        """Registra (o reemplaza, si ya existe con ese nombre) y devuelve la métrica."""
+        with self._lock:
+            self._metricas[metrica.nombre] = metrica
+        return metrica
+
+    def exportar(self) -> bytes:
+        with self._lock:
+            metricas = list(self._metricas.values())
+        lineas = [linea for m in metricas for linea in m.exportar()]
+        return ("\n".join(lineas) + "\n").encode('utf-8')
+
+
+REGISTRO = Registro()
+
+HTTP_DURACION = REGISTRO.registrar(Histograma(
+    "hospital_http_request_duration_seconds", "Duración de requests HTTP por ruta (sin SSE).",
+    ("method", "route", "status")))
+REPOSITORIO_DURACION = REGISTRO.registrar(Histograma(
+    "hospital_repository_duration_seconds", "Duración de llamadas a los repositorios SQLite.",
+    ("repository", "method")))
+JSON_DURACION = REGISTRO.registrar(Histograma(
+    "hospital_json_encode_duration_seconds", "Tiempo de serialización JSON de respuestas.",
+    (), buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)))
+API_DURACION = REGISTRO.registrar(Histograma(
+    "hospital_api_handler_duration_seconds", "Duración de la lógica de cada ruta de la API (sin escribir la respuesta).",
+    ("method", "route")))
+BROKER_PUBLICACION = REGISTRO.registrar(Histograma(
+    "hospital_broker_publish_duration_seconds",
+    "Desde que se entrega un evento al broker hasta que queda publicado (confirmado en RabbitMQ).",
+    ("broker",)))
+
+
+def registrar_componente(prefijo: str, componente: str, leer, contadores=(), gauges=()) -> None:
+    """
+    Expone un dict de métricas que el componente ya lleva (p. ej. pool_metrics()):
+    cada clave pasa a ser '{prefijo}_{clave}' ('_total' si es contador).
+    Las claves ausentes en el dict se omiten (p. ej. broker en memoria sin publicador).
+    """
+    def lector(clave):
+        def leer_clave():
+            valores = leer()
+            return {(): valores[clave]} if clave in valores else {}
+        return leer_clave
+    for clave in contadores:
+        REGISTRO.registrar(Recolector(f"{prefijo}_{clave}_total", f"{componente}: {clave} (acumulado).",
+                                      'counter', lector(clave)))
+    for clave in gauges:
+        REGISTRO.registrar(Recolector(f"{prefijo}_{clave}", f"{componente}: {clave} (valor actual).",
+                                      'gauge', lector(clave)))
+
+
+def observar_request(metodo: str, ruta: Optional[str], status: int, duracion: float) -> None:
+    """
+    'ruta' es la plantilla que atendió el request ('/api/turnos/{turno_id:int}'),
+    así la etiqueta 'route' tiene cardinalidad acotada. None = no coincidió con
+    ninguna ruta (404, 405, 501, 400 sobre URLs inventadas): una sola serie.
+    Lo mismo con 'method': un verbo inventado por el cliente (PUT, FOO, ...) va a METODO_OTRO.
+    """
+    if metodo not in METODOS_CONOCIDOS:
+        metodo = METODO_OTRO
+    HTTP_DURACION.observar(duracion, metodo, ruta or RUTA_DESCONOCIDA, str(status))
+
+
+def instrumentar_repositorio(nombre: str):
+    """
+    Decorador de clase: mide cada método público del repositorio en
+    REPOSITORIO_DURACION. Los generadores (iter_*) no se miden: su costo
+    ocurre mientras el servidor escribe la respuesta y ya cuenta en la ruta.
+    """
+    def decorar(cls):
+        for atributo, funcion in list(vars(cls).items()):
+            if atributo.startswith('_') or not inspect.isfunction(funcion) or inspect.isgeneratorfunction(funcion):
+                continue
+            setattr(cls, atributo, _medido(funcion, nombre, atributo))
+        return cls
+    return decorar
+
+
+def _medido(funcion, repositorio: str, metodo: str):
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            REPOSITORIO_DURACION.observar(time.perf_counter() - inicio, repositorio, metodo)
+    return envoltura
@@ -0,0 +1,135 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+# Configuración
+WORKERS = int(os.environ.get('HOSPITAL_WORKERS', os.cpu_count() or 2))
+GRACE_PERIOD = 10.0       # Segundos que tiene un worker para terminar tras SIGTERM
+RESTART_WARMUP = 2.0      # Segundos que se dan a los workers nuevos antes de retirar los viejos
+MAX_RESPAWN_BACKOFF = 30.0
+CRASH_WINDOW = 5.0        # Un worker que muere antes de esto cuenta como arranque fallido
+CACHE_TTL_WORKERS = '2'   # Cada worker invalida solo su caché: TTL corto para no servir datos viejos
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+class Supervisor:
+    """
+    Lanzador pre-fork: N procesos 'python main.py worker', cada uno con su propio
+    pool de SQLite, publicador/consumidor de RabbitMQ y relay del outbox,
+    escuchando todos en PORT con SO_REUSEPORT (el kernel reparte las conexiones).
+
+    - Un worker que muere se vuelve a lanzar (con backoff si muere al arrancar).
+    - SIGHUP: reinicio ordenado. Arrancan los workers nuevos y recién después
+      se retiran los viejos con SIGTERM, así nunca queda el puerto sin nadie.
+    - SIGTERM / Ctrl+C: apaga todos los workers y termina.
+
+    El supervisor no importa main.py: no abre la base ni conecta a RabbitMQ.
+    """
+
+    def __init__(self, workers: int = WORKERS):
+        self.cantidad = workers
+        self._workers = {}      # pid -> (Popen, lanzado_en)
+        self._retirandose = {}  # pid -> (Popen, límite para SIGKILL)
+        self._fallos_seguidos = 0
+        self._reiniciar = False
+        self._terminar = False
+
+    def _lanzar(self) -> None:
+        env = dict(os.environ)
+        # Cada proceso tendría su propio índice sin ver las escrituras de los demás
+        env.setdefault('HOSPITAL_INDICE_MEMORIA', '0')
+        env.setdefault('HOSPITAL_CACHE_TTL', CACHE_TTL_WORKERS)
+        proceso = subprocess.Popen([sys.executable, MAIN_PATH, 'worker'], env=env)
+        self._workers[proceso.pid] = (proceso, time.monotonic())
+        print(f"👷 [PREFORK] Worker {proceso.pid} lanzado ({len(self._workers)} activos)")
+
+    def _retirar(self, pid: int) -> None:
+        proceso, _ = self._workers.pop(pid)
+        proceso.send_signal(signal.SIGTERM)
+        self._retirandose[pid] = (proceso, time.monotonic() + GRACE_PERIOD)
+
+    def _revisar_retirados(self) -> None:
+        for pid, (proceso, limite) in list(self._retirandose.items()):
+            if proceso.poll() is not None:
+                del self._retirandose[pid]
+            elif time.monotonic() > limite:
+                print(f"❌ [PREFORK] Worker {pid} no terminó a tiempo, SIGKILL")
+                proceso.kill()
+
+    def _revisar_workers(self) -> None:
+        for pid, (proceso, lanzado_en) in list(self._workers.items()):
+            codigo = proceso.poll()
+            if codigo is None:
+                continue
+            del self._workers[pid]
+            print(f"❌ [PREFORK] Worker {pid} terminó inesperadamente (código {codigo})")
+            if time.monotonic() - lanzado_en < CRASH_WINDOW:
+                self._fallos_seguidos += 1
+            else:
+                self._fallos_seguidos = 0
+
+        faltan = self.cantidad - len(self._workers)
+        if faltan > 0:
+            if self._fallos_seguidos:
+                # Falla al arrancar (puerto ocupado, base rota...): no relanzar en bucle
+                espera = min(2 ** (self._fallos_seguidos - 1), MAX_RESPAWN_BACKOFF)
+                print(f"⏳ [PREFORK] Reintentando en {espera:.0f}s")
+                self._dormir(espera)
+                if self._terminar:
+                    return
+            for _ in range(faltan):
+                self._lanzar()
+
+    def _reinicio_ordenado(self) -> None:
+        print("🔄 [PREFORK] Reinicio ordenado de workers")
+        viejos = list(self._workers)
+        for _ in viejos:
+            self._lanzar()
+        self._dormir(RESTART_WARMUP)
+        for pid in viejos:
+            if pid in self._workers:
+                self._retirar(pid)
+
+    def _dormir(self, segundos: float) -> None:
+        # Las señales interrumpen el sleep; cortar antes si hay que apagar
+        limite = time.monotonic() + segundos
+        while not self._terminar and time.monotonic() < limite:
+            time.sleep(min(0.2, limite - time.monotonic()))
+
+    def ejecutar(self) -> None:
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, '_reiniciar', True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, '_terminar', True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, '_terminar', True))
+
+        print(f"🚀 [PREFORK] Supervisor {os.getpid()} con {self.cantidad} workers (SIGHUP = reinicio ordenado)")
+        for _ in range(self.cantidad):
+            self._lanzar()
+
+        while not self._terminar:
+            if self._reiniciar:
+                self._reiniciar = False
+                self._reinicio_ordenado()
+            self._revisar_workers()
+            self._revisar_retirados()
+            self._dormir(0.5)
+
+        print("🛑 [PREFORK] Apagando workers...")
+        for pid in list(self._workers):
+            self._retirar(pid)
+        while self._retirandose:
+            self._revisar_retirados()
+            time.sleep(0.1)
+        print("🏁 [PREFORK] Supervisor finalizado.")
+
+
+if __name__ == "__main__":
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        sys.exit("SO_REUSEPORT no está disponible en esta plataforma; usar 'python main.py'.")
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else WORKERS
+    if os.environ.get('HOSPITAL_BROKER') == 'memoria' and cantidad > 1:
+        print("⚠️ [PREFORK] Con HOSPITAL_BROKER=memoria cada worker solo notifica a sus propios clientes SSE")
+    Supervisor(cantidad).ejecutar()
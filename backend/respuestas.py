@@ -0,0 +1,172 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import zlib
+
+# Configuración
+GZIP_MIN_BYTES = 1024   # Por debajo de esto comprimir no compensa
+GZIP_LEVEL = 5          # Respuestas dinámicas (el frontend se comprime con nivel 9)
+CHUNK_BYTES = 16 * 1024 # Tamaño objetivo de cada bloque en respuestas por streaming
+SSE_HEARTBEAT = 15.0    # Segundos sin eventos antes de enviar un comentario keep-alive
+SSE_WRITE_TIMEOUT = 10.0  # Segundos máximos bloqueado escribiendo a un cliente SSE
+
+# Comentario SSE (lo ignora EventSource): mantiene vivos los proxies y detecta
+# conexiones medio abiertas, porque la escritura falla o vence SSE_WRITE_TIMEOUT
+HEARTBEAT_SSE = b": ping\n\n"
+
+
+def etag_de(cuerpo: bytes) -> str:
+    # ETag débil: el mismo contenido vale para la versión gzip y la plana
+    return 'W/"' + hashlib.blake2b(cuerpo, digest_size=16).hexdigest() + '"'
+
+
+def etag_coincide(if_none_match, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidatos = [_sin_prefijo_debil(e.strip()) for e in if_none_match.split(',')]
+    # Comparación débil: ignorar el prefijo W/ en ambos lados
+    return '*' in candidatos or _sin_prefijo_debil(etag) in candidatos
+
+
+def _sin_prefijo_debil(etag: str) -> str:
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def acepta_gzip(accept_encoding) -> bool:
+    if not accept_encoding:
+        return False
+    for parte in accept_encoding.split(','):
+        nombre, _, params = parte.strip().partition(';')
+        if nombre.strip().lower() == 'gzip':
+            return params.replace(' ', '') not in ('q=0', 'q=0.0')
+    return False
+
+
+def negociar(metodo: str, status: int, cuerpo: bytes, if_none_match=None, accept_encoding=None,
+             etag: str = None, cuerpo_gzip: bytes = None):
+    """
+    Aplica validadores y compresión a una respuesta.
+    Devuelve (status, headers_extra, cuerpo_final); status pasa a 304 si el
+    cliente ya tiene la versión actual.
+    """
+    headers = []
+    if metodo == 'GET' and status == 200:
+        etag = etag or etag_de(cuerpo)
+        headers.append(('ETag', etag))
+        if etag_coincide(if_none_match, etag):
+            return 304, headers, b''
+
+    headers.append(('Vary', 'Accept-Encoding'))
+    if len(cuerpo) >= GZIP_MIN_BYTES and acepta_gzip(accept_encoding):
+        cuerpo = cuerpo_gzip if cuerpo_gzip is not None else gzip.compress(cuerpo, GZIP_LEVEL)
+        headers.append(('Content-Encoding', 'gzip'))
+    return status, headers, cuerpo
+
+
+class RecursoEstatico:
+    """
+    Archivo servido desde memoria (p. ej. frontend/index.html) con su ETag y
+    su versión gzip precalculados. Solo se vuelve a leer del disco si cambia
+    el mtime del archivo.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._version = None  # (cuerpo, cuerpo_gzip, etag), se reemplaza entero
+
+    def obtener(self):
+        """Devuelve (cuerpo, cuerpo_gzip, etag). FileNotFoundError si el archivo no existe."""
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    with open(self.path, 'rb') as file:
+                        cuerpo = file.read()
+                    self._version = (cuerpo, gzip.compress(cuerpo, 9), etag_de(cuerpo))
+                    self._mtime = mtime
+        return self._version
+
+
+class JsonArrayStream:
+    """
+    Arreglo JSON generado por bloques a partir de un iterador de filas (p. ej.
+    el cursor de SQLite). Nunca arma la lista completa en memoria: el pico de
+    memoria depende de CHUNK_BYTES, no del tamaño del resultado.
+    'columnas' da el nombre de cada posición de la tupla.
+    """
+
+    def __init__(self, filas, columnas, tam_chunk: int = CHUNK_BYTES):
+        self.filas = filas
+        self.columnas = columnas
+        self.tam_chunk = tam_chunk
+
+    def __iter__(self):
+        columnas = self.columnas
+        dumps = json.dumps
+        partes, tam, separador = ['['], 1, ''
+        try:
+            for fila in self.filas:
+                texto = separador + dumps(dict(zip(columnas, fila)))
+                separador = ', '
+                partes.append(texto)
+                tam += len(texto)
+                if tam >= self.tam_chunk:
+                    yield ''.join(partes).encode('utf-8')
+                    partes, tam = [], 0
+            partes.append(']')
+            yield ''.join(partes).encode('utf-8')
+        finally:
+            # Devuelve la conexión al pool aunque el cliente corte a mitad de camino
+            cerrar = getattr(self.filas, 'close', None)
+            if cerrar:
+                cerrar()
+
+    def close(self):
+        cerrar = getattr(self.filas, 'close', None)
+        if cerrar:
+            cerrar()
+
+
+def evento_sse(mensaje: dict) -> bytes:
+    """Formato SSE: "id: N" (si el evento tiene evento_id) + "data: {json}" + línea en blanco."""
+    evento_id = mensaje.get('evento_id')
+    cabecera = f"id: {evento_id}\n" if evento_id is not None else ""
+    return f"{cabecera}data: {json.dumps(mensaje)}\n\n".encode('utf-8')
+
+
+def last_event_id(header, query_params):
+    """
+    Id del último evento que vio el cliente: header Last-Event-ID (reconexión
+    automática de EventSource) o ?last_event_id= en la URL. None si no hay o no es válido.
+    """
+    valor = header or query_params.get('last_event_id', [None])[0]
+    try:
+        return int(valor) if valor else None
+    except ValueError:
+        return None
+
+
+def nuevo_compresor_gzip():
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31 -> formato gzip
+
+
+def comprimir_stream(bloques):
+    """gzip incremental de un iterador de bytes."""
+    compresor = nuevo_compresor_gzip()
+    for bloque in bloques:
+        salida = compresor.compress(bloque)
+        if salida:
+            yield salida
+    yield compresor.flush()
+
+
+def enmarcar_chunked(bloques):
+    """Aplica Transfer-Encoding: chunked (HTTP/1.1) a un iterador de bytes."""
+    for bloque in bloques:
+        if bloque:
+            yield b'%x\r\n' % len(bloque) + bloque + b'\r\n'
+    yield b'0\r\n\r\n'
@@ -0,0 +1,275 @@
+import json
+from datetime import datetime, date, time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+
+class ErrorHttp(Exception):
+    """Error con status propio: lo lanza un handler o la validación y el router lo convierte en {"error": ...}."""
+
+    def __init__(self, status: int, mensaje: str):
+        super().__init__(mensaje)
+        self.status = status
+        self.mensaje = mensaje
+
+
+# --- Conversores de tipos (query string y cuerpo JSON) ---
+def _entero(valor) -> int:
+    if isinstance(valor, bool):
+        raise ValueError(valor)
+    return int(valor)
+
+
+def _texto(valor) -> str:
+    if not isinstance(valor, str) or not valor:
+        raise ValueError(valor)
+    return valor
+
+
+def _booleano(valor) -> bool:
+    if isinstance(valor, bool):
+        return valor
+    if valor in ('1', 'true'):
+        return True
+    if valor in ('0', 'false'):
+        return False
+    raise ValueError(valor)
+
+
+CONVERSORES = {
+    bool: _booleano,
+    int: _entero,
+    str: _texto,
+    datetime: datetime.fromisoformat,
+    date: date.fromisoformat,
+    time: time.fromisoformat,
+}
+
+
+class Objeto:
+    """Tipo para objetos JSON anidados (p. ej. cada ítem de un lote): Campo('turnos', [Objeto(...)])."""
+
+    def __init__(self, *campos: 'Campo'):
+        self.campos = campos
+
+    def __call__(self, valor) -> dict:
+        if not isinstance(valor, dict):
+            raise ValueError(valor)
+        return _validar(self.campos, valor, dict.get)
+
+
+class Campo:
+    """
+    Un parámetro de query o un campo del cuerpo JSON, con su tipo y restricciones.
+    Los mensajes de error se arman una sola vez, al declarar la ruta.
+    tipo: bool, int, str, datetime, date, time, un Objeto, o [tipo] para una lista.
+    """
+
+    def __init__(self, nombre: str, tipo=str, requerido: bool = False, defecto=None,
+                 opciones=None, minimo=None, maximo=None):
+        self.nombre = nombre
+        self.requerido = requerido
+        self.defecto = defecto
+        self.opciones = tuple(opciones) if opciones is not None else None
+        self.minimo = minimo
+        self.maximo = maximo
+        self.es_lista = isinstance(tipo, list)
+        tipo_base = tipo[0] if self.es_lista else tipo
+        self.convertir = tipo_base if isinstance(tipo_base, Objeto) else CONVERSORES[tipo_base]
+
+        self.error_falta = f"Falta parametro {nombre}"
+        self.error_tipo = f"{nombre} invalido"
+        if self.opciones is not None:
+            self.error_rango = f"{nombre} debe ser uno de: {', '.join(self.opciones)}"
+        else:
+            self.error_rango = f"{nombre} debe estar entre {minimo} y {maximo}"
+
+    def validar(self, crudo):
+        try:
+            if self.es_lista:
+                if not isinstance(crudo, list):
+                    raise ValueError(crudo)
+                return [self._elemento(i, v) for i, v in enumerate(crudo)]
+            valor = self.convertir(crudo)
+        except (TypeError, ValueError):
+            raise ErrorHttp(400, self.error_tipo)
+        if self.opciones is not None and valor not in self.opciones:
+            raise ErrorHttp(400, self.error_rango)
+        if (self.minimo is not None and valor < self.minimo) or (self.maximo is not None and valor > self.maximo):
+            raise ErrorHttp(400, self.error_rango)
+        return valor
+
+
+    def _elemento(self, posicion: int, crudo):
+        try:
+            return self.convertir(crudo)
+        except ErrorHttp as e:
+            raise ErrorHttp(e.status, f"{self.nombre}[{posicion}]: {e.mensaje}")
+
+
+def _validar(campos: Tuple[Campo, ...], datos: dict, leer) -> dict:
+    valores = {}
+    for campo in campos:
+        crudo = leer(datos, campo.nombre)
+        if crudo is None or crudo == '':
+            if campo.requerido:
+                raise ErrorHttp(400, campo.error_falta)
+            if campo.defecto is not None:
+                valores[campo.nombre] = campo.defecto
+            continue
+        valores[campo.nombre] = campo.validar(crudo)
+    return valores
+
+
+def _primer_valor(query: dict, nombre: str):
+    valores = query.get(nombre)
+    return valores[0] if valores else None
+
+
+class Solicitud:
+    """Lo que recibe un handler: parámetros del path, query y cuerpo ya validados y tipados."""
+    __slots__ = ('metodo', 'path', 'ruta', 'params', 'query', 'cuerpo', '_query_crudo', '_cuerpo_crudo')
+
+    def __init__(self, metodo: str, path: str, ruta: 'Ruta', params: dict, query_crudo: str, cuerpo_crudo: bytes):
+        self.metodo = metodo
+        self.path = path
+        self.ruta = ruta
+        self.params = params
+        self.query = {}
+        self.cuerpo = {}
+        self._query_crudo = query_crudo
+        self._cuerpo_crudo = cuerpo_crudo
+
+
+class Ruta:
+    """
+    Ruta compilada al registrarla: plantilla partida en segmentos
+    ('/api/turnos/{turno_id:int}' -> literales y (nombre, conversor)) y esquemas de query/cuerpo.
+    """
+
+    def __init__(self, metodo: str, plantilla: str, handler: Callable, query=(), cuerpo=None,
+                 status_valor: int = 400):
+        self.metodo = metodo
+        self.plantilla = plantilla
+        self.handler = handler
+        self.query = tuple(query)
+        self.cuerpo = tuple(cuerpo) if cuerpo is not None else None
+        self.status_valor = status_valor  # Status para ValueError de la lógica de negocio
+        self.segmentos = []
+        for segmento in plantilla.strip('/').split('/'):
+            if segmento.startswith('{') and segmento.endswith('}'):
+                nombre, _, tipo = segmento[1:-1].partition(':')
+                self.segmentos.append((nombre, _entero if tipo == 'int' else _texto))
+            else:
+                self.segmentos.append(segmento)
+        self.estatica = all(isinstance(s, str) for s in self.segmentos)
+
+    def coincidir(self, partes: List[str]) -> Optional[dict]:
+        params = {}
+        for esperado, parte in zip(self.segmentos, partes):
+            if isinstance(esperado, str):
+                if esperado != parte:
+                    return None
+            else:
+                nombre, convertir = esperado
+                try:
+                    params[nombre] = convertir(parte)
+                except ValueError:
+                    return None
+        return params
+
+    def preparar(self, solicitud: Solicitud) -> None:
+        """Valida query y cuerpo contra los esquemas de la ruta (solo si los declaró)."""
+        if self.query:
+            crudo = parse_qs(solicitud._query_crudo) if solicitud._query_crudo else {}
+            solicitud.query = _validar(self.query, crudo, _primer_valor)
+        if self.cuerpo is not None:
+            try:
+                datos = json.loads(solicitud._cuerpo_crudo)
+            except ValueError:
+                raise ErrorHttp(400, "JSON invalido")
+            if not isinstance(datos, dict):
+                raise ErrorHttp(400, "JSON invalido")
+            solicitud.cuerpo = _validar(self.cuerpo, datos, dict.get)
+
+
+class Router:
+    """
+    Tabla de rutas compartida por todos los métodos HTTP.
+    - Rutas estáticas: un dict (metodo, path) -> Ruta, búsqueda O(1).
+    - Rutas con parámetros: agrupadas por (metodo, cantidad de segmentos) y
+      comparadas segmento a segmento, sin expresiones regulares.
+    - Middlewares: funciones (solicitud, siguiente) -> (status, data) que envuelven
+      la ejecución de cada ruta (medición, caché, etc.).
+
+    Los handlers devuelven (status, data). ErrorHttp se responde con su status,
+    ValueError con el 'status_valor' de la ruta y cualquier otra excepción con 500.
+    """
+
+    NO_ENCONTRADA = (404, {"error": "Ruta no encontrada"})
+
+    def __init__(self):
+        self._estaticas: Dict[Tuple[str, str], Ruta] = {}
+        self._parametricas: Dict[Tuple[str, int], List[Ruta]] = {}
+        self._middlewares: List[Callable] = []
+        self._cadena = self._ejecutar
+
+    def agregar(self, metodo: str, plantilla: str, handler: Callable, **opciones) -> Ruta:
+        ruta = Ruta(metodo, plantilla.rstrip('/'), handler, **opciones)
+        if ruta.estatica:
+            self._estaticas[(metodo, ruta.plantilla)] = ruta
+        else:
+            self._parametricas.setdefault((metodo, len(ruta.segmentos)), []).append(ruta)
+        return ruta
+
+    def ruta(self, metodo: str, plantilla: str, **opciones):
+        """Decorador: @router.ruta('GET', '/api/medicos')."""
+        def registrar(handler):
+            self.agregar(metodo, plantilla, handler, **opciones)
+            return handler
+        return registrar
+
+    def usar(self, middleware: Callable) -> None:
+        """Agrega un middleware; el primero agregado es el más externo."""
+        self._middlewares.append(middleware)
+        cadena = self._ejecutar
+        for mw in reversed(self._middlewares):
+            cadena = (lambda mw, siguiente: lambda solicitud: mw(solicitud, siguiente))(mw, cadena)
+        self._cadena = cadena
+
+    def resolver(self, metodo: str, path: str) -> Tuple[Optional[Ruta], dict]:
+        ruta = self._estaticas.get((metodo, path))
+        if ruta is not None:
+            return ruta, {}
+        partes = path.strip('/').split('/')
+        for candidata in self._parametricas.get((metodo, len(partes)), ()):
+            params = candidata.coincidir(partes)
+            if params is not None:
+                return candidata, params
+        return None, {}
+
+    def plantilla(self, metodo: str, path: str) -> Optional[str]:
+        """Plantilla de la ruta que atiende (metodo, path), o None si ninguna coincide."""
+        ruta, _ = self.resolver(metodo, path)
+        return ruta.plantilla if ruta is not None else None
+
+    def despachar(self, metodo: str, path: str, query: str = '', cuerpo: bytes = b''):
+        """Resuelve y ejecuta la ruta. 'path' sin barra final; 'query' es el query string sin parsear."""
+        ruta, params = self.resolver(metodo, path)
+        if ruta is None:
+            return self.NO_ENCONTRADA
+        return self._cadena(Solicitud(metodo, path, ruta, params, query, cuerpo))
+
+    @staticmethod
+    def _ejecutar(solicitud: Solicitud):
+        ruta = solicitud.ruta
+        try:
+            ruta.preparar(solicitud)
+            return ruta.handler(solicitud)
+        except ErrorHttp as e:
+            return e.status, {"error": e.mensaje}
+        except ValueError as e:
+            return ruta.status_valor, {"error": str(e)}
+        except Exception as e:
+            print(f"❌ [API] {solicitud.metodo} {ruta.plantilla}: {e}")
+            return 500, {"error": str(e)}
@@ -0,0 +1,144 @@
+import threading
+import time
+try:
+    import fcntl
+except ImportError:  # Windows: sin prefork, un solo proceso archiva
+    fcntl = None
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from data.repositories import IArchivoRepository
+
+
+class Archivador:
+    """
+    Hilo que mantiene acotadas las tablas calientes (turnos, disponibilidad).
+
+    - Cada 'intervalo' segundos mueve al archivo histórico (una tabla por mes)
+      los horarios y turnos anteriores a hoy - 'retencion_dias', sea cual sea su
+      estado: la agenda vigente no cambia. Va en lotes de 'lote' filas, una
+      transacción corta por lote, para no retener el lock de escritura frente a las reservas.
+    - Después corre ANALYZE y, si quedaron muchas páginas libres, VACUUM.
+    - 'al_archivar(corte)' avisa a quien tenga copias en memoria (índice, caché).
+
+    Con varios procesos (prefork.py) cada worker tiene su Archivador, pero solo
+    trabaja el líder: el que obtiene el flock exclusivo de 'lock_path' y lo
+    conserva mientras viva. Los demás reintentan cada 'intervalo'; si el líder
+    muere, el sistema operativo libera el lock y otro toma su lugar. Así no hay
+    movimientos ni VACUUM concurrentes.
+    """
+
+    def __init__(self, archivo_repo: IArchivoRepository, retencion_dias: int = 30,
+                 intervalo: float = 3600.0, lote: int = 1000, vacuum_ratio: float = 0.25,
+                 al_archivar: Optional[Callable[[datetime], None]] = None,
+                 lock_path: Optional[str] = None):
+        self.archivo_repo = archivo_repo
+        self.retencion_dias = retencion_dias
+        self.intervalo = intervalo
+        self.lote = lote
+        self.vacuum_ratio = vacuum_ratio
+        self.al_archivar = al_archivar
+        self.lock_path = lock_path
+        self._lock_archivo = None  # Abierto (con flock) mientras este proceso sea el líder
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._stats = {"ejecuciones": 0, "turnos_archivados": 0, "disponibilidad_archivados": 0,
+                       "vacuums": 0, "errores": 0, "lider": 0}
+        self._tamanios = {}
+        self._duracion = 0.0
+        self._thread = threading.Thread(target=self._run, name="archivador", daemon=True)
+
+    def iniciar(self) -> None:
+        self._thread.start()
+        print(f"📦 [ARCHIVO] Archivador iniciado (retención {self.retencion_dias} días, cada {self.intervalo:.0f}s).")
+
+    def detener(self, timeout: float = 5.0) -> None:
+        """Corta entre lotes: lo ya movido queda confirmado, el resto espera a la próxima pasada."""
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        if self._lock_archivo and not self._thread.is_alive():
+            self._lock_archivo.close()  # Libera el flock: otro proceso puede tomar el relevo
+            self._lock_archivo = None
+
+    def tomar_liderazgo(self) -> bool:
+        """True si este proceso es (o acaba de volverse) el único que archiva."""
+        if self._lock_archivo or self.lock_path is None or fcntl is None:
+            return True
+        archivo = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            archivo.close()
+            return False
+        self._lock_archivo = archivo
+        with self._lock:
+            self._stats["lider"] = 1
+        print(f"📦 [ARCHIVO] Este proceso es el líder del archivado ({self.lock_path})")
+        return True
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {**self._stats, **self._tamanios, "duracion_segundos": round(self._duracion, 4)}
+
+    def corte(self) -> datetime:
+        """Inicio del día más viejo que se conserva en las tablas calientes."""
+        hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        return hoy - timedelta(days=self.retencion_dias)
+
+    def ejecutar(self) -> dict:
+        """Una pasada completa: archivar por lotes y mantenimiento. Devuelve lo que hizo."""
+        inicio = time.perf_counter()
+        corte = self.corte()
+        movidos = {"turnos": 0, "disponibilidad": 0}
+        while not self._stop_event.is_set():
+            lote = self.archivo_repo.archivar(corte, self.lote)
+            for tabla, cantidad in lote.items():
+                movidos[tabla] += cantidad
+            # Lote incompleto: no queda nada más viejo que el corte
+            if max(lote.values()) < self.lote:
+                break
+        if any(movidos.values()):
+            print(f"📦 [ARCHIVO] {movidos['turnos']} turnos y {movidos['disponibilidad']} horarios "
+                  f"archivados (corte {corte.date().isoformat()})")
+            if self.al_archivar:
+                self.al_archivar(corte)
+        mantenimiento = self.archivo_repo.mantenimiento(self.vacuum_ratio)
+        tamanios = self.archivo_repo.tamanios()
+        with self._lock:
+            self._stats["ejecuciones"] += 1
+            self._stats["turnos_archivados"] += movidos["turnos"]
+            self._stats["disponibilidad_archivados"] += movidos["disponibilidad"]
+            self._stats["vacuums"] += mantenimiento["vacuums"]
+            self._tamanios = tamanios
+            self._duracion = time.perf_counter() - inicio
+        return {**movidos, **mantenimiento, **tamanios}
+
+    def _run(self) -> None:
+        # Primera pasada al arrancar: un servidor que estuvo apagado semanas se pone al día
+        while not self._stop_event.is_set():
+            try:
+                if self.tomar_liderazgo():
+                    self.ejecutar()
+            except Exception as e:
+                with self._lock:
+                    self._stats["errores"] += 1
+                print(f"❌ [ARCHIVO] Error en el archivador: {e}")
+            self._stop_event.wait(self.intervalo)
+
+
+# Pasada manual (p. ej. desde cron con el servidor apagado). Desde backend/:
+#   python -m services.archivador [retencion_dias]
+if __name__ == "__main__":
+    import sys
+    from data.database import DatabaseConfig
+    from data.repositories import SqliteArchivoRepository
+
+    DatabaseConfig.crear_archivo = True
+    DatabaseConfig.initialize_db()
+    dias = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    archivador = Archivador(SqliteArchivoRepository(), retencion_dias=dias,
+                            lock_path=DatabaseConfig.archive_path() + ".lock")
+    if not archivador.tomar_liderazgo():
+        sys.exit("⚠️ [ARCHIVO] Un servidor en marcha ya está archivando; no hace falta una pasada manual.")
+    print(f"✅ [ARCHIVO] {archivador.ejecutar()}")
@@ -0,0 +1,159 @@
+import bisect
+import collections
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from logic.services import IEventPublisher
+from metricas import BROKER_PUBLICACION
+
+
+def _id_evento(entrada: Tuple[int, dict]) -> int:
+    return entrada[0]
+
+
+class ColaSuscriptor:
+    """
+    Cola acotada de un cliente SSE. put() nunca bloquea a quien reparte:
+    si el cliente no da abasto, se descarta el evento más viejo (el cliente puede
+    recuperarlo reconectando con Last-Event-ID mientras siga en el buffer de replay).
+    """
+
+    def __init__(self, max_pendientes: int = 100):
+        self._eventos = collections.deque(maxlen=max_pendientes)
+        self._cond = threading.Condition()
+        self.descartados = 0
+
+    def put(self, msg) -> None:
+        with self._cond:
+            if len(self._eventos) == self._eventos.maxlen:
+                self.descartados += 1
+            self._eventos.append(msg)
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None):
+        """Siguiente evento, o None si pasó 'timeout' sin novedades."""
+        with self._cond:
+            if not self._eventos and not self._cond.wait_for(lambda: self._eventos, timeout):
+                return None
+            return self._eventos.popleft()
+
+    def qsize(self) -> int:
+        return len(self._eventos)
+
+
+class InMemoryMessageBroker(IEventPublisher):
+    """
+    Pub/Sub dentro del proceso, sin RabbitMQ (HOSPITAL_BROKER=memoria).
+
+    Mismo contrato que RabbitMQMessageBroker: routing_key 'medico.{id}',
+    suscribir/desuscribir por médico con colas acotadas y replay por Last-Event-ID.
+    Solo llega a los suscriptores del mismo proceso: sirve para una instalación
+    de un solo nodo y para benchmarks, no para varios workers (prefork.py).
+
+    - Replay: los eventos con 'evento_id' (id del outbox, creciente) se guardan en un
+      buffer circular por médico; al reconectar, el cliente SSE recibe los que tengan
+      id mayor a su Last-Event-ID. Un id repetido (entrega at-least-once) se descarta.
+    """
+
+    REPLAY_POR_MEDICO = 256  # Eventos recientes que se guardan por médico
+    ETIQUETA = 'MEMORIA'
+
+    def __init__(self):
+        # Suscriptores SSE por médico. Agregar/quitar una cola es O(1).
+        # Diccionario: { medico_id: { cola, ... } }
+        self._active_subscriptions: Dict[int, set] = {}
+        self._subs_lock = threading.Lock()
+        # Buffer de replay por médico: [(evento_id, msg), ...] ordenado por id
+        self._recientes: Dict[int, List[Tuple[int, dict]]] = {}
+
+    @staticmethod
+    def routing_key(mensaje: dict) -> str:
+        return f"medico.{mensaje.get('medico_id')}"
+
+    def publicar_evento(self, topico: str, mensaje: dict) -> None:
+        inicio = time.perf_counter()
+        self.enrutar(self.routing_key(mensaje), mensaje)
+        BROKER_PUBLICACION.observar(time.perf_counter() - inicio, "memoria")
+
+    def cerrar(self):
+        pass
+
+    def metrics(self) -> dict:
+        """Suscriptores SSE activos (por médico y en total) y eventos descartados por clientes lentos."""
+        with self._subs_lock:
+            colas = [c for subs in self._active_subscriptions.values() for c in subs]
+            medicos = len(self._active_subscriptions)
+        return {
+            "suscriptores": len(colas),
+            "medicos_suscritos": medicos,
+            "sse_descartados": sum(getattr(c, 'descartados', 0) for c in colas),
+        }
+
+    def enrutar(self, routing_key: str, msg: dict) -> None:
+        """Entrega un mensaje recibido con routing_key 'medico.{id}' a los suscriptores de ese médico."""
+        try:
+            medico_id = int(routing_key.rsplit('.', 1)[1])
+        except (ValueError, IndexError):
+            print(f"❌ [{self.ETIQUETA}] Mensaje ignorado ({routing_key})")
+            return
+        self._despachar(medico_id, msg)
+
+    def suscribir(self, medico_id: int, cola=None, desde_id: Optional[int] = None) -> ColaSuscriptor:
+        """
+        Registra una cola acotada para los eventos del médico.
+        Devuelve la cola para que el controlador la consuma (SSE).
+        'cola' permite pasar cualquier objeto con put(msg) thread-safe y que no
+        bloquee (p. ej. el adaptador asyncio de async_server.py).
+        'desde_id' (Last-Event-ID) encola primero los eventos guardados posteriores a ese id.
+        """
+        python_q = cola if cola is not None else ColaSuscriptor()
+        with self._subs_lock:
+            # Replay y alta bajo el mismo lock: ningún evento se pierde ni llega dos veces
+            if desde_id is not None:
+                recientes = self._recientes.get(medico_id, [])
+                for _, msg in recientes[bisect.bisect_right(recientes, desde_id, key=_id_evento):]:
+                    python_q.put(msg)
+            self._active_subscriptions.setdefault(medico_id, set()).add(python_q)
+
+        print(f"📡 [{self.ETIQUETA}] Suscriptor agregado para Médico {medico_id}")
+        return python_q
+
+    def desuscribir(self, medico_id: int, q) -> None:
+        """
+        Quita la cola del suscriptor. Es idempotente y seguro desde cualquier hilo.
+        """
+        with self._subs_lock:
+            subs = self._active_subscriptions.get(medico_id)
+            if subs is None or q not in subs:
+                return
+            subs.discard(q)
+            if not subs:
+                del self._active_subscriptions[medico_id]
+        print(f"🔕 [{self.ETIQUETA}] Suscriptor removido para Médico {medico_id}")
+
+    def _guardar_reciente(self, medico_id: int, msg: dict) -> bool:
+        """Agrega el evento al buffer de replay (con _subs_lock tomado). False si es repetido."""
+        evento_id = msg.get('evento_id')
+        if evento_id is None:
+            return True
+        recientes = self._recientes.setdefault(medico_id, [])
+        # Normalmente llega en orden (append); un reintento viejo se inserta en su lugar
+        pos = bisect.bisect_left(recientes, evento_id, key=_id_evento)
+        if pos < len(recientes) and recientes[pos][0] == evento_id:
+            return False
+        if len(recientes) >= self.REPLAY_POR_MEDICO and pos == 0:
+            return True  # Más viejo que todo lo guardado: se entrega, pero no se guarda
+        recientes.insert(pos, (evento_id, msg))
+        if len(recientes) > self.REPLAY_POR_MEDICO:
+            del recientes[0]
+        return True
+
+    def _despachar(self, medico_id: int, msg: dict) -> None:
+        # Copia bajo lock; los put() se hacen fuera para no bloquear (des)suscripciones
+        with self._subs_lock:
+            if not self._guardar_reciente(medico_id, msg):
+                return
+            destinos = list(self._active_subscriptions.get(medico_id, ()))
+        for python_q in destinos:
+            python_q.put(msg)
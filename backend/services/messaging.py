@@ -1,28 +1,217 @@
 import queue
 import json
 import threading
+import collections
+import time
 import pika
-from typing import Dict
-from logic.services import IEventPublisher
+from typing import Callable, Optional
+from services.memoria import InMemoryMessageBroker, ColaSuscriptor
+from metricas import BROKER_PUBLICACION
 
-class RabbitMQMessageBroker(IEventPublisher):
+
+class RabbitMQPublisher:
+    """
+    Publicador persistente con un hilo de I/O dedicado.
+
+    - Una sola conexión/canal (pika.SelectConnection), que solo toca el ioloop
+      de este hilo. El exchange se declara una vez por conexión.
+    - Los requests solo encolan en memoria y nunca bloquean en el broker.
+    - Cada 'flush_interval' segundos el hilo publica un lote sin esperar acks
+      uno por uno: con publisher confirms asíncronos cada mensaje queda en
+      '_sin_confirmar' por su delivery tag hasta que llega el Basic.Ack (que
+      puede confirmar varios juntos con 'multiple'). Como máximo 'batch_size'
+      mensajes sin confirmar a la vez.
+    - Un Basic.Nack, o una conexión que se cae con mensajes sin confirmar,
+      los devuelve a '_reintentos', que se publican primero tras reconectar
+      (con backoff exponencial).
+    """
+
+    def __init__(self, host: str, exchange: str,
+                 flush_interval: float = 0.05, batch_size: int = 100,
+                 max_pendientes: int = 10000, max_backoff: float = 30.0):
+        self.host = host
+        self.exchange = exchange
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self._cola = queue.Queue(maxsize=max_pendientes)
+        self._reintentos = collections.deque()  # Nackeados o sin confirmar al caerse la conexión
+        self._sin_confirmar = {}                # delivery tag -> mensaje publicado esperando ack
+        self._ultimo_tag = 0                    # Los tags cuentan desde 1 en cada canal nuevo
+        self._stop_event = threading.Event()
+        self._connection = None
+        self._channel = None
+        self._lock = threading.Lock()
+        self._stats = {"encolados": 0, "publicados": 0, "descartados": 0, "errores": 0, "reconexiones": 0,
+                       "rechazados": 0}
+        self._thread = threading.Thread(target=self._run, name="rabbitmq-publisher", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, routing_key: str, body: str,
+                al_confirmar: Optional[Callable[[], None]] = None) -> None:
+        """
+        'al_confirmar' se invoca desde el hilo de I/O cuando el broker confirmó
+        el mensaje. Si se descarta o nunca se confirma, no se llama.
+        """
+        try:
+            self._cola.put_nowait((routing_key, body, al_confirmar, time.perf_counter()))
+            self._incrementar("encolados")
+        except queue.Full:
+            self._incrementar("descartados")
+            print(f"❌ [RABBITMQ] Cola de publicación llena, evento descartado ({routing_key})")
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {**self._stats,
+                    "pendientes": self._cola.qsize() + len(self._reintentos) + len(self._sin_confirmar)}
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Detiene el hilo intentando antes vaciar lo que quede en la cola."""
+        self._stop_event.set()
+        self._thread.join(timeout)
+
+    def _incrementar(self, clave: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[clave] += n
+
+    def _terminado(self) -> bool:
+        return (self._stop_event.is_set() and self._cola.empty()
+                and not self._reintentos and not self._sin_confirmar)
+
+    # --- Hilo de I/O ---
+    def _run(self) -> None:
+        backoff = 0.5
+        while not self._terminado():
+            self._connection = pika.SelectConnection(
+                pika.ConnectionParameters(host=self.host),
+                on_open_callback=self._al_abrir_conexion,
+                on_open_error_callback=self._al_fallar_conexion,
+                on_close_callback=self._al_cerrar_conexion)
+            # Corre hasta que la conexión se cierra (por error o porque ya no queda nada)
+            self._connection.ioloop.start()
+            if self._channel is not None:
+                backoff = 0.5  # Llegó a publicar: la próxima caída arranca el backoff de cero
+            self._connection = None
+            self._channel = None
+            if self._terminado():
+                break
+            self._incrementar("errores")
+            self._incrementar("reconexiones")
+            if self._stop_event.wait(backoff):
+                # Cerrando y sin broker: no tiene sentido seguir reintentando
+                break
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _al_abrir_conexion(self, connection) -> None:
+        connection.channel(on_open_callback=self._al_abrir_canal)
+
+    def _al_fallar_conexion(self, connection, error) -> None:
+        print(f"❌ [RABBITMQ] No se pudo conectar el publicador: {error}")
+        connection.ioloop.stop()
+
+    def _al_cerrar_conexion(self, connection, motivo) -> None:
+        if self._sin_confirmar:
+            print(f"❌ [RABBITMQ] Conexión cerrada con {len(self._sin_confirmar)} mensajes sin confirmar: {motivo}")
+            self._devolver_sin_confirmar()
+        connection.ioloop.stop()
+
+    def _al_abrir_canal(self, channel) -> None:
+        channel.add_on_close_callback(self._al_cerrar_canal)
+        channel.exchange_declare(exchange=self.exchange, exchange_type='topic',
+                                 callback=lambda _frame: self._activar_confirms(channel))
+
+    def _al_cerrar_canal(self, channel, motivo) -> None:
+        # Sin canal no hay nada que hacer con la conexión: cerrarla dispara la reconexión
+        self._devolver_sin_confirmar()
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+
+    def _activar_confirms(self, channel) -> None:
+        self._ultimo_tag = 0
+        channel.confirm_delivery(ack_nack_callback=self._al_confirmar)
+        self._channel = channel
+        print("📡 [RABBITMQ] Publicador conectado.")
+        self._publicar_lote()
+
+    def _tomar_siguiente(self):
+        if self._reintentos:
+            return self._reintentos.popleft()
+        try:
+            return self._cola.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _publicar_lote(self) -> None:
+        """Publica sin esperar acks hasta llenar la ventana y se reprograma."""
+        if self._channel is None or not self._channel.is_open:
+            return
+        while len(self._sin_confirmar) < self.batch_size:
+            mensaje = self._tomar_siguiente()
+            if mensaje is None:
+                break
+            routing_key, body, _, _ = mensaje
+            self._channel.basic_publish(exchange=self.exchange, routing_key=routing_key, body=body)
+            self._ultimo_tag += 1
+            self._sin_confirmar[self._ultimo_tag] = mensaje
+        if self._terminado():
+            self._connection.close()
+            return
+        self._connection.ioloop.call_later(self.flush_interval, self._publicar_lote)
+
+    def _al_confirmar(self, frame) -> None:
+        """Basic.Ack / Basic.Nack: con 'multiple' confirma todos los tags hasta el indicado."""
+        metodo = frame.method
+        if metodo.multiple:
+            tags = [tag for tag in self._sin_confirmar if tag <= metodo.delivery_tag]
+        else:
+            tags = [metodo.delivery_tag] if metodo.delivery_tag in self._sin_confirmar else []
+        mensajes = [self._sin_confirmar.pop(tag) for tag in sorted(tags)]
+        if isinstance(metodo, pika.spec.Basic.Nack):
+            self._incrementar("rechazados", len(mensajes))
+            print(f"❌ [RABBITMQ] El broker rechazó {len(mensajes)} mensajes, se reintentan")
+            self._reintentos.extend(mensajes)
+            return
+        self._incrementar("publicados", len(mensajes))
+        ahora = time.perf_counter()
+        for _, _, al_confirmar, encolado_en in mensajes:
+            BROKER_PUBLICACION.observar(ahora - encolado_en, "rabbitmq")
+            if al_confirmar is not None:
+                try:
+                    al_confirmar()
+                except Exception as e:
+                    print(f"❌ [RABBITMQ] Error en callback de confirmación: {e}")
+
+    def _devolver_sin_confirmar(self) -> None:
+        """Lo publicado y no confirmado vuelve adelante de la cola, en el orden original."""
+        self._reintentos.extendleft(self._sin_confirmar[tag] for tag in sorted(self._sin_confirmar, reverse=True))
+        self._sin_confirmar.clear()
+
+class RabbitMQMessageBroker(InMemoryMessageBroker):
     """
     Adapter para RabbitMQ.
     Implementa el patrón Pub/Sub usando un Exchange tipo 'Topic'.
     
     Arquitectura:
-    - Publicar: Envía mensaje al Exchange 'hospital_events' con routing_key 'medico.{id}'
-    - Suscribir: Crea una cola temporal en RabbitMQ, la une al Exchange y 
-      usa un hilo para pasar mensajes a la queue.Queue de Python.
+    - Publicar: Encola el mensaje; un hilo con conexión persistente lo envía al
+      Exchange 'hospital_events' con routing_key 'medico.{id}'
+    - Suscribir: Un único consumidor por proceso (cola temporal unida a 'medico.*')
+      reparte cada mensaje en memoria a las colas acotadas (ColaSuscriptor) de ese médico.
+      El reparto local y el replay por Last-Event-ID son los de InMemoryMessageBroker.
     """
 
     EXCHANGE_NAME = 'hospital_events'
+    BINDING_KEY = 'medico.*'
+    ETIQUETA = 'RABBITMQ'
 
     def __init__(self, host='localhost'):
+        super().__init__()
         self.host = host
-        # Mantenemos referencia a los hilos de escucha para poder cerrarlos si es necesario
-        # Diccionario: { medico_id: [ { 'queue': python_queue, 'thread': thread_obj, 'stop_event': event } ] }
-        self._active_subscriptions: Dict[int, list] = {}
+        # Consumidor compartido: se arranca con la primera suscripción
+        self._consumer_thread = None
+        self._consumer_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        # Conexión de publicación de larga vida (hilo de I/O propio)
+        self._publisher = RabbitMQPublisher(host, self.EXCHANGE_NAME)
 
     def _get_connection(self):
         """Crea una conexión nueva a RabbitMQ."""
@@ -31,110 +220,74 @@ class RabbitMQMessageBroker(IEventPublisher):
 
     def publicar_evento(self, topico: str, mensaje: dict) -> None:
         """
-        Abre conexión momentánea, publica al Exchange y cierra.
+        Encola el evento en el publicador persistente y retorna de inmediato.
+        Sin print por evento: los encolados y descartados se cuentan en metrics().
         """
-        destinatario_id = mensaje.get('medico_id')
-        routing_key = f"medico.{destinatario_id}"
-        
-        try:
-            connection = self._get_connection()
-            channel = connection.channel()
-            
-            # Declarar el exchange (si no existe) tipo 'topic'
-            channel.exchange_declare(exchange=self.EXCHANGE_NAME, exchange_type='topic')
-            
-            # Publicar
-            body = json.dumps(mensaje)
-            channel.basic_publish(
-                exchange=self.EXCHANGE_NAME,
-                routing_key=routing_key,
-                body=body
-            )
-            
-            print(f"📣 [RABBITMQ] Enviado a {routing_key}: {mensaje['tipo']}")
-            connection.close()
-        except Exception as e:
-            print(f"❌ [RABBITMQ] Error publicando: {e}")
-
-    def suscribir(self, medico_id: int) -> queue.Queue:
-        """
-        Inicia un hilo que escucha a RabbitMQ y vuelca los datos en una cola thread-safe de Python.
-        Devuelve la cola de Python para que el controlador la consuma (SSE).
-        """
-        python_q = queue.Queue()
-        stop_event = threading.Event()
-        
-        # Iniciamos el consumidor en un hilo separado para no bloquear el servidor web
-        listener_thread = threading.Thread(
-            target=self._rabbit_consumer_worker,
-            args=(medico_id, python_q, stop_event),
-            daemon=True
-        )
-        listener_thread.start()
-
-        # Guardar referencia para poder limpiar después
-        if medico_id not in self._active_subscriptions:
-            self._active_subscriptions[medico_id] = []
-        
-        self._active_subscriptions[medico_id].append({
-            'queue': python_q,
-            'thread': listener_thread,
-            'stop_event': stop_event
-        })
-
-        print(f"📡 [RABBITMQ] Listener iniciado para Médico {medico_id}")
+        self._publisher.enqueue(self.routing_key(mensaje), json.dumps(mensaje))
+
+    def publicar_confirmado(self, topico: str, mensaje: dict, al_confirmar: Callable[[], None]) -> None:
+        """Como publicar_evento, pero avisa cuando RabbitMQ confirmó (publisher confirms)."""
+        self._publisher.enqueue(self.routing_key(mensaje), json.dumps(mensaje), al_confirmar)
+
+    def metrics(self) -> dict:
+        return {**super().metrics(), **self._publisher.metrics()}
+
+    def cerrar(self):
+        """Vacía la cola de publicación y detiene el consumidor (apagado ordenado)."""
+        self._stop_event.set()
+        self._publisher.close()
+
+    def suscribir(self, medico_id: int, cola=None, desde_id: Optional[int] = None) -> ColaSuscriptor:
+        python_q = super().suscribir(medico_id, cola, desde_id)
+        with self._consumer_lock:
+            if self._consumer_thread is None:
+                self._consumer_thread = threading.Thread(
+                    target=self._rabbit_consumer_worker, name="rabbitmq-consumer", daemon=True
+                )
+                self._consumer_thread.start()
         return python_q
 
-    def desuscribir(self, medico_id: int, q: queue.Queue):
-        """
-        Señaliza al hilo que debe detenerse y limpia referencias.
-        """
-        if medico_id in self._active_subscriptions:
-            subs = self._active_subscriptions[medico_id]
-            # Buscar la suscripción específica que corresponde a esa cola
-            target_sub = next((s for s in subs if s['queue'] == q), None)
-            
-            if target_sub:
-                print(f"🔕 [RABBITMQ] Deteniendo listener para Médico {medico_id}...")
-                target_sub['stop_event'].set() # Señal para detener el bucle del hilo
-                # Nota: El hilo morirá cuando intente leer de Rabbit y detecte el evento o timeout
-                subs.remove(target_sub)
-                
-            if not self._active_subscriptions[medico_id]:
-                del self._active_subscriptions[medico_id]
-
-    def _rabbit_consumer_worker(self, medico_id: int, python_q: queue.Queue, stop_event: threading.Event):
+    def _rabbit_consumer_worker(self):
         """
-        Lógica que corre en el hilo secundario:
-        Conecta a RabbitMQ -> Crea cola temporal -> Consume -> Pone en Python Queue
+        Lógica que corre en el hilo consumidor compartido:
+        Conecta a RabbitMQ -> Crea cola temporal 'medico.*' -> Consume -> Reparte por medico_id.
+        Si la conexión se cae, reintenta con backoff.
         """
-        routing_key = f"medico.{medico_id}"
-        connection = None
-        try:
-            connection = self._get_connection()
-            channel = connection.channel()
-            
-            channel.exchange_declare(exchange=self.EXCHANGE_NAME, exchange_type='topic')
-            
-            # Cola exclusiva y temporal (se borra al desconectar)
-            result = channel.queue_declare(queue='', exclusive=True, auto_delete=True)
-            queue_name = result.method.queue
-            
-            channel.queue_bind(exchange=self.EXCHANGE_NAME, queue=queue_name, routing_key=routing_key)
-            
-            # Consumo manual con timeout para poder revisar stop_event
-            for method_frame, properties, body in channel.consume(queue_name, inactivity_timeout=1):
-                if stop_event.is_set():
-                    break
-                
-                if method_frame:
-                    msg = json.loads(body)
-                    python_q.put(msg)
-                    channel.basic_ack(method_frame.delivery_tag)
-                    
-        except Exception as e:
-            print(f"❌ Error en listener de Médico {medico_id}: {e}")
-        finally:
-            if connection and connection.is_open:
-                connection.close()
-            print(f"🏁 Listener Médico {medico_id} finalizado.")
\ No newline at end of file
+        backoff = 0.5
+        while not self._stop_event.is_set():
+            connection = None
+            try:
+                connection = self._get_connection()
+                channel = connection.channel()
+
+                channel.exchange_declare(exchange=self.EXCHANGE_NAME, exchange_type='topic')
+
+                # Cola exclusiva y temporal (se borra al desconectar)
+                result = channel.queue_declare(queue='', exclusive=True, auto_delete=True)
+                queue_name = result.method.queue
+
+                channel.queue_bind(exchange=self.EXCHANGE_NAME, queue=queue_name, routing_key=self.BINDING_KEY)
+                print("📡 [RABBITMQ] Consumidor compartido conectado.")
+                backoff = 0.5
+
+                # Consumo manual con timeout para poder revisar stop_event
+                for method_frame, properties, body in channel.consume(queue_name, inactivity_timeout=1, auto_ack=True):
+                    if self._stop_event.is_set():
+                        break
+
+                    if method_frame:
+                        try:
+                            msg = json.loads(body)
+                        except ValueError:
+                            print(f"❌ [RABBITMQ] Mensaje ignorado ({method_frame.routing_key})")
+                            continue
+                        self.enrutar(method_frame.routing_key, msg)
+
+            except Exception as e:
+                print(f"❌ Error en consumidor compartido: {e}")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if connection and connection.is_open:
+                    connection.close()
+        print("🏁 Consumidor compartido finalizado.")
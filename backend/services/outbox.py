@@ -0,0 +1,115 @@
+import threading
+import time
+from typing import Dict, List
+
+from data.repositories import IOutboxRepository
+from logic.services import IEventPublisher
+
+
+class OutboxRelay:
+    """
+    Hilo que vacía la tabla 'outbox' hacia el broker (entrega at-least-once).
+
+    - Reclama lotes con un lease: mientras dura, ningún otro relay los toma.
+    - Cada evento se publica con confirmación; solo los confirmados se borran.
+    - Lo que no se confirma (broker caído, cola llena, proceso que muere) vuelve
+      a estar listo cuando vence el lease, con backoff exponencial por intento.
+    - Los ids entregados al publicador y aún sin confirmar quedan 'en vuelo': si
+      se vuelven a reclamar no se reenvían (el publicador ya los tiene y los
+      reintenta solo), y con 'max_en_vuelo' sin confirmar se deja de reclamar.
+      Así un broker caído no llena la cola del publicador con copias del mismo
+      evento. Pasados 'vencimiento_en_vuelo' segundos se dan por perdidos
+      (p. ej. descartados por cola llena) y se vuelven a enviar.
+    Los consumidores pueden recibir duplicados y deben tolerarlos.
+    """
+
+    def __init__(self, outbox_repo: IOutboxRepository, publisher: IEventPublisher,
+                 poll_interval: float = 0.2, batch_size: int = 100, lease: float = 5.0,
+                 max_en_vuelo: int = 1000, vencimiento_en_vuelo: float = 300.0):
+        self.outbox_repo = outbox_repo
+        self.publisher = publisher
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_en_vuelo = max_en_vuelo
+        self.vencimiento_en_vuelo = vencimiento_en_vuelo
+        self._confirmados: List[int] = []  # Ids confirmados aún no borrados de SQLite
+        self._en_vuelo: Dict[int, float] = {}  # Id entregado al publicador -> cuándo (monotonic)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._stats = {"reclamados": 0, "confirmados": 0, "errores": 0, "omitidos_en_vuelo": 0}
+        self._thread = threading.Thread(target=self._run, name="outbox-relay", daemon=True)
+
+    def iniciar(self) -> None:
+        self._thread.start()
+        print("📮 [OUTBOX] Relay iniciado.")
+
+    def detener(self, timeout: float = 5.0) -> None:
+        """Deja de reclamar eventos nuevos (las confirmaciones en vuelo se siguen anotando)."""
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def cerrar(self, timeout: float = 5.0) -> None:
+        self.detener(timeout)
+        # Lo ya confirmado no debe reenviarse en el próximo arranque
+        self._borrar_confirmados()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {**self._stats, "por_borrar": len(self._confirmados), "en_vuelo": len(self._en_vuelo)}
+
+    def _al_confirmar(self, evento_id: int):
+        def callback():
+            with self._lock:
+                self._en_vuelo.pop(evento_id, None)
+                self._confirmados.append(evento_id)
+                self._stats["confirmados"] += 1
+        return callback
+
+    def _borrar_confirmados(self) -> None:
+        with self._lock:
+            ids, self._confirmados = self._confirmados, []
+        try:
+            self.outbox_repo.confirmar(ids)
+        except Exception as e:
+            # Se reintenta en la próxima vuelta; a lo sumo habrá un duplicado
+            with self._lock:
+                self._confirmados.extend(ids)
+                self._stats["errores"] += 1
+            print(f"❌ [OUTBOX] No se pudieron borrar eventos confirmados: {e}")
+
+    def _ciclo(self) -> int:
+        """Una vuelta del relay. Devuelve cuántos eventos se reclamaron."""
+        self._borrar_confirmados()
+        with self._lock:
+            ahora = time.monotonic()
+            for evento_id in [i for i, desde in self._en_vuelo.items() if ahora - desde > self.vencimiento_en_vuelo]:
+                del self._en_vuelo[evento_id]
+            if len(self._en_vuelo) >= self.max_en_vuelo:
+                return 0  # El publicador no confirma (broker caído): esperar antes de reclamar más
+        lote = self.outbox_repo.reclamar(self.batch_size, self.lease)
+        with self._lock:
+            nuevos = [evento for evento in lote if evento[0] not in self._en_vuelo]
+            for evento_id, _, _ in nuevos:
+                self._en_vuelo[evento_id] = ahora
+            self._stats["reclamados"] += len(lote)
+            self._stats["omitidos_en_vuelo"] += len(lote) - len(nuevos)
+        for evento_id, topico, mensaje in nuevos:
+            # El id del outbox viaja con el evento: es creciente y sirve como id SSE
+            mensaje["evento_id"] = evento_id
+            self.publisher.publicar_confirmado(topico, mensaje, self._al_confirmar(evento_id))
+        return len(lote)
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                reclamados = self._ciclo()
+            except Exception as e:
+                with self._lock:
+                    self._stats["errores"] += 1
+                print(f"❌ [OUTBOX] Error en el relay: {e}")
+                reclamados = 0
+            # Lote lleno: probablemente hay más esperando, seguir sin dormir
+            if reclamados < self.batch_size:
+                self._stop_event.wait(self.poll_interval)
@@ -0,0 +1,215 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+import data.database as database
+from data.database import DatabaseConfig
+from data.repositories import (SqliteArchivoRepository, SqliteDisponibilidadRepository, SqliteMedicoRepository,
+                               SqliteTurnosRepository)
+from logic.dtos import (AgendarTurnoDTO, AgendarTurnosLoteDTO, AgregarDisponibilidadLoteDTO, AnularTurnosLoteDTO,
+                        CrearMedicoDTO)
+from logic.indice_horarios import IndiceHorarios
+from logic.services import AgendamientoService, MedicoService
+from services.archivador import Archivador
+from services.memoria import InMemoryMessageBroker
+
+PACIENTES = [("Ana", "Perez"), ("Luis", "Gomez"), ("Eva", "Diaz"), ("Juan", "Ruiz")]
+HILOS = 8
+OPERACIONES_POR_HILO = 60
+PAUSA = 0.002  # Segundos entre el commit en SQLite y la vuelta al servicio
+
+
+class _TurnosConPausa(SqliteTurnosRepository):
+    """
+    Ensancha la ventana entre el commit en SQLite y la actualización del índice.
+    Sin el lock 'escritura', otra escritura sobre el mismo horario se mete en el medio
+    y el índice queda invertido. 'puntos' detiene ahí a hilos puntuales: nombre -> (llegó, seguir).
+    """
+
+    def __init__(self):
+        self.puntos = {}
+
+    def _volver(self) -> None:
+        punto = self.puntos.get(threading.current_thread().name)
+        if punto is None:
+            time.sleep(PAUSA)
+            return
+        llego, seguir = punto
+        llego.set()
+        seguir.wait(5)
+
+    def reservar(self, *args, **kwargs):
+        resultado = super().reservar(*args, **kwargs)
+        self._volver()
+        return resultado
+
+    def reservar_lote(self, *args, **kwargs):
+        resultados = super().reservar_lote(*args, **kwargs)
+        self._volver()
+        return resultados
+
+    def anular(self, *args, **kwargs):
+        resultado = super().anular(*args, **kwargs)
+        self._volver()
+        return resultado
+
+    def anular_lote(self, *args, **kwargs):
+        resultados = super().anular_lote(*args, **kwargs)
+        self._volver()
+        return resultados
+
+
+class TestIndiceHorarios(unittest.TestCase):
+    """El índice en memoria contra SQLite, con reservas y anulaciones concurrentes sobre un mismo médico."""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.db_original, self.pool_original = database.DB_NAME, DatabaseConfig._pool
+        self.crear_archivo_original = DatabaseConfig.crear_archivo
+        database.DB_NAME = os.path.join(self.directorio, "hospital.db")
+        DatabaseConfig._pool = None
+        DatabaseConfig.crear_archivo = True
+        DatabaseConfig.initialize_db()
+        self.addCleanup(self._restaurar)
+
+        self.disp_repo = SqliteDisponibilidadRepository()
+        self.turno_repo = _TurnosConPausa()
+        self.indice = IndiceHorarios()
+        self.indice.cargar(self.disp_repo.iter_todos(), self.turno_repo.iter_activos())
+        self.medicos = MedicoService(SqliteMedicoRepository(), self.disp_repo, indice=self.indice)
+        self.agenda = AgendamientoService(self.turno_repo, self.disp_repo, InMemoryMessageBroker(),
+                                          indice=self.indice)
+        self.medico_id = self.medicos.registrar_medico(CrearMedicoDTO("Marta", "Sosa", "Clínica")).id
+
+    def _restaurar(self):
+        DatabaseConfig._pool.close_all()
+        database.DB_NAME, DatabaseConfig._pool = self.db_original, self.pool_original
+        DatabaseConfig.crear_archivo = self.crear_archivo_original
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def _cargar_horarios(self, inicio: datetime, cantidad: int) -> list:
+        fechas = [inicio + timedelta(minutes=30 * i) for i in range(cantidad)]
+        self.medicos.agregar_disponibilidad_lote(AgregarDisponibilidadLoteDTO(self.medico_id, fechas))
+        return fechas
+
+    def _diferencias(self) -> list:
+        return self.indice.diferencias(self.disp_repo.iter_todos(), self.turno_repo.iter_activos())
+
+    def _comparar_consultas(self, fechas: list) -> None:
+        """proximos_libres y paciente_ocupado responden lo mismo que las consultas SQL."""
+        for desde in fechas[::7]:
+            esperado = [d.fecha_hora for d in self.disp_repo.find_by_medico(
+                self.medico_id, desde=desde, estado="DISPONIBLE", limit=5)]
+            self.assertEqual(self.indice.proximos_libres(self.medico_id, desde, 5), esperado, desde)
+        for fecha in fechas:
+            for nombre, apellido in PACIENTES:
+                self.assertEqual(self.indice.paciente_ocupado(nombre, apellido, fecha),
+                                 self.turno_repo.existe_conflicto_paciente(nombre, apellido, fecha),
+                                 (nombre, apellido, fecha))
+
+    def _operar(self, semilla: int, fechas: list, turnos: list, errores: list) -> None:
+        azar = random.Random(semilla)
+        try:
+            for _ in range(OPERACIONES_POR_HILO):
+                nombre, apellido = azar.choice(PACIENTES)
+                operacion = azar.random()
+                try:
+                    if operacion < 0.4:
+                        dto = AgendarTurnoDTO(self.medico_id, nombre, apellido, azar.choice(fechas))
+                        turnos.append(self.agenda.agendar_turno(dto).id)
+                    elif operacion < 0.6:
+                        lote = [AgendarTurnoDTO(self.medico_id, *azar.choice(PACIENTES), azar.choice(fechas))
+                                for _ in range(4)]
+                        resultado = self.agenda.agendar_turnos_lote(AgendarTurnosLoteDTO(lote))
+                        turnos.extend(r["id"] for r in resultado["resultados"] if "id" in r)
+                    elif operacion < 0.85 and turnos:
+                        self.agenda.anular_turno(azar.choice(turnos[-4:]))
+                    elif turnos:
+                        ids = [azar.choice(turnos) for _ in range(3)]
+                        self.agenda.anular_turnos_lote(AnularTurnosLoteDTO(ids))
+                except ValueError:
+                    pass  # Rechazo de negocio (horario tomado, paciente ocupado): es parte de la carga
+        except Exception as e:
+            errores.append(e)
+
+    def _carga_concurrente(self, fechas: list) -> None:
+        turnos, errores = [], []
+        hilos = [threading.Thread(target=self._operar, args=(semilla, fechas, turnos, errores))
+                 for semilla in range(HILOS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(errores, [])
+        self.assertTrue(turnos, "la carga no confirmó ningún turno")
+
+    def test_reservas_y_anulaciones_concurrentes(self):
+        # Pocos horarios para muchos hilos: las operaciones chocan sobre los mismos slots
+        fechas = self._cargar_horarios(datetime.now().replace(minute=0, second=0, microsecond=0)
+                                       + timedelta(days=1), 12)
+        self._carga_concurrente(fechas)
+        self.assertEqual(self._diferencias(), [])
+        self._comparar_consultas(fechas)
+
+    def test_anulacion_entre_rechazo_y_sincronizacion(self):
+        """
+        A reserva el horario; B, que lo vio libre en el índice, es rechazado por SQLite;
+        C anula el turno de A. Sin orden, el marcar_ocupado de B llega después del liberar de C.
+        """
+        fecha = self._cargar_horarios(datetime.now().replace(minute=0, second=0, microsecond=0)
+                                      + timedelta(days=1), 1)[0]
+        eventos = {nombre: (threading.Event(), threading.Event()) for nombre in ("A", "B")}
+        self.turno_repo.puntos = eventos
+        turnos = []
+
+        def reservar(nombre, apellido):
+            try:
+                turnos.append(self.agenda.agendar_turno(AgendarTurnoDTO(self.medico_id, nombre, apellido, fecha)))
+            except ValueError:
+                pass
+
+        hilo_a = threading.Thread(target=reservar, args=("Ana", "Perez"), name="A")
+        hilo_b = threading.Thread(target=reservar, args=("Luis", "Gomez"), name="B")
+        hilo_a.start()
+        eventos["A"][0].wait(5)  # A confirmó en SQLite, el índice todavía dice DISPONIBLE
+        hilo_b.start()
+        eventos["B"][0].wait(0.2)  # Con el lock, B espera a A y no llega
+        eventos["A"][1].set()
+        hilo_a.join()
+        hilo_c = threading.Thread(target=self.agenda.anular_turno, args=(turnos[0].id,), name="C")
+        hilo_c.start()
+        hilo_c.join(0.2)  # Con el lock, C espera a que B termine
+        eventos["B"][1].set()
+        for hilo in (hilo_b, hilo_c):
+            hilo.join()
+
+        # Con el lock, C puede adelantarse a B (y B reserva): cualquier orden deja índice y base iguales
+        self.assertEqual(self._diferencias(), [])
+
+    def test_descartar_anteriores_tras_archivar(self):
+        hoy = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
+        viejas = self._cargar_horarios(hoy - timedelta(days=45), 12)
+        nuevas = self._cargar_horarios(hoy + timedelta(days=1), 12)
+        self._carga_concurrente(viejas + nuevas)
+
+        archivador = Archivador(SqliteArchivoRepository(), retencion_dias=30, lote=5,
+                                al_archivar=self.indice.descartar_anteriores)
+        movidos = archivador.ejecutar()
+        self.assertEqual(movidos["disponibilidad"], len(viejas))
+        self.assertEqual(self._diferencias(), [])
+        self._comparar_consultas(viejas + nuevas)
+        self.assertEqual(self.indice.proximos_libres(self.medico_id, viejas[0], 1),
+                         self.indice.proximos_libres(self.medico_id, archivador.corte(), 1))
+        # Un horario archivado no vuelve a la tabla caliente (ni se puede reservar de nuevo)
+        self.assertEqual(self.disp_repo.save_many(self.medico_id, viejas), 0)
+        with self.assertRaises(ValueError):
+            self.agenda.agendar_turno(AgendarTurnoDTO(self.medico_id, "Ana", "Perez", viejas[-1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
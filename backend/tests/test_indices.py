@@ -0,0 +1,99 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import data.database as database
+from data.database import DatabaseConfig
+from data.migrations import consultas_con_scan, explicar_consultas, FILAS_MINIMAS_SCAN
+from data import repositories
+
+# Índice que debe usar cada consulta crítica (ver data/migrations.consultas_criticas)
+INDICES_ESPERADOS = {
+    "disponibilidad.find_by_medico": "ux_disponibilidad_medico_fecha",
+    "disponibilidad.find_by_medico (rango + cursor)": "ux_disponibilidad_medico_fecha",
+    "disponibilidad.marcar_reservada": "ux_disponibilidad_medico_fecha",
+    "disponibilidad.marcar_disponible": "ux_disponibilidad_medico_fecha",
+    "turnos.reservar (tomar horario)": "ux_disponibilidad_medico_fecha",
+    "turnos.find_by_paciente": "idx_turnos_paciente_fecha",
+    "turnos.find_by_paciente (rango + cursor)": "idx_turnos_paciente_fecha",
+    "turnos.existe_conflicto_paciente": "ux_turnos_paciente_fecha_activo",
+    "turnos.existe_conflicto_medico": "ux_turnos_medico_fecha_activo",
+    "medicos.find_by_especialidad": "idx_medicos_especialidad",
+    "archivo.turnos_vencidos": "idx_turnos_fecha",
+    "archivo.disponibilidad_vencida": "idx_disponibilidad_fecha",
+    "outbox.reclamar": "idx_outbox_disponible",
+}
+
+
+class TestPlanesDeConsultas(unittest.TestCase):
+    """EXPLAIN QUERY PLAN de las consultas críticas sobre una base nueva con todas las migraciones."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directorio = tempfile.mkdtemp()
+        cls.db_original, cls.pool_original = database.DB_NAME, DatabaseConfig._pool
+        database.DB_NAME = os.path.join(cls.directorio, "hospital.db")
+        DatabaseConfig._pool = None
+        DatabaseConfig.initialize_db()
+
+    @classmethod
+    def tearDownClass(cls):
+        DatabaseConfig._pool.close_all()
+        database.DB_NAME, DatabaseConfig._pool = cls.db_original, cls.pool_original
+        shutil.rmtree(cls.directorio, ignore_errors=True)
+
+    def _conexion(self) -> sqlite3.Connection:
+        # Sin caché de sentencias, como DatabaseConfig.verificar_indices (ver explicar_consultas)
+        conn = sqlite3.connect(database.DB_NAME, cached_statements=0)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_ninguna_consulta_critica_hace_scan(self):
+        self.assertEqual(DatabaseConfig.verificar_indices(), {})
+
+    def test_cada_consulta_usa_su_indice(self):
+        planes = explicar_consultas(self._conexion())
+        self.assertEqual(set(planes), set(INDICES_ESPERADOS))
+        for nombre, indice in INDICES_ESPERADOS.items():
+            with self.subTest(consulta=nombre):
+                self.assertTrue(any(f"INDEX {indice} " in detalle for detalle in planes[nombre]), planes[nombre])
+
+    def test_consultas_salen_de_los_repositorios(self):
+        conn = self._conexion()
+        planes = explicar_consultas(conn)
+        sql, params = repositories.SqliteTurnosRepository._consulta_por_paciente(
+            ["turnos"], "Ana", "Perez", None, None, None, None, None, None, "*")
+        plan = [fila[3] for fila in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        self.assertEqual(planes["turnos.find_by_paciente"], plan)
+
+    def test_indice_faltante_se_reporta(self):
+        conn = self._conexion()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DROP INDEX idx_medicos_especialidad")
+            problemas = consultas_con_scan(conn)
+        finally:
+            conn.rollback()
+        self.assertEqual(problemas, {"medicos.find_by_especialidad": ["SCAN medicos"]})
+
+    def test_scan_en_tabla_chica_analizada_no_se_reporta(self):
+        conn = self._conexion()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DROP INDEX idx_medicos_especialidad")
+            conn.execute("INSERT INTO medicos (nombre, apellido, especialidad) VALUES ('Ana', 'Perez', 'Clínica')")
+            conn.execute("ANALYZE main")
+            chica = consultas_con_scan(conn)
+            # Con estadísticas de una tabla grande el SCAN vuelve a ser un problema
+            conn.execute("UPDATE sqlite_stat1 SET stat = ? WHERE tbl = 'medicos'", (str(FILAS_MINIMAS_SCAN),))
+            grande = consultas_con_scan(conn)
+        finally:
+            conn.rollback()
+        self.assertEqual(chica, {})
+        self.assertIn("medicos.find_by_especialidad", grande)
+
+
+if __name__ == "__main__":
+    unittest.main()